@@ -0,0 +1,75 @@
+import hashlib
+import time
+from copy import copy
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+from core import metrics
+from core.caching import LRUCache
+
+# JWTAuthentication does 2 things on every request
+# it decodes the token and checks the signature, then it loads the user from the DB
+# an access token is valid for a day so the same token keeps coming back and
+# we keep doing exactly the same work for it
+# CachedJWTAuthentication remembers both results
+
+AUTH_CACHE = getattr(settings, 'JWT_AUTH_CACHE', {})
+
+token_cache = LRUCache(maxsize=AUTH_CACHE.get('TOKEN_CACHE_SIZE', 10000))
+# decoded tokens, keyed by the hash of the raw token
+# a token never changes so the only thing that can make an entry stale is its expiry
+
+user_cache = LRUCache(
+    maxsize=AUTH_CACHE.get('USER_CACHE_SIZE', 10000),
+    ttl=AUTH_CACHE.get('USER_CACHE_TTL', 60))
+# users, keyed by their id
+# when a user is saved or deleted we drop it from the cache (check core.signals.handlers)
+# but that only happens in the process that saved it, other processes (workers)
+# find out when the entry expires, that's why it has a short ttl
+
+metrics.register_cache('jwt_tokens', token_cache)
+metrics.register_cache('jwt_users', user_cache)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_validated_token(self, raw_token):
+        key = hashlib.sha256(raw_token).hexdigest()
+        # we don't keep the raw token around, only its hash
+        validated_token = token_cache.get(key)
+        if validated_token is not None:
+            return validated_token
+
+        validated_token = super().get_validated_token(raw_token)
+        # this raises an exception if the token is invalid or expired
+        # so we only ever cache valid tokens
+        expires_in = validated_token['exp'] - time.time()
+        token_cache.set(key, validated_token, ttl=max(expires_in, 0))
+        # the entry expires at the same time as the token does so an expired token
+        # is validated again (and rejected) instead of being served from the cache
+        return validated_token
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        user = user_cache.get(str(user_id))
+        if user is None:
+            user = super().get_user(validated_token)
+            user_cache.set(str(user_id), user)
+        else:
+            self.check_user(user, validated_token)
+        return copy(user)
+        # every request gets its own copy, so anything a request attaches to the user
+        # (like the permission cache) doesn't leak into other requests
+
+    # the same checks JWTAuthentication.get_user does after loading the user,
+    # they don't need the DB so we still run them when the user comes from the cache
+    def check_user(self, user, validated_token):
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(
+                    _("The user's password has been changed."), code='password_changed')
@@ -0,0 +1,58 @@
+import threading
+import time
+from collections import OrderedDict
+
+# a small in-process cache we use for things we look up on every request
+# (decoded tokens, users, ...). it keeps at most maxsize entries, when it's full
+# the least recently used entry is dropped, and every entry can have a time to live
+# the cache lives in the memory of each process so it's only good for
+# data that is fine to be a little stale or that we can invalidate with signals
+
+
+class LRUCache:
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # ttl is the default time to live in seconds, None means entries don't expire
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        # an OrderedDict remembers the order keys were inserted in
+        # we move a key to the end every time we read it, so the first key
+        # is always the least recently used one
+        self._lock = threading.Lock()
+        # the cache is shared by all the threads of the process
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                (value, expires_at) = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return None if entry is None else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,60 @@
+import time
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+from core.authentication import CachedJWTAuthentication, token_cache, user_cache
+
+# python manage.py bench_auth --requests 5000
+# sends the same authenticated request through a tiny view with
+# JWTAuthentication and with CachedJWTAuthentication and prints
+# requests per second and queries per request for both
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks authenticated request throughput with and without CachedJWTAuthentication'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        with transaction.atomic():
+            # the benchmark user is rolled back at the end so nothing is left in the DB
+            user = get_user_model().objects.create_user(
+                username='bench-auth', email='bench-auth@domain.com', password='bench-auth')
+            token = str(AccessToken.for_user(user))
+            for authentication_class in [JWTAuthentication, CachedJWTAuthentication]:
+                token_cache.clear()
+                user_cache.clear()
+                (elapsed, queries) = self.run(authentication_class, token, count)
+                self.stdout.write(
+                    f'{authentication_class.__name__:<26} '
+                    f'{count / elapsed:>10.0f} req/s '
+                    f'{queries / count:>6.2f} queries/req')
+            transaction.set_rollback(True)
+
+    def run(self, authentication_class, token, count):
+        class BenchView(APIView):
+            authentication_classes = [authentication_class]
+            permission_classes = [IsAuthenticated]
+
+            def get(self, request):
+                return Response({'id': request.user.id})
+
+        view = BenchView.as_view()
+        factory = APIRequestFactory()
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            for _ in range(count):
+                request = factory.get('/', HTTP_AUTHORIZATION=f'JWT {token}')
+                response = view(request)
+                assert response.status_code == 200
+            elapsed = time.perf_counter() - start
+        return (elapsed, len(context.captured_queries))
@@ -0,0 +1,101 @@
+import gzip
+import json
+import time
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from core import renderers
+from store.models import Collection, Order, OrderItem, Product
+from store.serializer import OrderSerializer, ProductSerializer2
+
+# python manage.py bench_json --products 1000 --orders 200 --repeat 20
+# serializes a page of products (ProductSerializer2) and a page of orders with their items
+# (OrderSerializer) once, then renders the data with DRF's JSONRenderer,
+# core.renderers.FastJSONRenderer and core.renderers.MessagePackRenderer and prints for each
+# the time to encode and decode it, its size (and gzipped size) and whether it decodes to
+# the same data as the JSON of JSONRenderer.
+# the rows are made in a transaction that is rolled back at the end
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the JSON and MessagePack renderers on product and order payloads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--orders', type=int, default=200)
+        parser.add_argument('--items', type=int, default=5, help='items per order')
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        if renderers.orjson is None:
+            raise CommandError('orjson is not installed, FastJSONRenderer falls back to JSONRenderer')
+        formats = [
+            (JSONRenderer(), json.loads),
+            (renderers.FastJSONRenderer(), renderers.orjson.loads),
+        ]
+        if renderers.msgpack is not None:
+            formats.append((renderers.MessagePackRenderer(), renderers.msgpack.unpackb))
+        repeat = options['repeat']
+        with transaction.atomic():
+            payloads = self.payloads(options['products'], options['orders'], options['items'])
+            self.stdout.write(
+                f'{"payload":<10} {"renderer":<20} {"encode ms":>10} {"decode ms":>10} '
+                f'{"bytes":>10} {"gzipped":>10}  same as JSONRenderer')
+            for (name, data) in payloads:
+                expected = JSONRenderer().render(data)
+                for (renderer, decode) in formats:
+                    (encode_time, content) = self.run(lambda: renderer.render(data, renderer.media_type), repeat)
+                    (decode_time, decoded) = self.run(lambda: decode(content), repeat)
+                    self.stdout.write(
+                        f'{name:<10} {type(renderer).__name__:<20} {encode_time * 1000:>10.3f} '
+                        f'{decode_time * 1000:>10.3f} {len(content):>10} {len(gzip.compress(content)):>10}  '
+                        f'{self.same(content, decoded, expected)}')
+            transaction.set_rollback(True)
+
+    def same(self, content, decoded, expected):
+        if content == expected:
+            return 'bytes'
+        return 'values' if decoded == json.loads(expected) else 'NO'
+        # values means it's another format or the JSON only differs in how a number is written
+
+    def run(self, fn, repeat):
+        best = None
+        for _ in range(max(repeat, 1)):
+            start = time.perf_counter()
+            result = fn()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+            # the fastest run, the others are slowed down by whatever else the machine does
+        return (best, result)
+
+    def payloads(self, product_count, order_count, item_count):
+        collection = Collection.objects.create(title='bench-json')
+        Product.objects.bulk_create([
+            Product(title=f'Bench product {i} – édition spéciale', slug=f'bench-json-{i}',
+                    description='A product made by bench_json ' * 4,
+                    unit_price=Decimal('1.99') + i % 500, inventory=i % 100, collection=collection)
+            for i in range(product_count)
+        ])
+        products = list(Product.objects.filter(collection=collection).order_by('id'))
+        for (i, product) in enumerate(products):
+            product.like_count = i % 7
+            product.liked_by_me = i % 3 == 0
+            # what ProductViewSet annotates
+        user = get_user_model().objects.create_user(
+            username='bench-json', email='bench-json@domain.com', password='bench-json')
+        orders = Order.objects.bulk_create([Order(customer=user.customer) for _ in range(order_count)])
+        if not all(order.pk for order in orders):
+            orders = list(Order.objects.filter(customer=user.customer).order_by('id'))
+            # not every DB gives the ids of bulk_create back
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=products[(i + j) % len(products)], quantity=j + 1,
+                      unit_price=products[(i + j) % len(products)].unit_price)
+            for (i, order) in enumerate(orders) for j in range(item_count)
+        ])
+        orders = Order.objects.filter(customer=user.customer).prefetch_related('items__product')
+        return [
+            ('products', ProductSerializer2(products, many=True).data),
+            ('orders', OrderSerializer(orders, many=True).data),
+        ]
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from core import slow_queries
+
+# python manage.py slow_queries                       the queries with the most total time
+# python manage.py slow_queries --order p95 --limit 5 --explain
+# python manage.py slow_queries --reset               forget everything recorded so far
+# reads what the web processes recorded (check core/slow_queries.py)
+
+
+class Command(BaseCommand):
+    help = 'Reports the query fingerprints with the most time, their p95, callers and EXPLAIN'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--order', choices=slow_queries.ORDERS, default='total')
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--explain', action='store_true', help='print the EXPLAIN of slow queries')
+        parser.add_argument('--reset', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            slow_queries.reset()
+            self.stdout.write('slow query stats removed')
+            return
+        rows = slow_queries.report(options['order'], options['limit'])
+        if not rows:
+            self.stdout.write('no queries recorded yet')
+            return
+        self.stdout.write(
+            f'{"id":<12} {"count":>8} {"total ms":>12} {"mean ms":>10} {"p95 ms":>10} {"max ms":>10} {"slow":>6}')
+        for row in rows:
+            self.stdout.write(
+                f'{row["id"]:<12} {row["count"]:>8} {row["total_ms"]:>12.3f} {row["mean_ms"]:>10.3f} '
+                f'{row["p95_ms"]:>10.3f} {row["max_ms"]:>10.3f} {row["slow"]:>6}')
+            self.stdout.write(f'    {row["fingerprint"]}')
+            for (where, count) in row['sources']:
+                self.stdout.write(f'    {count:>6}x {where}')
+            if options['explain'] and row['explain']:
+                self.stdout.write(f'    EXPLAIN ({row["explain"]["ms"]} ms, params {row["explain"]["params"]})')
+                for line in row['explain']['plan'].splitlines():
+                    self.stdout.write(f'        {line}')
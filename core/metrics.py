@@ -0,0 +1,321 @@
+import json
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+# runtime metrics in the Prometheus text format, served at /metrics/ (check core.views)
+# for every route (the view name the url resolved to) we count the requests and keep
+# histograms of their latency, response size and the number and time of their DB queries
+#     http_request_duration_seconds_bucket{route="store:products-list",method="GET",le="0.1"} 42
+# the queries are timed with connection.execute_wrapper, the in-process caches
+# (core.caching.LRUCache) report their hits and misses with register_cache()
+#
+# recording a request is a few dict updates under one lock, the text is only
+# built when prometheus scrapes the endpoint.
+# every process counts its own requests. with more than one worker set
+# METRICS['MULTIPROCESS_DIR'] so each one writes its numbers to <dir>/metrics.<pid>.json
+# every FLUSH_SECONDS and the endpoint adds up the files of all of them.
+# the file of a worker that exited is deleted by the next scrape, otherwise its last numbers
+# would be added forever (prometheus sees the counters go down, which it reads as a restart)
+
+METRICS = getattr(settings, 'METRICS', {})
+ENABLED = METRICS.get('ENABLED', True)
+LATENCY_BUCKETS = tuple(METRICS.get(
+    'LATENCY_BUCKETS', (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)))
+SIZE_BUCKETS = tuple(METRICS.get('SIZE_BUCKETS', (100, 1000, 10000, 100000, 1000000, 10000000)))
+QUERY_BUCKETS = tuple(METRICS.get('QUERY_BUCKETS', (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)))
+MULTIPROCESS_DIR = METRICS.get('MULTIPROCESS_DIR')
+FLUSH_SECONDS = METRICS.get('FLUSH_SECONDS', 15)
+
+lock = threading.Lock()
+# one lock for all the metrics, a request takes it once to record everything
+registry = {}
+# metric name -> Metric, in the order they are shown
+
+
+class Metric:
+    def __init__(self, kind, name, help, labelnames, buckets=None):
+        self.kind = kind
+        # counter, gauge or histogram
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = buckets
+        self.values = {}
+        # label values (a tuple) -> a number, or for a histogram a list with the count
+        # of every bucket (the last one is +Inf) followed by the sum of the observed values
+        registry[name] = self
+
+    # the _ mtds expect the caller to hold the lock
+    def _inc(self, labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def _observe(self, labels, value):
+        counts = self.values.get(labels)
+        if counts is None:
+            counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        # the first bucket whose upper bound is >= value, len(buckets) is +Inf
+        counts[-1] += value
+
+    def inc(self, labels, amount=1):
+        with lock:
+            self._inc(labels, amount)
+
+    def observe(self, labels, value):
+        with lock:
+            self._observe(labels, value)
+
+    def set(self, labels, value):
+        with lock:
+            self.values[labels] = value
+
+
+requests_total = Metric(
+    'counter', 'http_requests_total', 'Requests by route, method and status.',
+    ['route', 'method', 'status'])
+request_duration = Metric(
+    'histogram', 'http_request_duration_seconds', 'Time to build the response.',
+    ['route', 'method'], LATENCY_BUCKETS)
+response_size = Metric(
+    'histogram', 'http_response_size_bytes', 'Size of the response body, streaming responses are not counted.',
+    ['route'], SIZE_BUCKETS)
+request_queries = Metric(
+    'histogram', 'db_queries_per_request', 'Number of DB queries run by a request.',
+    ['route'], QUERY_BUCKETS)
+request_query_duration = Metric(
+    'histogram', 'db_query_duration_seconds_per_request', 'Time a request spent waiting for the DB.',
+    ['route'], LATENCY_BUCKETS)
+cache_hits = Metric('counter', 'cache_hits_total', 'In-process cache hits.', ['cache'])
+cache_misses = Metric('counter', 'cache_misses_total', 'In-process cache misses.', ['cache'])
+cache_entries = Metric('gauge', 'cache_entries', 'Entries in the in-process cache.', ['cache'])
+db_connections = Metric(
+    'gauge', 'db_server_connections', 'Connections the DB server reports, by state.', ['alias', 'state'])
+
+caches = {}
+# name -> LRUCache
+
+
+def register_cache(name, cache):
+    # anything with hits, misses and a len(), e.g core.caching.LRUCache
+    caches[name] = cache
+
+
+def record_request(route, method, status, seconds, size, queries, query_seconds):
+    with lock:
+        requests_total._inc((route, method, str(status)))
+        request_duration._observe((route, method), seconds)
+        if size is not None:
+            response_size._observe((route,), size)
+        request_queries._observe((route,), queries)
+        request_query_duration._observe((route,), query_seconds)
+
+
+class QueryTimer:
+    # the execute_wrapper of the DB connections, runs around every query of the request
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.queries += 1
+
+
+class MetricsMiddleware:
+    # put it near the top of MIDDLEWARE so the time of the other middleware is included
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.flushed_at = time.monotonic()
+
+    def __call__(self, request):
+        if not ENABLED:
+            return self.get_response(request)
+        timer = QueryTimer()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(timer))
+            response = self.get_response(request)
+        seconds = time.perf_counter() - start
+        match = request.resolver_match
+        route = match.view_name if match else 'unresolved'
+        # view_name includes the namespace (e.g admin:store_product_changelist) so it's unique
+        # unlike the path, it doesn't have the ids in it, which would make a route per object
+        if response.streaming:
+            size = None
+            # the body is only produced while it's sent, after we are done
+        else:
+            size = len(response.content)
+        record_request(route, request.method, response.status_code, seconds, size,
+                       timer.queries, timer.seconds)
+        if MULTIPROCESS_DIR and time.monotonic() - self.flushed_at >= FLUSH_SECONDS:
+            self.flushed_at = time.monotonic()
+            write_snapshot()
+        return response
+
+
+def collect_caches():
+    for (name, cache) in caches.items():
+        cache_hits.set((name,), cache.hits)
+        cache_misses.set((name,), cache.misses)
+        cache_entries.set((name,), len(cache))
+
+
+def collect_db_connections():
+    # the server's own numbers, Django itself doesn't pool connections
+    # (a worker thread keeps its connection for CONN_MAX_AGE seconds)
+    values = {}
+    for alias in connections:
+        connection = connections[alias]
+        try:
+            with connection.cursor() as cursor:
+                if connection.vendor == 'mysql':
+                    cursor.execute(
+                        "SHOW GLOBAL STATUS WHERE Variable_name IN "
+                        "('Threads_connected', 'Threads_running', 'Max_used_connections')")
+                elif connection.vendor == 'postgresql':
+                    cursor.execute(
+                        'SELECT COALESCE(state, \'unknown\'), COUNT(*) FROM pg_stat_activity '
+                        'WHERE datname = current_database() GROUP BY 1')
+                else:
+                    continue
+                    # sqlite has no server
+                for (state, count) in cursor.fetchall():
+                    values[(alias, state.lower())] = int(count)
+        except DatabaseError:
+            continue
+    with lock:
+        db_connections.values = values
+
+
+def snapshot():
+    # {metric name: {labels: value}} of this process
+    collect_caches()
+    with lock:
+        return {
+            metric.name: {labels: list(value) if isinstance(value, list) else value
+                          for (labels, value) in metric.values.items()}
+            for metric in registry.values() if metric is not db_connections
+        }
+        # the DB connections are the same for every process, they are collected by the scrape
+
+
+def snapshot_path(pid):
+    return os.path.join(MULTIPROCESS_DIR, f'metrics.{pid}.json')
+
+
+def process_alive(pid):
+    # the workers share MULTIPROCESS_DIR on one machine, so their pids are ours to check
+    try:
+        os.kill(pid, 0)
+        # signal 0 doesn't send anything, it only checks the process exists
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+        # it exists, it's run by another user
+    return True
+
+
+def remove_stale(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+        # another process scraping at the same time removed it first
+
+
+def write_snapshot():
+    os.makedirs(MULTIPROCESS_DIR, exist_ok=True)
+    data = {name: [[list(labels), value] for (labels, value) in values.items()]
+            for (name, values) in snapshot().items()}
+    path = snapshot_path(os.getpid())
+    with open(f'{path}.tmp', 'w') as file:
+        json.dump(data, file)
+    os.replace(f'{path}.tmp', path)
+    # like core.profiling, a reader never sees half a file
+
+
+def add(total, values):
+    for (labels, value) in values.items():
+        current = total.get(labels)
+        if current is None:
+            total[labels] = list(value) if isinstance(value, list) else value
+        elif isinstance(value, list):
+            total[labels] = [a + b for (a, b) in zip(current, value)]
+        else:
+            total[labels] = current + value
+
+
+def collect():
+    samples = snapshot()
+    if MULTIPROCESS_DIR and os.path.isdir(MULTIPROCESS_DIR):
+        own = f'metrics.{os.getpid()}.json'
+        for filename in os.listdir(MULTIPROCESS_DIR):
+            if filename == own or not filename.startswith('metrics.') or not filename.endswith('.json'):
+                continue
+                # this process's numbers are in samples already, newer than its file
+            pid = filename[len('metrics.'):-len('.json')]
+            if not pid.isdigit() or not process_alive(int(pid)):
+                remove_stale(os.path.join(MULTIPROCESS_DIR, filename))
+                continue
+            try:
+                with open(os.path.join(MULTIPROCESS_DIR, filename)) as file:
+                    data = json.load(file)
+            except (OSError, ValueError):
+                continue
+            for (name, rows) in data.items():
+                if name in registry:
+                    add(samples.setdefault(name, {}), {tuple(labels): value for (labels, value) in rows})
+    collect_db_connections()
+    samples[db_connections.name] = dict(db_connections.values)
+    return samples
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def format_labels(names, values):
+    pairs = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for (name, value) in zip(names, values))
+    return f'{{{pairs}}}' if pairs else ''
+
+
+def render(samples=None):
+    samples = collect() if samples is None else samples
+    lines = []
+    for metric in registry.values():
+        values = samples.get(metric.name)
+        if not values:
+            continue
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for (labels, value) in sorted(values.items()):
+            if metric.kind != 'histogram':
+                lines.append(f'{metric.name}{format_labels(metric.labelnames, labels)} {format_value(value)}')
+                continue
+            count = 0
+            names = metric.labelnames + ('le',)
+            for (bound, bucket) in zip(metric.buckets + (math.inf,), value):
+                count += bucket
+                # prometheus buckets are cumulative, le="0.1" counts everything up to 0.1
+                lines.append(f'{metric.name}_bucket{format_labels(names, labels + (format_value(bound),))} {count}')
+            lines.append(f'{metric.name}_sum{format_labels(metric.labelnames, labels)} {format_value(value[-1])}')
+            lines.append(f'{metric.name}_count{format_labels(metric.labelnames, labels)} {count}')
+    return '\n'.join(lines) + '\n'
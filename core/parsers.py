@@ -0,0 +1,21 @@
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from core.renderers import MessagePackRenderer, msgpack
+
+# request bodies in MessagePack (Content-Type: application/msgpack)
+# the write endpoints read request.data so they take it like JSON, e.g an internal
+# service can send its cart items or products in the same format it reads them in
+
+
+class MessagePackParser(BaseParser):
+    media_type = 'application/msgpack'
+    renderer_class = MessagePackRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if msgpack is None:
+            raise ParseError('MessagePack is not supported on this server')
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+            # raw=False gives str for strings like the JSON, keys can only be strings
+        except (ValueError, TypeError, msgpack.UnpackException) as error:
+            raise ParseError(f'MessagePack parse error - {error}')
@@ -0,0 +1,80 @@
+import threading
+from bisect import bisect_left, insort
+
+# an in-memory index for "starts with" searches (autocomplete)
+# for every object we keep one key per word of its text, from that word to the end
+#     'Diet Coke Lemon' -> 'diet coke lemon', 'coke lemon', 'lemon'
+# in a sorted list, so the keys starting with what the user typed are next to each other
+# and we find the first one with a binary search (bisect) instead of scanning a table
+#     'co' -> 'coke lemon' (and whatever comes after it starting with 'co')
+# like core.caching.LRUCache it lives in the memory of each process
+
+
+def normalize(text):
+    return ' '.join(text.split()).casefold()
+
+
+def word_keys(text):
+    words = normalize(text).split(' ')
+    return {' '.join(words[i:]) for i in range(len(words)) if words[i]}
+
+
+class PrefixIndex:
+    def __init__(self):
+        self._keys = []
+        # [(key, id), ...] sorted
+        self._labels = {}
+        # id -> the original text
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._labels)
+
+    def load(self, items):
+        # items is an iterable of (id, text), replaces everything in the index
+        labels = {}
+        keys = []
+        for (id, text) in items:
+            labels[id] = text
+            keys.extend((key, id) for key in word_keys(text))
+        keys.sort()
+        with self._lock:
+            (self._keys, self._labels) = (keys, labels)
+
+    def add(self, id, text):
+        with self._lock:
+            self._remove(id)
+            self._labels[id] = text
+            for key in word_keys(text):
+                insort(self._keys, (key, id))
+
+    def remove(self, id):
+        with self._lock:
+            self._remove(id)
+
+    def _remove(self, id):
+        text = self._labels.pop(id, None)
+        if text is None:
+            return
+        for key in word_keys(text):
+            position = bisect_left(self._keys, (key, id))
+            if position < len(self._keys) and self._keys[position] == (key, id):
+                del self._keys[position]
+
+    # [(id, text), ...] of the objects with a word starting with the prefix
+    # in the order of the matching keys, each object once
+    def search(self, prefix, limit=10):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        results = {}
+        with self._lock:
+            position = bisect_left(self._keys, (prefix,))
+            while position < len(self._keys) and len(results) < limit:
+                (key, id) = self._keys[position]
+                if not key.startswith(prefix):
+                    break
+                if id not in results:
+                    results[id] = self._labels[id]
+                position += 1
+        return list(results.items())
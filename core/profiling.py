@@ -0,0 +1,198 @@
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from django.conf import settings
+from core.metrics import process_alive, remove_stale
+
+# a sampling profiler cheap enough to leave on in production
+# instead of tracing every function call (like cProfile or the debug toolbar) a background
+# thread looks at the stack of the profiled requests every few milliseconds and counts
+# the stacks it sees. the functions that show up in a lot of samples are where the time goes.
+#
+# only a fraction of the requests of every url name is profiled (SAMPLING_PROFILER['RATES'])
+# and the sampler thread sleeps when no request is being profiled.
+# the counts are written per url name in the "collapsed stack" format
+#     store.views:list;store.serializer:to_representation;... 42
+# which flamegraph.pl and speedscope turn into flame graphs. every process writes its own
+# files (<url name>.<pid>.collapsed) and /profiles/<url name>/ adds them up (check core.views)
+# the counts in memory are only the ones since the last flush, flush() adds them to the file.
+# the files of workers that exited are deleted when the profiles are read
+
+SAMPLING_PROFILER = getattr(settings, 'SAMPLING_PROFILER', {})
+ENABLED = SAMPLING_PROFILER.get('ENABLED', False)
+DEFAULT_RATE = SAMPLING_PROFILER.get('DEFAULT_RATE', 0.01)
+RATES = SAMPLING_PROFILER.get('RATES', {})
+# url name -> the fraction of its requests we profile e.g {'products-list': 0.1}
+INTERVAL = SAMPLING_PROFILER.get('INTERVAL', 0.005)
+# seconds between samples
+FLUSH_SECONDS = SAMPLING_PROFILER.get('FLUSH_SECONDS', 30)
+OUTPUT_DIR = str(SAMPLING_PROFILER.get('OUTPUT_DIR', os.path.join(settings.BASE_DIR, 'profiles')))
+MAX_DEPTH = SAMPLING_PROFILER.get('MAX_DEPTH', 128)
+MAX_STACKS = SAMPLING_PROFILER.get('MAX_STACKS', 5000)
+# per url name and process, the file keeps the most common ones
+
+
+def collapse(frame):
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        names.append(f'{frame.f_globals.get("__name__", "?")}:{frame.f_code.co_name}')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+    # the collapsed format starts from the outermost frame
+
+
+class Sampler:
+    def __init__(self, interval=INTERVAL, output_dir=OUTPUT_DIR, flush_seconds=FLUSH_SECONDS):
+        self.interval = interval
+        self.output_dir = output_dir
+        self.flush_seconds = flush_seconds
+        self.active = {}
+        # thread id -> url name of the requests being profiled right now
+        self.counts = defaultdict(Counter)
+        # url name -> {collapsed stack: samples}
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+        self.pid = None
+        self.written = set()
+        # the url names this process wrote a file for, flush() adds to those files
+        self.flushed_at = time.monotonic()
+
+    def ensure_running(self):
+        if self.thread is not None and self.thread.is_alive() and self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive() or self.pid != os.getpid():
+                # a forked worker doesn't get the threads of its parent, so we start one per process
+                self.pid = os.getpid()
+                self.counts = defaultdict(Counter)
+                self.written = set()
+                self.thread = threading.Thread(target=self.run, name='sampling-profiler', daemon=True)
+                self.thread.start()
+
+    def start(self, name):
+        self.ensure_running()
+        with self.lock:
+            self.active[threading.get_ident()] = name
+        self.wake.set()
+
+    def stop(self):
+        with self.lock:
+            self.active.pop(threading.get_ident(), None)
+
+    def sample(self):
+        with self.lock:
+            active = dict(self.active)
+        if not active:
+            return False
+        frames = sys._current_frames()
+        for (thread_id, name) in active.items():
+            frame = frames.get(thread_id)
+            if frame is not None:
+                stack = collapse(frame)
+                with self.lock:
+                    self.counts[name][stack] += 1
+        return True
+
+    def run(self):
+        while True:
+            if not self.sample():
+                self.wake.wait(timeout=self.flush_seconds)
+                self.wake.clear()
+                # nothing to profile, sleep until a profiled request starts
+            else:
+                time.sleep(self.interval)
+            if time.monotonic() - self.flushed_at >= self.flush_seconds:
+                self.flush()
+
+    def flush(self):
+        with self.lock:
+            (counts, self.counts) = (self.counts, defaultdict(Counter))
+            # the counts start again from zero, the file keeps the total
+        os.makedirs(self.output_dir, exist_ok=True)
+        for (name, stacks) in counts.items():
+            path = os.path.join(self.output_dir, f'{name}.{os.getpid()}.collapsed')
+            if name in self.written and os.path.exists(path):
+                stacks.update(read_collapsed(path))
+                # not the file of an older process that had the same pid
+            with open(f'{path}.tmp', 'w') as file:
+                for (stack, count) in stacks.most_common(MAX_STACKS):
+                    file.write(f'{stack} {count}\n')
+            os.replace(f'{path}.tmp', path)
+            # the file is replaced in one step so a reader never sees half of it
+            self.written.add(name)
+        self.flushed_at = time.monotonic()
+
+
+def read_collapsed(path):
+    stacks = Counter()
+    with open(path) as file:
+        for line in file:
+            (stack, _, count) = line.rstrip('\n').rpartition(' ')
+            if stack and count.isdigit():
+                stacks[stack] += int(count)
+    return stacks
+
+
+def live_files(output_dir):
+    # (url name, filename) of the processes that are still running
+    # the files of the others are deleted, read_profile would add them up forever
+    files = []
+    for filename in os.listdir(output_dir) if os.path.isdir(output_dir) else []:
+        if not filename.endswith('.collapsed'):
+            continue
+        (name, _, pid) = filename[:-len('.collapsed')].rpartition('.')
+        if not pid.isdigit():
+            continue
+        if not process_alive(int(pid)):
+            remove_stale(os.path.join(output_dir, filename))
+            continue
+        files.append((name, filename))
+    return files
+
+
+sampler = Sampler()
+
+
+def read_profile(name, output_dir=None):
+    # the samples of every process for a url name, added up, most common first
+    output_dir = output_dir or OUTPUT_DIR
+    stacks = Counter()
+    for (file_name, filename) in live_files(output_dir):
+        if file_name == name:
+            stacks.update(read_collapsed(os.path.join(output_dir, filename)))
+    return stacks
+
+
+def profiled_names(output_dir=None):
+    output_dir = output_dir or OUTPUT_DIR
+    return sorted({name for (name, filename) in live_files(output_dir)})
+
+
+class SamplingProfilerMiddleware:
+    # goes first in MIDDLEWARE so the samples include the other middleware
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            if getattr(request, '_profiled', False):
+                sampler.stop()
+
+    # the url name is only known once the url is resolved, which happens
+    # after the middleware is called and before the view runs
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not ENABLED:
+            return None
+        name = request.resolver_match.url_name if request.resolver_match else None
+        if not name:
+            return None
+        if random.random() < RATES.get(name, DEFAULT_RATE):
+            request._profiled = True
+            sampler.start(name)
+        return None
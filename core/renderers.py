@@ -0,0 +1,104 @@
+import datetime
+import decimal
+import math
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+    # FastJSONRenderer works like the JSONRenderer of DRF without it
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# DRF's JSONRenderer builds the response with json.dumps, the pure python encoder calls
+# JSONEncoder.default for every value json doesn't know. with COERCE_DECIMAL_TO_STRING = False
+# that's every unit_price, price_with_tax and total_price, so a page of 100 products
+# makes a few hundred python calls through a chain of isinstance checks just for the prices.
+# orjson is written in rust, it writes dicts, lists, strings, numbers, UUIDs and datetimes
+# itself. Decimals still go through default() but there it's one dict lookup on the type.
+# the bytes are the same as what JSONRenderer makes (compact, utf-8, \u2028 escaped,
+# datetimes in UTC ending in Z), check python manage.py bench_json. the only difference is
+# the exponent of floats under 0.0001 or over 1e16, 1e-7 instead of 1e-07 (the same number)
+# orjson writes NaN and Infinity as null where the strict JSONRenderer raises, so when the
+# JSON has a null we look for them and let JSONRenderer raise (check has_non_finite)
+
+drf_encoder = JSONEncoder()
+
+DEFAULTS = {
+    decimal.Decimal: float,
+    # COERCE_DECIMAL_TO_STRING = False means prices are numbers in the JSON
+    datetime.timedelta: lambda value: str(value.total_seconds()),
+}
+
+
+def default(value):
+    convert = DEFAULTS.get(type(value))
+    if convert is not None:
+        return convert(value)
+    return drf_encoder.default(value)
+    # lazy translations, querysets, bytes ... like JSONRenderer, raises TypeError for the rest
+
+
+def has_non_finite(value):
+    if isinstance(value, float):
+        return not math.isfinite(value)
+    if isinstance(value, decimal.Decimal):
+        return not value.is_finite()
+    if isinstance(value, dict):
+        return any(has_non_finite(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return any(has_non_finite(item) for item in value)
+    return False
+
+
+class FastJSONRenderer(JSONRenderer):
+    options = (orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or not self.compact or self.ensure_ascii or not self.strict:
+            return super().render(data, accepted_media_type, renderer_context)
+            # orjson can only make compact utf-8 JSON without NaN
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+            # ?indent=4 or the browsable API, orjson only indents by 2 and speed doesn't matter there
+        try:
+            content = orjson.dumps(data, default=default, option=self.options)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+            # integers over 64 bits and the like, json can write them
+        if b'null' in content and has_non_finite(data):
+            return super().render(data, accepted_media_type, renderer_context)
+            # raises like JSONRenderer instead of sending a NaN price as null
+            # we only walk the data when there is a null, a NaN can't be anywhere else
+        if b'\xe2\x80' in content:
+            content = content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+            # like JSONRenderer, so the JSON is also valid javascript
+        return content
+
+
+# MessagePack for the internal services that read whole feeds (/store/products/?page_size=1000)
+# a client sends Accept: application/msgpack (or ?format=msgpack) and gets the same data
+# as the JSON in a binary form that is smaller and faster to read, numbers aren't text
+# and strings don't need escaping. values json doesn't know are converted like in the JSON
+# (Decimal to float, UUID and datetime to str) so both formats decode to the same data.
+# it's the second renderer in DEFAULT_RENDERER_CLASSES, clients that don't ask for it get JSON
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if msgpack is None:
+            raise ImproperlyConfigured('MessagePackRenderer needs the msgpack package')
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=default, use_bin_type=True)
@@ -1,5 +1,7 @@
 from djoser.serializers import UserSerializer as BaseUserSerializer, UserCreateSerializer as BaseUserCreateSerializer
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer as BaseTokenObtainPairSerializer
+from store.models import Customer
 
 class UserCreateSerializer(BaseUserCreateSerializer):
     class Meta(BaseUserCreateSerializer.Meta):
@@ -24,3 +26,23 @@ class UserSerializer(BaseUserSerializer):
         fields = ['id', 'username', 'email', 'first_name', 'last_name']
         # add 'current_user': 'core.serializers.UserSerializer', to 
         # the serializer settings for djoser 
+
+
+# the token a user gets at login (auth/jwt/create/) is signed by the server
+# so the client can read it but can't change it. we add the customer id as an
+# extra claim, so the store endpoints can read it from the token instead of looking up
+# the customer on every request. permissions (like is_staff) are always read from
+# request.user, a token lives for a day and would keep them after they are taken away
+class TokenObtainPairSerializer(BaseTokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        # this is the refresh token, the access token copies all its claims
+        # so the claims survive when the client refreshes the access token
+        (customer, created) = Customer.objects.only('id').get_or_create(user_id=user.id)
+        # the customer is created when the user registers (check store.signals.handlers)
+        # get_or_create is only here for users that registered before that
+        token['customer_id'] = customer.id
+        return token
+        # add 'TOKEN_OBTAIN_SERIALIZER': 'core.serializers.TokenObtainPairSerializer' to
+        # the SIMPLE_JWT settings
@@ -0,0 +1,11 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from core.authentication import user_cache
+
+
+@receiver([post_save, post_delete], sender=settings.AUTH_USER_MODEL)
+# when a user is updated (e.g deactivated or made staff) or deleted
+# the copy in the authentication cache is out of date so we drop it
+def invalidate_cached_user(sender, **kwargs):
+    user_cache.pop(str(kwargs['instance'].pk))
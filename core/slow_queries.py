@@ -0,0 +1,304 @@
+import decimal
+import hashlib
+import json
+import math
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.views import View
+from rest_framework.serializers import BaseSerializer
+from core.caching import LRUCache
+
+# which SQL is slow and who runs it
+# every query of a request goes through record() (a connection.execute_wrapper) which turns
+# its SQL into a fingerprint, the SQL with the values taken out
+#     SELECT ... WHERE "store_product"."inventory" < 10 AND ... IN (1, 2, 3)
+#     SELECT ... WHERE "store_product"."inventory" < ? AND ... IN (...)
+# so the same query with other values is counted together. per fingerprint we keep the
+# count, the total and max time and the last SAMPLE_SIZE times (for the p95).
+# a query slower than THRESHOLD_MS also gets
+#   - the view/serializer that ran it, from the stack
+#   - an EXPLAIN of the query with its values (once a minute at most per fingerprint)
+#     the values themselves are only kept with RECORD_PARAMS (check describe_params)
+# only the MAX_FINGERPRINTS fingerprints with the most total time are kept.
+#
+# every process writes its numbers to <OUTPUT_DIR>/slow_queries.<pid>.json every
+# FLUSH_SECONDS, python manage.py slow_queries and /slow-queries/ add them up
+
+SLOW_QUERIES = getattr(settings, 'SLOW_QUERIES', {})
+ENABLED = SLOW_QUERIES.get('ENABLED', False)
+THRESHOLD_MS = SLOW_QUERIES.get('THRESHOLD_MS', 100)
+EXPLAIN = SLOW_QUERIES.get('EXPLAIN', True)
+EXPLAIN_SECONDS = SLOW_QUERIES.get('EXPLAIN_SECONDS', 60)
+# how long an EXPLAIN is kept before a slower run of the query can replace it
+MAX_FINGERPRINTS = SLOW_QUERIES.get('MAX_FINGERPRINTS', 500)
+SAMPLE_SIZE = SLOW_QUERIES.get('SAMPLE_SIZE', 200)
+FLUSH_SECONDS = SLOW_QUERIES.get('FLUSH_SECONDS', 30)
+RECORD_PARAMS = SLOW_QUERIES.get('RECORD_PARAMS', False)
+# the values of the slow queries in the files and at /slow-queries/, off by default cus they
+# can be session keys, tokens or emails. turn it on locally to reproduce a plan
+OUTPUT_DIR = str(SLOW_QUERIES.get('OUTPUT_DIR', os.path.join(settings.BASE_DIR, 'slow_queries')))
+
+BASE_DIR = str(settings.BASE_DIR)
+
+STRING = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+NUMBER = re.compile(r'(?<![\w."`])-?\d+(?:\.\d+)?(?:e[+-]?\d+)?\b', re.IGNORECASE)
+# not the digits in names like "T3" or "store_product2"
+PLACEHOLDER = re.compile(r'%s|\?')
+IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+ROWS = re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+')
+SPACES = re.compile(r'\s+')
+
+fingerprints = LRUCache(maxsize=SLOW_QUERIES.get('FINGERPRINT_CACHE_SIZE', 5000))
+# raw sql -> (id, fingerprint), django sends the values as params so most queries
+# come back with exactly the same sql and we only run the regexes once for them
+lock = threading.Lock()
+stats = {}
+# fingerprint id -> QueryStats of this process
+local = threading.local()
+# local.paused while we run our own EXPLAIN so it isn't recorded
+
+
+def fingerprint(sql):
+    cached = fingerprints.get(sql)
+    if cached is not None:
+        return cached
+    text = STRING.sub('?', sql)
+    text = NUMBER.sub('?', text)
+    text = PLACEHOLDER.sub('?', text)
+    text = IN_LIST.sub('(...)', text)
+    # IN (?, ?, ?) and IN (?) are the same query
+    text = ROWS.sub('(...), ...', text)
+    # the rows of a bulk insert
+    text = SPACES.sub(' ', text).strip()
+    result = (hashlib.md5(text.encode()).hexdigest()[:12], text)
+    fingerprints.set(sql, result)
+    return result
+
+
+class QueryStats:
+    def __init__(self, id, text, example):
+        self.id = id
+        self.fingerprint = text
+        self.example = example
+        # the sql of the first query we saw, with placeholders
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.durations = deque(maxlen=SAMPLE_SIZE)
+        # seconds of the last runs, for the p95
+        self.slow = 0
+        self.sources = Counter()
+        self.explain = None
+        # {'params', 'ms', 'plan', 'at'} of a slow run
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'fingerprint': self.fingerprint,
+            'example': self.example,
+            'count': self.count,
+            'total': self.total,
+            'max': self.max,
+            'durations': list(self.durations),
+            'slow': self.slow,
+            'sources': dict(self.sources),
+            'explain': self.explain,
+        }
+
+
+def source():
+    # the innermost view or serializer on the stack and the line of our code that ran the query
+    # e.g 'store.views.ProductViewSet.list at store/serializers.py:52'
+    owner = None
+    caller = None
+    frame = sys._getframe(1)
+    while frame is not None and owner is None:
+        filename = frame.f_code.co_filename
+        if caller is None and filename.startswith(BASE_DIR) and filename != __file__ \
+                and 'site-packages' not in filename:
+            caller = f'{os.path.relpath(filename, BASE_DIR)}:{frame.f_lineno}'
+        cls = type(frame.f_locals.get('self')) if frame.f_code.co_varnames[:1] == ('self',) else None
+        # type() and not isinstance(), isinstance would load a lazy object (like request.user)
+        if cls is not None and issubclass(cls, (BaseSerializer, View)):
+            owner = f'{cls.__module__}.{cls.__qualname__}.{frame.f_code.co_name}'
+        frame = frame.f_back
+    return ' at '.join(name for name in [owner, caller] if name) or 'unknown'
+
+
+def describe_params(params):
+    # ['str', 'int'] instead of the values, unless RECORD_PARAMS
+    if RECORD_PARAMS or params is None:
+        return repr(params)
+    if isinstance(params, dict):
+        return repr({name: type(value).__name__ for (name, value) in params.items()})
+    return repr([type(value).__name__ for value in params])
+
+
+def redact_plan(plan, params):
+    # postgres writes the values into the plan e.g Filter: (session_key = 'abc'::text)
+    if RECORD_PARAMS or not params:
+        return plan
+    for value in params.values() if isinstance(params, dict) else params:
+        if value is None or isinstance(value, (bool, int, float, decimal.Decimal)):
+            continue
+            # numbers aren't quoted, replacing them would also replace the costs and row counts
+        quoted = "'{}'".format(str(value).replace("'", "''"))
+        plan = plan.replace(quoted, "'?'")
+    return plan
+
+
+def run_explain(connection, sql, params):
+    local.paused = True
+    try:
+        with transaction.atomic(using=connection.alias):
+            # a savepoint, a failing EXPLAIN doesn't break the transaction of the request
+            with connection.cursor() as cursor:
+                cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+                return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+    except DatabaseError as error:
+        return f'EXPLAIN failed: {error}'
+    finally:
+        local.paused = False
+
+
+def record(execute, sql, params, many, context):
+    if getattr(local, 'paused', False):
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    result = execute(sql, params, many, context)
+    add(context['connection'], sql, params, many, time.perf_counter() - start)
+    # a query that fails isn't recorded, its error goes up to the view like before
+    return result
+
+
+def add(connection, sql, params, many, seconds):
+    (id, text) = fingerprint(sql)
+    slow = seconds * 1000 >= THRESHOLD_MS
+    where = source() if slow else None
+    # the stack is only read for slow queries, it's the expensive part
+    with lock:
+        entry = stats.get(id)
+        if entry is None:
+            if len(stats) >= MAX_FINGERPRINTS:
+                del stats[min(stats.values(), key=lambda s: s.total).id]
+                # makes room for the new one, it only happens for a new fingerprint
+            entry = stats[id] = QueryStats(id, text, sql)
+        entry.count += 1
+        entry.total += seconds
+        entry.max = max(entry.max, seconds)
+        entry.durations.append(seconds)
+        if not slow:
+            return
+        entry.slow += 1
+        entry.sources[where] += 1
+        explain = entry.explain
+    if EXPLAIN and not many and sql.lstrip()[:6].upper() == 'SELECT' and (
+            explain is None or (time.time() - explain['at'] >= EXPLAIN_SECONDS
+                                and seconds * 1000 > explain['ms'])):
+        entry.explain = {
+            'params': describe_params(params),
+            'ms': round(seconds * 1000, 3),
+            'plan': redact_plan(run_explain(connection, sql, params), params),
+            'at': time.time(),
+        }
+
+
+class SlowQueryMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.flushed_at = time.monotonic()
+
+    def __call__(self, request):
+        if not ENABLED:
+            return self.get_response(request)
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(record))
+                return self.get_response(request)
+        finally:
+            if time.monotonic() - self.flushed_at >= FLUSH_SECONDS:
+                self.flushed_at = time.monotonic()
+                flush()
+
+
+def flush(output_dir=None):
+    output_dir = output_dir or OUTPUT_DIR
+    with lock:
+        data = [entry.as_dict() for entry in stats.values()]
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f'slow_queries.{os.getpid()}.json')
+    with open(f'{path}.tmp', 'w') as file:
+        json.dump(data, file)
+    os.replace(f'{path}.tmp', path)
+
+
+def reset(output_dir=None):
+    output_dir = output_dir or OUTPUT_DIR
+    with lock:
+        stats.clear()
+    for filename in os.listdir(output_dir) if os.path.isdir(output_dir) else []:
+        if filename.startswith('slow_queries.') and filename.endswith('.json'):
+            os.remove(os.path.join(output_dir, filename))
+
+
+def merge(total, entry):
+    total['count'] += entry['count']
+    total['total'] += entry['total']
+    total['max'] = max(total['max'], entry['max'])
+    total['durations'] += entry['durations']
+    total['slow'] += entry['slow']
+    total['sources'] = dict(Counter(total['sources']) + Counter(entry['sources']))
+    if entry['explain'] and (not total['explain'] or entry['explain']['ms'] > total['explain']['ms']):
+        total['explain'] = entry['explain']
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+
+ORDERS = ['total', 'p95', 'max', 'count', 'slow']
+
+
+def report(order='total', limit=20, output_dir=None):
+    # the fingerprints of every process added up, the ones with the most <order> first
+    output_dir = output_dir or OUTPUT_DIR
+    merged = {}
+    for filename in os.listdir(output_dir) if os.path.isdir(output_dir) else []:
+        if not filename.startswith('slow_queries.') or not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(output_dir, filename)) as file:
+                entries = json.load(file)
+        except (OSError, ValueError):
+            continue
+        for entry in entries:
+            if entry['id'] in merged:
+                merge(merged[entry['id']], entry)
+            else:
+                merged[entry['id']] = entry
+    rows = []
+    for entry in merged.values():
+        durations = entry.pop('durations')
+        total = entry.pop('total')
+        rows.append(dict(
+            entry,
+            total_ms=round(total * 1000, 3),
+            mean_ms=round(total * 1000 / entry['count'], 3) if entry['count'] else 0.0,
+            p95_ms=round(percentile(durations, 0.95) * 1000, 3),
+            max_ms=round(entry.pop('max') * 1000, 3),
+            sources=Counter(entry['sources']).most_common(5),
+        ))
+    key = {'total': 'total_ms', 'p95': 'p95_ms', 'max': 'max_ms'}.get(order, order)
+    rows.sort(key=lambda row: row[key], reverse=True)
+    return rows[:limit]
@@ -0,0 +1,86 @@
+from django.conf import settings
+from django.db import connections
+
+# reading a lot of rows without loading them all into memory
+# every function here is a generator that yields the rows in batches (lists) of at most
+# fetch_size rows, so a streaming response or an exporter only ever holds one batch.
+#
+#     for batch in stream_raw('SELECT id, title FROM store_product'):
+#         ...
+#     for batch in stream_queryset(Product.objects.filter(inventory=0), ['id', 'title']):
+#         ...
+#
+# the default MySQL cursor (mysqlclient) reads the whole result into the memory of the
+# client when the query runs, even with fetchmany() or .iterator(chunk_size). on MySQL
+# stream_raw uses an unbuffered cursor (SSCursor) that reads the rows from the server as we
+# fetch them, and stream_queryset reads the rows in chunks ordered by primary key.
+# while an unbuffered cursor is open the connection can't run other queries, so don't
+# query the same DB alias until the generator is finished (or use another alias)
+
+STREAMING_FETCH_SIZE = getattr(settings, 'STREAMING_FETCH_SIZE', 2000)
+
+
+def stream_raw(sql, params=None, using='default', fetch_size=None):
+    fetch_size = fetch_size or STREAMING_FETCH_SIZE
+    connection = connections[using]
+    if connection.vendor == 'mysql':
+        from MySQLdb.cursors import SSCursor
+        # mysqlclient is only installed with the MySQL backend
+        connection.ensure_connection()
+        cursor = connection.connection.cursor(SSCursor)
+    else:
+        cursor = connection.cursor()
+        # postgres and sqlite already hand the rows over as we fetch them
+    try:
+        cursor.execute(sql, params or ())
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                return
+            yield rows
+    finally:
+        cursor.close()
+        # an unbuffered cursor has to be closed (or read to the end) before the
+        # connection can be used again, this also runs if the client stops the download
+
+
+def stream_queryset(queryset, fields=None, fetch_size=None):
+    # tuples of the fields if we give fields (like values_list), otherwise model instances
+    fetch_size = fetch_size or STREAMING_FETCH_SIZE
+    if connections[queryset.db].vendor == 'mysql':
+        yield from keyset_batches(queryset, fields, fetch_size)
+        return
+    rows = queryset.values_list(*fields) if fields else queryset
+    batch = []
+    for row in rows.iterator(chunk_size=fetch_size):
+        # iterator() doesn't keep the rows in the queryset's cache, and on postgres
+        # it uses a server side cursor
+        batch.append(row)
+        if len(batch) == fetch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def keyset_batches(queryset, fields=None, fetch_size=None):
+    # the rows in chunks ordered by primary key, every chunk starts after the last primary key
+    # of the previous one. each chunk is a short query of its own so we don't keep a read
+    # (and its transaction) open for the whole export. the rows come ordered by primary key
+    fetch_size = fetch_size or STREAMING_FETCH_SIZE
+    queryset = queryset.prefetch_related(None).order_by('pk')
+    if fields:
+        queryset = queryset.values_list('pk', *fields)
+        # we need the primary key to know where the next chunk starts
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        rows = list(chunk[:fetch_size])
+        if not rows:
+            return
+        if fields:
+            last_pk = rows[-1][0]
+            yield [row[1:] for row in rows]
+        else:
+            last_pk = rows[-1].pk
+            yield rows
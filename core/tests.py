@@ -1,3 +1,352 @@
-from django.test import TestCase
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipIf
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.tokens import AccessToken
+from core import metrics, profiling, renderers, slow_queries
+from core.authentication import CachedJWTAuthentication, token_cache, user_cache
+from core.caching import LRUCache
+from core.streaming import keyset_batches, stream_queryset, stream_raw
+from store.models import Collection, Order, OrderItem, Product
+from store.serializer import OrderSerializer, ProductSerializer2
 
 # Create your tests here.
+
+
+class LRUCacheTests(TestCase):
+    def test_least_recently_used_entry_is_dropped(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+    def test_entries_expire(self):
+        cache = LRUCache(maxsize=10, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2, ttl=120)
+        now = time.monotonic()
+        with mock.patch('core.caching.time.monotonic', return_value=now + 90):
+            self.assertIsNone(cache.get('a'))
+            self.assertEqual(cache.get('b'), 2)
+        self.assertEqual(len(cache), 1)
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        user_cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username='buyer', email='buyer@domain.com', password='secret')
+
+    def authenticate(self, token):
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'JWT {token}')
+        return CachedJWTAuthentication().authenticate(request)
+
+    def test_second_request_comes_from_the_cache(self):
+        token = AccessToken.for_user(self.user)
+        self.authenticate(token)
+        with self.assertNumQueries(0):
+            (user, validated_token) = self.authenticate(token)
+        self.assertEqual(user.pk, self.user.pk)
+
+    def test_saving_the_user_drops_it_from_the_cache(self):
+        token = AccessToken.for_user(self.user)
+        self.authenticate(token)
+        self.user.set_password('changed')
+        self.user.save()
+        self.assertIsNone(user_cache.get(str(self.user.pk)))
+        (user, _) = self.authenticate(token)
+        self.assertTrue(user.check_password('changed'))
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(user_cache.get(str(self.user.pk)))
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(token)
+
+    def test_inactive_user_is_refused_on_a_cache_hit(self):
+        token = AccessToken.for_user(self.user)
+        self.authenticate(token)
+        user_cache.get(str(self.user.pk)).is_active = False
+        # e.g the user was deactivated in another process and this one still has it
+        with self.assertNumQueries(0), self.assertRaises(AuthenticationFailed):
+            self.authenticate(token)
+
+    def test_expired_token_is_rejected_from_the_cache(self):
+        token = AccessToken.for_user(self.user)
+        token.set_exp(lifetime=timedelta(seconds=30))
+        self.authenticate(token)
+        later = time.monotonic() + 60
+        with mock.patch('core.caching.time.monotonic', return_value=later), \
+                mock.patch('rest_framework_simplejwt.tokens.aware_utcnow',
+                           return_value=timezone.now() + timedelta(seconds=60)), \
+                self.assertRaises(AuthenticationFailed):
+            self.authenticate(token)
+
+
+class StreamingTests(TestCase):
+    def test_raw_rows_are_read_in_bounded_batches(self):
+        collection = Collection.objects.create(title='a')
+        Product.objects.bulk_create([
+            Product(title=f'{i}', slug=f'{i}', description=f'{i:0>200}', unit_price=10, inventory=i,
+                    collection=collection)
+            for i in range(20000)
+        ], batch_size=1000)
+        # an existing table, a CREATE TABLE here would commit the test's transaction on MySQL
+        sql = 'SELECT id, description FROM store_product'
+
+        tracemalloc.start()
+        try:
+            count = 0
+            for batch in stream_raw(sql, fetch_size=500):
+                self.assertLessEqual(len(batch), 500)
+                count += len(batch)
+            (_, streamed_peak) = tracemalloc.get_traced_memory()
+
+            tracemalloc.reset_peak()
+            with connection.cursor() as cursor:
+                cursor.execute(sql)
+                rows = cursor.fetchall()
+            (_, full_peak) = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(count, len(rows))
+        self.assertLess(streamed_peak, full_peak / 5)
+
+    def test_querysets_are_read_in_batches(self):
+        collection = Collection.objects.create(title='a')
+        Product.objects.bulk_create([
+            Product(title=f'{i}', slug=f'{i}', unit_price=10, inventory=i, collection=collection)
+            for i in range(25)
+        ])
+        products = Product.objects.filter(inventory__gte=5)
+        for batches in [stream_queryset(products, ['inventory'], fetch_size=10),
+                        keyset_batches(products, ['inventory'], fetch_size=10)]:
+            batches = list(batches)
+            self.assertEqual([len(batch) for batch in batches], [10, 10])
+            self.assertEqual(sorted(row[0] for batch in batches for row in batch), list(range(5, 25)))
+        self.assertEqual(
+            [product.inventory for product in next(keyset_batches(products, fetch_size=3))], [5, 6, 7])
+
+
+def busy_loop(seconds):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        sum(range(1000))
+
+
+class SamplingProfilerTests(TestCase):
+    def test_profiled_requests_are_sampled_per_url_name(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            sampler = profiling.Sampler(interval=0.001, output_dir=output_dir, flush_seconds=60)
+            with mock.patch.object(profiling, 'sampler', sampler), \
+                    mock.patch.object(profiling, 'ENABLED', True), \
+                    mock.patch.object(profiling, 'RATES', {'products-list': 1.0}), \
+                    mock.patch.object(profiling, 'OUTPUT_DIR', output_dir), \
+                    mock.patch('store.views.ProductViewSet.get_queryset',
+                               side_effect=lambda: busy_loop(0.2) or Product.objects.all()):
+                self.client.get('/store/products/')
+                sampler.flush()
+                self.assertEqual(profiling.profiled_names(output_dir), ['products-list'])
+
+                admin = get_user_model().objects.create_superuser(
+                    username='admin', email='admin@domain.com', password='secret')
+                self.client.force_login(admin)
+                response = self.client.get('/profiles/products-list/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('core.tests:busy_loop', response.content.decode())
+
+    def test_flushed_counts_move_to_the_file(self):
+        exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+        exited.wait()
+        with tempfile.TemporaryDirectory() as output_dir:
+            with open(os.path.join(output_dir, f'products-list.{exited.pid}.collapsed'), 'w') as file:
+                file.write('a;b 100\n')
+            sampler = profiling.Sampler(output_dir=output_dir)
+            sampler.counts['products-list']['a;b'] += 2
+            sampler.flush()
+            self.assertEqual(dict(sampler.counts), {})
+            sampler.counts['products-list']['a;b'] += 3
+            sampler.counts['products-list']['a;c'] += 1
+            sampler.flush()
+            self.assertEqual(profiling.read_profile('products-list', output_dir), {'a;b': 5, 'a;c': 1})
+            self.assertEqual(os.listdir(output_dir), [f'products-list.{os.getpid()}.collapsed'])
+            # the file of the worker that exited is gone
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        for metric in metrics.registry.values():
+            metric.values = {}
+
+    def test_requests_are_recorded_per_route(self):
+        collection = Collection.objects.create(title='a')
+        Product.objects.create(title='a', slug='a', unit_price=10, inventory=1, collection=collection)
+        cache = LRUCache(maxsize=10)
+        cache.get('missing')
+        with mock.patch.dict(metrics.caches, {'test': cache}):
+            self.client.get('/store/products/')
+            self.client.get('/store/products/')
+            response = self.client.get('/metrics/')
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        self.assertIn('http_requests_total{route="products-list",method="GET",status="200"} 2', text)
+        self.assertIn('http_request_duration_seconds_bucket{route="products-list",method="GET",le="+Inf"} 2', text)
+        self.assertIn('http_request_duration_seconds_count{route="products-list",method="GET"} 2', text)
+        self.assertIn('db_queries_per_request_count{route="products-list"} 2', text)
+        self.assertIn('cache_misses_total{cache="test"} 1', text)
+
+        queries = metrics.request_queries.values[('products-list',)]
+        self.assertEqual(sum(queries[:-1]), 2)
+        self.assertGreater(queries[-1], 0)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Metric('histogram', 'test_seconds', 'Test.', ['route'], (0.1, 1))
+        try:
+            for value in [0.05, 0.5, 0.5, 5]:
+                histogram.observe(('a',), value)
+            text = metrics.render({'test_seconds': histogram.values})
+        finally:
+            del metrics.registry['test_seconds']
+        self.assertIn('test_seconds_bucket{route="a",le="0.1"} 1', text)
+        self.assertIn('test_seconds_bucket{route="a",le="1"} 3', text)
+        self.assertIn('test_seconds_bucket{route="a",le="+Inf"} 4', text)
+        self.assertIn('test_seconds_sum{route="a"} 6.05', text)
+
+    def test_files_of_exited_workers_are_removed(self):
+        exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+        exited.wait()
+        snapshot = {'http_requests_total': [[['products-list', 'GET', '200'], 5]]}
+        with tempfile.TemporaryDirectory() as output_dir, \
+                mock.patch.object(metrics, 'MULTIPROCESS_DIR', output_dir):
+            for pid in [exited.pid, os.getppid()]:
+                with open(os.path.join(output_dir, f'metrics.{pid}.json'), 'w') as file:
+                    json.dump(snapshot, file)
+            samples = metrics.collect()
+            self.assertEqual(os.listdir(output_dir), [f'metrics.{os.getppid()}.json'])
+        self.assertEqual(samples['http_requests_total'], {('products-list', 'GET', '200'): 5})
+
+    def test_only_internal_ips_can_read_metrics(self):
+        response = self.client.get('/metrics/', REMOTE_ADDR='10.1.2.3')
+        self.assertEqual(response.status_code, 404)
+
+
+class SlowQueryTests(TestCase):
+    def test_fingerprints_ignore_values(self):
+        (id, text) = slow_queries.fingerprint(
+            "SELECT * FROM \"T3\" WHERE a = 10 AND b = 'x''y' AND c IN (%s, %s, %s) LIMIT 21")
+        self.assertEqual(text, 'SELECT * FROM "T3" WHERE a = ? AND b = ? AND c IN (...) LIMIT ?')
+        self.assertEqual(slow_queries.fingerprint('SELECT * FROM "T3" WHERE a = 1 AND b = \'\' AND c IN (%s) LIMIT 1')[0], id)
+        self.assertEqual(
+            slow_queries.fingerprint('INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s)')[1],
+            'INSERT INTO t (a, b) VALUES (...), ...')
+
+    def test_slow_queries_are_reported_with_their_view_and_plan(self):
+        collection = Collection.objects.create(title='a')
+        Product.objects.create(title='a', slug='a', unit_price=10, inventory=1, collection=collection)
+        admin = get_user_model().objects.create_superuser(
+            username='admin', email='admin@domain.com', password='secret')
+        with tempfile.TemporaryDirectory() as output_dir, \
+                mock.patch.object(slow_queries, 'stats', {}), \
+                mock.patch.object(slow_queries, 'OUTPUT_DIR', output_dir), \
+                mock.patch.object(slow_queries, 'ENABLED', True), \
+                mock.patch.object(slow_queries, 'THRESHOLD_MS', 0):
+            self.client.get('/store/products/')
+            self.client.get('/store/products/')
+            self.client.force_login(admin)
+            response = self.client.get('/slow-queries/?order=count&limit=50')
+            output = StringIO()
+            call_command('slow_queries', '--explain', stdout=output)
+
+        self.assertEqual(response.status_code, 200)
+        products = [row for row in response.json()['queries']
+                    if row['fingerprint'].startswith('SELECT "store_product"."id"')]
+        self.assertEqual(len(products), 1)
+        self.assertEqual(products[0]['count'], 2)
+        self.assertEqual(products[0]['slow'], 2)
+        self.assertIn('store.views.ProductViewSet', products[0]['sources'][0][0])
+        self.assertNotIn('EXPLAIN failed', products[0]['explain']['plan'])
+        self.assertIn(products[0]['id'], output.getvalue())
+
+    def test_params_are_redacted_unless_recorded(self):
+        sql = 'SELECT session_data FROM django_session WHERE session_key = %s'
+        with mock.patch.object(slow_queries, 'stats', {}), mock.patch.object(slow_queries, 'THRESHOLD_MS', 0):
+            slow_queries.add(connection, sql, ('secret-session-key',), False, 0.5)
+            explain = slow_queries.stats[slow_queries.fingerprint(sql)[0]].explain
+        self.assertEqual(explain['params'], "['str']")
+        self.assertNotIn('secret-session-key', json.dumps(explain))
+        plan = "Index Scan on django_session (cost=0.28..8.29 rows=1) Index Cond: (session_key = 'it''s'::text)"
+        self.assertEqual(slow_queries.redact_plan(plan, ["it's", 8]),
+                         "Index Scan on django_session (cost=0.28..8.29 rows=1) Index Cond: (session_key = '?'::text)")
+        with mock.patch.object(slow_queries, 'RECORD_PARAMS', True):
+            self.assertEqual(slow_queries.describe_params(('secret-session-key',)), "('secret-session-key',)")
+            self.assertEqual(slow_queries.redact_plan(plan, ["it's"]), plan)
+
+
+@skipIf(renderers.orjson is None, 'orjson is not installed')
+class FastJSONRendererTests(TestCase):
+    def test_output_is_the_same_as_json_renderer(self):
+        collection = Collection.objects.create(title='a')
+        product = Product.objects.create(
+            title='Diet \u2028 Coke – é', slug='a', unit_price=Decimal('79.07'), inventory=1, collection=collection)
+        user = get_user_model().objects.create_user(
+            username='user', email='user@domain.com', password='secret')
+        order = Order.objects.create(customer=user.customer)
+        OrderItem.objects.create(order=order, product=product, quantity=2, unit_price=product.unit_price)
+
+        for data in [ProductSerializer2([product], many=True).data,
+                     OrderSerializer(Order.objects.all(), many=True).data]:
+            self.assertEqual(renderers.FastJSONRenderer().render(data), JSONRenderer().render(data))
+        response = self.client.get(f'/store/products/{product.id}/')
+        self.assertIn(b'"price_with_tax":86.977', response.content)
+        self.assertIn(b'\\u2028', response.content)
+
+    def test_nan_and_infinity_fail_like_json_renderer(self):
+        for value in [float('nan'), float('inf'), Decimal('NaN'), Decimal('-Infinity')]:
+            data = {'results': [{'id': 1, 'price': value, 'collection': None}]}
+            with self.assertRaises(ValueError):
+                JSONRenderer().render(data)
+            with self.assertRaises(ValueError):
+                renderers.FastJSONRenderer().render(data)
+        self.assertEqual(renderers.FastJSONRenderer().render({'price': None}), b'{"price":null}')
+
+
+@skipIf(renderers.msgpack is None, 'msgpack is not installed')
+class MessagePackTests(TestCase):
+    def test_lists_and_writes_in_msgpack(self):
+        collection = Collection.objects.create(title='a')
+        product = Product.objects.create(
+            title='a', slug='a', unit_price=Decimal('79.07'), inventory=1, collection=collection)
+
+        response = self.client.get('/store/products/', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(renderers.msgpack.unpackb(response.content), self.client.get('/store/products/').json())
+
+        cart_id = self.client.post('/store/carts/').json()['id']
+        response = self.client.post(
+            f'/store/carts/{cart_id}/items/', renderers.msgpack.packb({'product_id': product.id, 'quantity': 3}),
+            content_type='application/msgpack')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['quantity'], 3)
+
+        response = self.client.post(
+            f'/store/carts/{cart_id}/items/', b'\xc1', content_type='application/msgpack')
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,8 @@
+from django.urls import path
+from . import views
+
+# URLConf
+urlpatterns = [
+    path('', views.profiles),
+    path('<str:name>/', views.profile),
+]
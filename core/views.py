@@ -1,3 +1,57 @@
+import re
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import Http404, HttpResponse, JsonResponse
 from django.shortcuts import render
+from core import metrics, profiling, slow_queries
 
 # Create your views here.
+
+
+# the metrics of core.metrics in the Prometheus text format
+# only for the addresses in INTERNAL_IPS (prometheus runs next to the app), not through auth
+def metrics_view(request):
+    if request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS:
+        raise Http404()
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# the profiles of the sampling profiler (check core.profiling)
+# /profiles/ lists the url names that have samples
+# /profiles/products-list/ gives their stacks in the collapsed format, to make a flame graph
+#     curl ... /profiles/products-list/ > products-list.txt
+#     flamegraph.pl products-list.txt > products-list.svg   (or drop the file on speedscope.app)
+@staff_member_required
+def profiles(request):
+    return JsonResponse({'profiles': profiling.profiled_names()})
+
+
+@staff_member_required
+def profile(request, name):
+    if not re.fullmatch(r'[\w.-]+', name):
+        raise Http404()
+        # the name becomes part of a file name
+    if request.GET.get('flush') == '1':
+        profiling.sampler.flush()
+        # the samples of this process are only written every FLUSH_SECONDS
+    stacks = profiling.read_profile(name)
+    if not stacks:
+        raise Http404()
+    body = ''.join(f'{stack} {count}\n' for (stack, count) in stacks.most_common())
+    return HttpResponse(body, content_type='text/plain')
+
+
+# the slowest queries of every process (check core.slow_queries)
+# /slow-queries/?order=p95&limit=50, order is one of total, p95, max, count, slow
+@staff_member_required
+def slow_query_report(request):
+    order = request.GET.get('order', 'total')
+    if order not in slow_queries.ORDERS:
+        return JsonResponse({'error': f'order must be one of {", ".join(slow_queries.ORDERS)}'}, status=400)
+    try:
+        limit = int(request.GET.get('limit', 20))
+    except ValueError:
+        return JsonResponse({'error': 'limit must be a number'}, status=400)
+    slow_queries.flush()
+    # the numbers of this process are only written every FLUSH_SECONDS
+    return JsonResponse({'queries': slow_queries.report(order, limit)})
@@ -0,0 +1,66 @@
+# Generated by Django 4.2.8 on 2026-10-19 17:16
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Min
+
+
+def remove_duplicate_likes(apps, schema_editor):
+    LikedItem = apps.get_model('likes', 'LikedItem')
+    duplicates = LikedItem.objects \
+        .values('user_id', 'content_type_id', 'object_id') \
+        .annotate(first_id=Min('id'), likes=Count('id')) \
+        .filter(likes__gt=1)
+    for row in duplicates:
+        LikedItem.objects.filter(
+            user_id=row['user_id'],
+            content_type_id=row['content_type_id'],
+            object_id=row['object_id']).exclude(id=row['first_id']).delete()
+
+
+def fill_like_counters(apps, schema_editor):
+    LikedItem = apps.get_model('likes', 'LikedItem')
+    LikeCounter = apps.get_model('likes', 'LikeCounter')
+    counts = LikedItem.objects \
+        .values('content_type_id', 'object_id') \
+        .annotate(likes=Count('id')) \
+        .order_by()
+    batch = []
+    for row in counts.iterator(chunk_size=1000):
+        batch.append(LikeCounter(
+            content_type_id=row['content_type_id'], object_id=row['object_id'], count=row['likes']))
+        if len(batch) == 1000:
+            LikeCounter.objects.bulk_create(batch)
+            batch = []
+    LikeCounter.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('likes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_likes, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='likeditem',
+            unique_together={('user', 'content_type', 'object_id')},
+        ),
+        migrations.CreateModel(
+            name='LikeCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+            ],
+            options={
+                'unique_together': {('content_type', 'object_id')},
+            },
+        ),
+        migrations.RunPython(fill_like_counters, migrations.RunPython.noop),
+    ]
@@ -1,17 +1,115 @@
 from django.conf import settings
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, Exists, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 # from django.contrib.auth.models import User
 # default user class from the auth system
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 
 
+class LikedItemManager(models.Manager):
+    # liking something twice (or unliking something that isn't liked) does nothing
+    # both return True if something changed
+    def like(self, user, obj):
+        content_type = ContentType.objects.get_for_model(obj)
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    self.create(user=user, content_type=content_type, object_id=obj.pk)
+            except IntegrityError:
+                return False
+                # the unique constraint on (user, content_type, object_id) tells us it's already liked
+                # even if two requests try to like it at the same time
+            LikeCounter.objects.add(content_type.id, obj.pk, 1)
+            # the like and the counter are saved together or not at all
+        return True
+
+    def unlike(self, user, obj):
+        content_type = ContentType.objects.get_for_model(obj)
+        with transaction.atomic():
+            (deleted, _) = self \
+                .filter(user=user, content_type=content_type, object_id=obj.pk) \
+                .delete()
+            # nothing listens to the deletes of liked items so django runs a single DELETE
+            # and deleted is the number of rows it really removed. when two unlikes run at
+            # the same time the second one waits for the row lock and deletes nothing
+            if deleted:
+                LikeCounter.objects.add(content_type.id, obj.pk, -deleted)
+        return deleted > 0
+        # when a user is deleted with their likes the counters are recounted
+        # (check likes.signals.handlers)
+
+    # an expression for annotating a queryset with whether the user liked each object
+    # e.g Product.objects.annotate(liked_by_me=LikedItem.objects.liked_expression(Product, user))
+    # it's one EXISTS subquery per row in the same query, answered from the index
+    # of the (user, content_type, object_id) unique constraint
+    def liked_expression(self, model, user):
+        if not user.is_authenticated:
+            return Value(False)
+            # anonymous users haven't liked anything, no need to ask the DB
+        return Exists(self.filter(
+            user=user,
+            content_type=ContentType.objects.get_for_model(model),
+            object_id=OuterRef('pk')))
+
+
 class LikedItem(models.Model):
+    objects = LikedItemManager()
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey()
 
+    class Meta:
+        unique_together = [['user', 'content_type', 'object_id']]
+        # a user can only like something once
+        # the index of the constraint also finds the likes of a user
+
+
+class LikeCounterManager(models.Manager):
+    def add(self, content_type_id, object_id, amount):
+        (counter, created) = self.get_or_create(content_type_id=content_type_id, object_id=object_id)
+        self.filter(pk=counter.pk).update(count=F('count') + amount)
+        # F() makes the DB do the addition so two likes at the same time are both counted
+
+    # sets the counters of some objects of a model to the number of their liked items
+    def recount(self, content_type_id, object_ids):
+        likes = LikedItem.objects \
+            .filter(content_type_id=OuterRef('content_type_id'), object_id=OuterRef('object_id')) \
+            .values('content_type_id') \
+            .annotate(count=Count('id')) \
+            .values('count')
+        self.filter(content_type_id=content_type_id, object_id__in=object_ids) \
+            .update(count=Coalesce(Subquery(likes), 0))
+
+    def count_for(self, obj):
+        return self \
+            .filter(content_type=ContentType.objects.get_for_model(obj), object_id=obj.pk) \
+            .values_list('count', flat=True) \
+            .first() or 0
+
+    # an expression for annotating a queryset with the like count of each object
+    # e.g Product.objects.annotate(like_count=LikeCounter.objects.count_expression(Product))
+    # it's a subquery so a page of products is still one query
+    def count_expression(self, model):
+        counts = self.filter(
+            content_type=ContentType.objects.get_for_model(model),
+            object_id=OuterRef('pk'))
+        return Coalesce(Subquery(counts.values('count')[:1]), 0)
+        # objects nobody has liked don't have a counter
+
+
+# the number of likes of an object so we don't have to count the liked items every time
+class LikeCounter(models.Model):
+    objects = LikeCounterManager()
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = [['content_type', 'object_id']]
+
 #in django we use migrations to create or update our datebase tables
 #based of the models we have in our project
 #in django we are not going to manually create or modify our datbase tables
@@ -0,0 +1,19 @@
+from collections import defaultdict
+from django.conf import settings
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+from likes.models import LikeCounter, LikedItem
+
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+# deleting a user deletes their likes too (on_delete=CASCADE) so the counters of
+# what they liked have to go down. we delete the likes ourselves and count the liked
+# items of those objects again, this runs in the same transaction as the delete of the user
+def remove_likes_of_deleted_user(sender, instance, **kwargs):
+    likes = LikedItem.objects.filter(user=instance)
+    liked = defaultdict(list)
+    for (content_type_id, object_id) in likes.values_list('content_type_id', 'object_id'):
+        liked[content_type_id].append(object_id)
+    likes.delete()
+    for (content_type_id, object_ids) in liked.items():
+        LikeCounter.objects.recount(content_type_id, object_ids)
@@ -0,0 +1,458 @@
+import statistics
+import time
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import EmptyResultSet
+from django.db import DatabaseError, NotSupportedError, connection, transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Func, Q, Value
+from django.db.models.aggregates import Count, Min
+from django.db.models.functions import Concat
+from django.db.models.query import QuerySet, RawQuerySet
+from django.test.utils import CaptureQueriesContext
+from store.models import Collection, Customer, Order, OrderItem, Product
+from tags.models import TaggedItem
+
+# the query lab
+# the querysets of say_hello1 (check views.py) as named patterns we can run against
+# the data we have, to see the SQL django sends, how long it takes, how many queries
+# it needs and how the DB plans to run it (EXPLAIN).
+# patterns with the same compare name are different ways of getting the same thing
+# (e.g prefetch_related vs a query per row) and are shown side by side.
+#
+#     python manage.py query_lab --compare recent_orders
+#     GET /playground/lab/?compare=recent_orders
+#
+# a pattern returns a queryset (the lab evaluates it) or does its own work and returns
+# the result, e.g looping over orders and touching their customers like a template would.
+# everything runs in a transaction that is rolled back, so the lab never changes the data
+
+patterns = {}
+# name -> Pattern
+
+
+class Pattern:
+    def __init__(self, name, fn, compare=None):
+        self.name = name
+        self.fn = fn
+        self.compare = compare
+        self.description = (fn.__doc__ or '').strip()
+
+
+def pattern(name, compare=None):
+    def decorator(fn):
+        patterns[name] = Pattern(name, fn, compare)
+        return fn
+    return decorator
+
+
+def comparisons():
+    groups = {}
+    for p in patterns.values():
+        if p.compare:
+            groups.setdefault(p.compare, []).append(p)
+    return groups
+
+
+def evaluate(result):
+    if result is None:
+        return []
+    if isinstance(result, (QuerySet, RawQuerySet)):
+        return list(result)
+    if isinstance(result, dict):
+        return [result]
+    if isinstance(result, (list, tuple)):
+        return list(result)
+    return [result]
+
+
+def query_sql(result):
+    if isinstance(result, RawQuerySet):
+        return result.raw_query
+    if isinstance(result, QuerySet):
+        try:
+            return str(result.query)
+        except EmptyResultSet:
+            return None
+    return None
+
+
+def explain(result):
+    if not isinstance(result, QuerySet):
+        return None
+        # the other patterns run more than one query, check their queries
+    try:
+        return result.explain()
+    except (NotSupportedError, DatabaseError, EmptyResultSet) as error:
+        return f'EXPLAIN failed: {error}'
+
+
+def run(p, repeat=1, with_explain=True):
+    timings = []
+    try:
+        with transaction.atomic():
+            for _ in range(max(repeat, 1)):
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    result = p.fn()
+                    rows = evaluate(result)
+                    timings.append(time.perf_counter() - start)
+            report = {
+                'name': p.name,
+                'compare': p.compare,
+                'description': p.description,
+                'sql': query_sql(result),
+                'rows': len(rows),
+                'time_ms': round(statistics.median(timings) * 1000, 3),
+                # the median so one slow run (e.g the first one, with a cold cache) doesn't count too much
+                'query_count': len(queries),
+                'queries': [query['sql'] for query in queries],
+                'explain': explain(result) if with_explain else None,
+            }
+            transaction.set_rollback(True)
+    except DatabaseError as error:
+        # e.g CONCAT doesn't exist on older versions of sqlite
+        return {'name': p.name, 'compare': p.compare, 'description': p.description, 'error': str(error)}
+    return report
+
+
+def run_many(names=None, compare=None, repeat=1, with_explain=True):
+    selected = [
+        p for p in patterns.values()
+        if (names is None or p.name in names) and (compare is None or p.compare == compare)
+    ]
+    return [run(p, repeat, with_explain) for p in selected]
+
+
+# retrieving objects
+
+@pattern('get_by_pk')
+def get_by_pk():
+    """get() returns one object, not a queryset"""
+    try:
+        return Product.objects.get(pk=1)
+    except Product.DoesNotExist:
+        return []
+
+
+@pattern('first')
+def first():
+    return Product.objects.filter().first()
+
+
+@pattern('exists')
+def exists():
+    return Product.objects.filter(pk=1).exists()
+
+
+# filtering
+
+@pattern('price_equals')
+def price_equals():
+    return Product.objects.filter(unit_price=20)
+
+
+@pattern('price_greater_than')
+def price_greater_than():
+    return Product.objects.filter(unit_price__gt=20)
+
+
+@pattern('price_range')
+def price_range():
+    return Product.objects.filter(unit_price__range=(20, 30))
+
+
+@pattern('collection_in')
+def collection_in():
+    """say_hello1 used collection__id__range with 3 values, __in is what it meant"""
+    return Product.objects.filter(collection__id__in=(1, 2, 3))
+
+
+@pattern('title_icontains')
+def title_icontains():
+    return Product.objects.filter(title__icontains='coffee')
+
+
+@pattern('last_update_year')
+def last_update_year():
+    return Product.objects.filter(last_update__year=2021)
+
+
+@pattern('description_isnull')
+def description_isnull():
+    return Product.objects.filter(description__isnull=True)
+
+
+@pattern('and_kwargs', compare='and')
+def and_kwargs():
+    return Product.objects.filter(inventory__lt=10, unit_price__lt=20)
+
+
+@pattern('and_chained', compare='and')
+def and_chained():
+    return Product.objects.filter(inventory__lt=10).filter(unit_price__lt=20)
+
+
+@pattern('and_q', compare='and')
+def and_q():
+    return Product.objects.filter(Q(inventory__lt=10) & Q(unit_price__lt=20))
+
+
+@pattern('or_q')
+def or_q():
+    return Product.objects.filter(Q(inventory__lt=10) | Q(unit_price__lt=20))
+
+
+@pattern('not_q')
+def not_q():
+    return Product.objects.filter(Q(inventory__lt=10) & ~Q(unit_price__lt=20))
+
+
+@pattern('f_same_row')
+def f_same_row():
+    return Product.objects.filter(inventory=F('unit_price'))
+
+
+@pattern('f_related')
+def f_related():
+    return Product.objects.filter(inventory=F('collection__id'))
+
+
+# sorting and limiting
+
+@pattern('order_by_title')
+def order_by_title():
+    return Product.objects.order_by('title')
+
+
+@pattern('order_by_price_and_title')
+def order_by_price_and_title():
+    return Product.objects.order_by('unit_price', '-title')
+
+
+@pattern('order_by_reverse')
+def order_by_reverse():
+    return Product.objects.order_by('unit_price', '-title').reverse()
+
+
+@pattern('filter_and_order')
+def filter_and_order():
+    return Product.objects.filter(collection__id=1).order_by('unit_price')
+
+
+@pattern('related_title_and_order')
+def related_title_and_order():
+    return Product.objects.filter(collection__title='pets').order_by('unit_price')
+
+
+@pattern('cheapest_sliced', compare='cheapest')
+def cheapest_sliced():
+    return Product.objects.order_by('unit_price')[:1]
+
+
+@pattern('cheapest_earliest', compare='cheapest')
+def cheapest_earliest():
+    try:
+        return Product.objects.earliest('unit_price')
+    except Product.DoesNotExist:
+        return []
+
+
+@pattern('most_expensive')
+def most_expensive():
+    try:
+        return Product.objects.latest('unit_price')
+    except Product.DoesNotExist:
+        return []
+
+
+@pattern('first_page')
+def first_page():
+    return Product.objects.all()[:5]
+
+
+@pattern('second_page')
+def second_page():
+    return Product.objects.all()[5:10]
+
+
+# selecting fields
+# the same product rows as model instances, dictionaries, tuples and deferred instances
+
+@pattern('product_rows_instances', compare='product_rows')
+def product_rows_instances():
+    return Product.objects.select_related('collection')
+
+
+@pattern('product_rows_values', compare='product_rows')
+def product_rows_values():
+    return Product.objects.values('id', 'title', 'collection__title')
+
+
+@pattern('product_rows_values_list', compare='product_rows')
+def product_rows_values_list():
+    return Product.objects.values_list('id', 'title', 'collection__title')
+
+
+@pattern('product_rows_only', compare='product_rows')
+def product_rows_only():
+    return Product.objects.select_related('collection').only('id', 'title', 'collection__title')
+
+
+@pattern('ordered_products_distinct')
+def ordered_products_distinct():
+    return OrderItem.objects.values('product__id', 'product__title').distinct()
+
+
+@pattern('ordered_products_subquery')
+def ordered_products_subquery():
+    return Product.objects \
+        .filter(id__in=OrderItem.objects.values('product__id').distinct()) \
+        .order_by('title')
+
+
+@pattern('defer_description')
+def defer_description():
+    return Product.objects.defer('description')
+
+
+# related objects
+# reading the collection of every product, with a query per product and with a join
+
+@pattern('collection_titles_n_plus_one', compare='collection_titles')
+def collection_titles_n_plus_one():
+    """a query for the products and one more per product for its collection"""
+    return [(product.title, product.collection.title) for product in Product.objects.all()[:50]]
+
+
+@pattern('collection_titles_select_related', compare='collection_titles')
+def collection_titles_select_related():
+    return [(product.title, product.collection.title)
+            for product in Product.objects.select_related('collection')[:50]]
+
+
+@pattern('prefetch_promotions')
+def prefetch_promotions():
+    return Product.objects.prefetch_related('promotions').all()
+
+
+@pattern('prefetch_promotions_and_select_collection')
+def prefetch_promotions_and_select_collection():
+    return Product.objects.prefetch_related('promotions').select_related('collection').all()
+
+
+# the last 5 orders with their customers and items, the way a template would read them
+
+@pattern('recent_orders_n_plus_one', compare='recent_orders')
+def recent_orders_n_plus_one():
+    """queries for every customer, every order's items and every item's product"""
+    return [
+        (order.customer.user.first_name, [item.product.title for item in order.items.all()])
+        for order in Order.objects.order_by('-placed_at')[:5]
+    ]
+
+
+@pattern('recent_orders_prefetch', compare='recent_orders')
+def recent_orders_prefetch():
+    orders = Order.objects \
+        .select_related('customer__user') \
+        .prefetch_related('items__product') \
+        .order_by('-placed_at')[:5]
+    return [
+        (order.customer.user.first_name, [item.product.title for item in order.items.all()])
+        for order in orders
+    ]
+
+
+# aggregating and annotating
+
+@pattern('aggregate_count_min')
+def aggregate_count_min():
+    return Product.objects.aggregate(count=Count('id'), min_price=Min('unit_price'))
+
+
+@pattern('aggregate_collection')
+def aggregate_collection():
+    return Product.objects.filter(collection__id=1).aggregate(count=Count('id'), min_price=Min('unit_price'))
+
+
+@pattern('annotate_value')
+def annotate_value():
+    return Customer.objects.annotate(isnew=Value(True))
+
+
+@pattern('annotate_f')
+def annotate_f():
+    return Customer.objects.annotate(new_id=F('id') + 1)
+
+
+@pattern('annotate_full_name_func', compare='full_name')
+def annotate_full_name_func():
+    """the first and last names moved to the user, so we follow customer.user"""
+    return Customer.objects.annotate(
+        full_name=Func(F('user__first_name'), Value(' '), F('user__last_name'), function='CONCAT'))
+
+
+@pattern('annotate_full_name_concat', compare='full_name')
+def annotate_full_name_concat():
+    return Customer.objects.annotate(full_name=Concat('user__first_name', Value(' '), 'user__last_name'))
+
+
+@pattern('annotate_full_name_sort_name', compare='full_name')
+def annotate_full_name_sort_name():
+    """the lower case copy of the name we keep on the customer, no join"""
+    return Customer.objects.values('id', 'sort_name')
+
+
+# the number of orders of the customers on a page
+
+@pattern('order_counts_annotate', compare='order_counts')
+def order_counts_annotate():
+    return Customer.objects.annotate(orders_count=Count('order'))[:50]
+
+
+@pattern('order_counts_stats', compare='order_counts')
+def order_counts_stats():
+    """the count we keep up to date in CustomerStats (check store.customer_stats)"""
+    return Customer.objects.select_related('stats').values('id', 'stats__order_count')[:50]
+
+
+@pattern('order_counts_n_plus_one', compare='order_counts')
+def order_counts_n_plus_one():
+    return [(customer.id, customer.order_set.count()) for customer in Customer.objects.all()[:50]]
+
+
+@pattern('discounted_price')
+def discounted_price():
+    return Product.objects.annotate(discounted_price=ExpressionWrapper(
+        F('unit_price') * 0.8, output_field=DecimalField()))
+
+
+# generic relationships
+
+@pattern('tags_of_product')
+def tags_of_product():
+    return TaggedItem.objects \
+        .select_related('tag') \
+        .filter(content_type=ContentType.objects.get_for_model(Product), object_id=1)
+
+
+@pattern('tags_custom_manager')
+def tags_custom_manager():
+    return TaggedItem.objects.get_tags_for(Product, 1)
+
+
+# raw SQL
+
+@pattern('raw_all', compare='raw')
+def raw_all():
+    return Product.objects.raw('SELECT * FROM store_product')
+
+
+@pattern('raw_id_title', compare='raw')
+def raw_id_title():
+    """the other fields are loaded with a query per product if we read them"""
+    return Product.objects.raw('SELECT id, title FROM store_product')
+
+
+@pattern('collections_with_products')
+def collections_with_products():
+    return Collection.objects.annotate(product_count=Count('products')).order_by('title')
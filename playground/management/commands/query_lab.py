@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from playground import lab
+
+# python manage.py query_lab                          runs every pattern
+# python manage.py query_lab --compare recent_orders  prefetch_related vs a query per row
+# python manage.py query_lab --pattern first --pattern exists --sql --explain
+# python manage.py query_lab --list
+# runs the query patterns of the playground (check playground/lab.py) on the data we have
+
+
+class Command(BaseCommand):
+    help = 'Runs the ORM query patterns of the playground and reports their time, queries and plans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pattern', action='append', dest='patterns')
+        parser.add_argument('--compare')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--sql', action='store_true', help='print the queries of every pattern')
+        parser.add_argument('--explain', action='store_true', help='print the EXPLAIN output')
+        parser.add_argument('--list', action='store_true', help='list the patterns and comparisons')
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for (name, group) in lab.comparisons().items():
+                self.stdout.write(f'{name}: {", ".join(p.name for p in group)}')
+            self.stdout.write(', '.join(lab.patterns))
+            return
+        unknown = [name for name in options['patterns'] or [] if name not in lab.patterns]
+        if unknown:
+            raise CommandError(f'unknown patterns: {", ".join(unknown)}')
+        if options['compare'] and options['compare'] not in lab.comparisons():
+            raise CommandError(f'unknown comparison: {options["compare"]}')
+
+        reports = lab.run_many(options['patterns'], options['compare'], options['repeat'], options['explain'])
+        width = max([len(report['name']) for report in reports] + [7])
+        self.stdout.write(f'{"pattern":<{width}}  {"compare":<18} {"time ms":>10} {"queries":>8} {"rows":>8}')
+        for report in reports:
+            if 'error' in report:
+                self.stdout.write(self.style.ERROR(f'{report["name"]:<{width}}  {report["error"]}'))
+                continue
+            self.stdout.write(
+                f'{report["name"]:<{width}}  {report["compare"] or "":<18} {report["time_ms"]:>10.3f} '
+                f'{report["query_count"]:>8} {report["rows"]:>8}')
+            if options['sql']:
+                for sql in report['queries']:
+                    self.stdout.write(f'    {sql}')
+            if options['explain'] and report['explain']:
+                for line in report['explain'].splitlines():
+                    self.stdout.write(f'    {line}')
@@ -1,3 +1,23 @@
+from django.contrib.auth import get_user_model
 from django.test import TestCase
+from store.models import Collection, Product
 
 # Create your tests here.
+
+
+class QueryLabTests(TestCase):
+    def test_compare_n_plus_one_with_select_related(self):
+        collection = Collection.objects.create(title='a')
+        for i in range(3):
+            Product.objects.create(
+                title=f'{i}', slug=f'{i}', unit_price=10, inventory=10, collection=collection)
+        admin = get_user_model().objects.create_superuser(
+            username='admin', email='admin@domain.com', password='secret')
+        self.client.force_login(admin)
+
+        response = self.client.get('/playground/lab/?compare=collection_titles')
+        reports = {report['name']: report for report in response.json()['results']}
+        self.assertEqual(reports['collection_titles_n_plus_one']['query_count'], 4)
+        self.assertEqual(reports['collection_titles_select_related']['query_count'], 1)
+        self.assertEqual(reports['collection_titles_select_related']['rows'], 3)
+        self.assertEqual(Product.objects.count(), 3)
@@ -1,7 +1,8 @@
 from django.forms import DecimalField
 from django.shortcuts import render
 from django.db import transaction, connection
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
+from django.contrib.admin.views.decorators import staff_member_required
 from django.core.exceptions import ObjectDoesNotExist
 from django.db.models import Q, F, Value, Func, ExpressionWrapper
 from django.db.models.functions import Concat
@@ -9,6 +10,7 @@ from django.db.models.aggregates import Count, Max, Min, Avg, Sum
 from django.contrib.contenttypes.models import ContentType
 from store.models import Collection, Product, OrderItem, Order, Customer
 from tags.models import TaggedItem
+from playground import lab
 
 
 #a view fn is fn that takes a request and returns a response
@@ -520,3 +522,29 @@ def say_hello2(request):
 
 def say_hello(request):
     return render(request, 'hello.html', {'name': 'Mosh'})
+
+
+# the query lab (check lab.py)
+# /playground/lab/ lists the patterns and the comparisons
+# /playground/lab/?pattern=recent_orders_prefetch&pattern=first runs some patterns
+# /playground/lab/?compare=recent_orders runs the patterns of a comparison side by side
+# &repeat=5 runs every pattern 5 times and reports the median time, &explain=0 skips EXPLAIN
+# staff only cus it runs queries over the whole store
+@staff_member_required
+def query_lab(request):
+    names = request.GET.getlist('pattern') or None
+    compare = request.GET.get('compare')
+    if names is None and compare is None:
+        return JsonResponse({
+            'patterns': {name: p.description for (name, p) in lab.patterns.items()},
+            'comparisons': {name: [p.name for p in group] for (name, group) in lab.comparisons().items()},
+        })
+    unknown = [name for name in names or [] if name not in lab.patterns]
+    if unknown:
+        return JsonResponse({'error': f'unknown patterns: {", ".join(unknown)}'}, status=400)
+    try:
+        repeat = min(int(request.GET.get('repeat', 1)), 20)
+    except ValueError:
+        return JsonResponse({'error': 'repeat must be a number'}, status=400)
+    reports = lab.run_many(names, compare, repeat, request.GET.get('explain') != '0')
+    return JsonResponse({'results': reports}, json_dumps_params={'indent': 2})
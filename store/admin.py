@@ -1,14 +1,23 @@
 from typing import Any
-from django.contrib import admin, messages
+from django import forms
+from django.contrib import admin
+from django.contrib.admin import helpers
 from django.contrib.contenttypes.admin import GenericTabularInline
 from django.db.models.query import QuerySet
 from django.db.models.aggregates import Count
+from django.db.models import Q
 from django.http.request import HttpRequest
+from django.template.response import TemplateResponse
 from django.utils.html import format_html, urlencode
 from django.urls import reverse
 
 from tags.models import TaggedItem
 from . import models
+from .pagination import EstimatedCountPaginator
+from tags.admin import TagAdmin
+from tags.models import Tag
+from . import admin_jobs, autocomplete, export
+from .admin_mixins import AutoRelatedMixin, PrefixSearchMixin
 # . means current folder(in this case app)
 # so we are importing the models in this app
 
@@ -44,17 +53,19 @@ class TagInline(GenericTabularInline):
 
 
 @admin.register(models.Product)
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(PrefixSearchMixin, AutoRelatedMixin, admin.ModelAdmin):
     # editing forms
     # fields = ['title', 'slug']
     # exclude = ['promotions']
     # readonly_fields = ['title']
     autocomplete_fields= ['collection']
     search_fields = ['title']
+    prefix_index = autocomplete.products
+    # the product search box of the order items comes from this index (check store.autocomplete)
     prepopulated_fields = {
         'slug': ['title']
     }
-    actions = ['clear_inventory']
+    actions = ['clear_inventory', 'adjust_prices', 'export_csv']
     inlines = [TagInline]
     list_display = ['title', 'unit_price', 'inventory_status', 'collection_title']
     # using @admin.register(models.Product) as a decorator
@@ -71,6 +82,9 @@ class ProductAdmin(admin.ModelAdmin):
     list_per_page = 10
     list_select_related = ['collection']
     # to preload the collection
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    # the count of the products comes from the table statistics (check store.pagination)
 
     #  to show a particular field in the collection model
     def collection_title(self, product):
@@ -96,19 +110,49 @@ class ProductAdmin(admin.ModelAdmin):
     # @admin.action(description='Clear Inventory') is used to give the text 
     # we'll use as description in the actions drop down
     def clear_inventory(self, request, queryset):
-        updated_count = queryset.update(inventory=0)
-        self.message_user(
-            request,
-            f'{updated_count} products were successfully updated.',
-            messages.ERROR
-            # messages.ERROR to show error style messages
-        )
+        admin_jobs.dispatch(self, request, queryset, 'clear_inventory')
+        # a few products are updated right away, a big selection (e.g select all)
+        # is updated in the background in chunks (check store.admin_jobs)
         # every model admin has the mtd for showing a message to the  user
 
+    # this action shows a page asking for the percentage before changing anything
+    # the page posts the same action again with the selection and the percentage
+    @admin.action(description='Adjust prices')
+    def adjust_prices(self, request, queryset):
+        form = PriceAdjustmentForm(request.POST if 'apply' in request.POST else None)
+        if form.is_valid():
+            admin_jobs.dispatch(
+                self, request, queryset, 'adjust_prices', {'percent': str(form.cleaned_data['percent'])})
+            return None
+            # None takes us back to the changelist
+        return TemplateResponse(request, 'admin/store/product/adjust_prices.html', {
+            **self.admin_site.each_context(request),
+            'title': 'Adjust prices',
+            'opts': self.model._meta,
+            'form': form,
+            'count': queryset.count(),
+            'select_across': request.POST.get('select_across') == '1',
+            'selected': request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+        })
+
+    @admin.action(description='Export to CSV')
+    def export_csv(self, request, queryset):
+        return export.export_products(queryset)
+        # returning a response from an action sends it instead of going back to the changelist
+        # select all to export everything the changelist is filtered by
+
+
+class PriceAdjustmentForm(forms.Form):
+    percent = forms.DecimalField(
+        max_digits=5, decimal_places=2, min_value=-99, max_value=1000,
+        help_text='e.g 10 to make the products 10% more expensive, -10 for 10% cheaper')
+
 @admin.register(models.Collection)
-class CollectionAdmin(admin.ModelAdmin):
+class CollectionAdmin(PrefixSearchMixin, admin.ModelAdmin):
     list_display = ['title', 'product_count']
     search_fields=['title']
+    prefix_index = autocomplete.collections
 
     @admin.display(ordering='product_count')
     def product_count(self, collection):
@@ -146,24 +190,48 @@ class CollectionAdmin(admin.ModelAdmin):
 
 
 @admin.register(models.Customer)
-class CustomerAdmin(admin.ModelAdmin):
-    list_display = ['first_name', 'last_name',  'membership', 'orders']
+class CustomerAdmin(AutoRelatedMixin, admin.ModelAdmin):
+    actions = ['export_csv']
+    list_display = ['first_name', 'last_name',  'membership', 'orders', 'lifetime_spend', 'last_order_at']
     # we won't be able to use 'first_name', 'last_name' in our list_display
     # cus we tied the customer model with the user model
     # to fix this we'll define a mtd called first_name in the customer model
     # and we'll return user.first_name in that mtd. we'll do this for last_name too
     list_editable = ['membership']
     list_per_page = 10
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     # ordering = ['first_name', 'last_name']
-    list_select_related = ['user']
+    list_select_related = ['user', 'stats']
     # when getting customers we want to also preload the users otherwise
     # for each customer, separate query will be sent to the DB
-    ordering = ['user__first_name', 'user__last_name']
+    # stats are the numbers we keep about the orders of the customer (check store.customer_stats)
+    ordering = ['sort_name']
+    # ordering = ['user__first_name', 'user__last_name']
     # 'user__first_name', 'user__last_name' cus we're getting from the user model
     # when loading customer we want to preload them otherwise for each customer a query will be sent to the DB
-    search_fields = ['first_name__istartswith', 'last_name__istartswith']
+    # sort_name is a lower case copy of the names on the customer table so we don't need the join to sort
+    # search_fields = ['first_name__istartswith', 'last_name__istartswith']
+    search_fields = ['sort_name']
+    # the search itself is done in get_search_results
+
+    # searching 'John Sm' finds the customers whose name starts with 'john sm'
+    # and searching 'Smith' (or 'Smith J') the ones whose last name starts with it
+    # LIKE 'john sm%' on an indexed column is a range scan on the index, with the OR
+    # MySQL reads both indexes and merges the results
+    # we use istartswith cus on MySQL startswith becomes LIKE BINARY which
+    # can't use the index of a case insensitive column. sort_name is already lower case
+    # this is also used by the customer autocomplete in the order admin
+    def get_search_results(self, request, queryset, search_term):
+        search_term = ' '.join(search_term.split())
+        if not search_term:
+            return queryset, False
+        sort_name = models.Customer.make_sort_name(search_term, '')
+        return queryset.filter(
+            Q(sort_name__istartswith=sort_name) | Q(reverse_sort_name__istartswith=sort_name)), False
+        # False means the results can't have duplicates
 
-    @admin.display(ordering='orders_count')
+    @admin.display(ordering='stats__order_count')
     def orders(self, customer):
         url = (
             reverse('admin:store_order_changelist')
@@ -171,12 +239,30 @@ class CustomerAdmin(admin.ModelAdmin):
             + urlencode({
                 'customer__id': str(customer.id)
             }))
-        return format_html('<a href="{}">{} Orders</a>', url, customer.orders_count)
+        stats = getattr(customer, 'stats', None)
+        # customers that never placed an order don't have stats
+        return format_html('<a href="{}">{} Orders</a>', url, stats.order_count if stats else 0)
 
-    def get_queryset(self, request):
-        return super().get_queryset(request).annotate(
-            orders_count=Count('order')
-        )
+    @admin.display(ordering='stats__lifetime_spend')
+    def lifetime_spend(self, customer):
+        stats = getattr(customer, 'stats', None)
+        return stats.lifetime_spend if stats else 0
+
+    @admin.display(ordering='stats__last_order_at')
+    def last_order_at(self, customer):
+        stats = getattr(customer, 'stats', None)
+        return stats.last_order_at if stats else None
+
+    @admin.action(description='Export to CSV')
+    def export_csv(self, request, queryset):
+        return export.export_customers(queryset)
+
+    # we used to annotate every customer with the number of their orders
+    # which counted all the orders of every customer on the page on every page view
+    # def get_queryset(self, request):
+    #     return super().get_queryset(request).annotate(
+    #         orders_count=Count('order')
+    #     )
 
 
 class OrderItemInline(admin.TabularInline):
@@ -192,8 +278,69 @@ class OrderItemInline(admin.TabularInline):
     model = models.OrderItem
     
 
+# the tags app doesn't know about our autocomplete indexes
+# so we replace its admin with one that uses them
+class PrefixTagAdmin(PrefixSearchMixin, TagAdmin):
+    prefix_index = autocomplete.tags
+
+
+admin.site.unregister(Tag)
+admin.site.register(Tag, PrefixTagAdmin)
+
+
 @admin.register(models.Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(AutoRelatedMixin, admin.ModelAdmin):
     autocomplete_fields= ['customer']
     inlines = [OrderItemInline]
     list_display = ['id', 'placed_at', 'customer']
+    # AutoRelatedMixin sees that the customer column shows Customer.__str__
+    # which reads customer.user, so the orders are loaded with select_related('customer__user')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    # store_order has millions of rows, counting them on every page view is too slow
+    actions = ['export_csv']
+
+    @admin.action(description='Export to CSV')
+    def export_csv(self, request, queryset):
+        return export.export_orders(queryset)
+        # for the finance team, with the customer and the total of every order
+
+
+@admin.register(models.OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    # to see what the outbox worker is doing and why events failed
+    list_display = ['id', 'topic', 'status', 'attempts', 'created_at', 'processed_at']
+    list_filter = ['status', 'topic']
+    list_per_page = 50
+    readonly_fields = ['topic', 'payload', 'attempts', 'created_at', 'processed_at', 'last_error']
+
+
+@admin.register(models.AdminJob)
+class AdminJobAdmin(AutoRelatedMixin, admin.ModelAdmin):
+    # the background admin actions (check store.admin_jobs)
+    # open a job to see its progress, reload the page to update it
+    actions = ['cancel_jobs']
+    list_display = ['id', 'action', 'status', 'progress', 'created_by', 'created_at', 'finished_at']
+    list_filter = ['status', 'action']
+    list_select_related = ['created_by']
+    fields = ['action', 'params', 'status', 'progress', 'cancel_requested', 'created_by',
+              'created_at', 'finished_at', 'last_error']
+    readonly_fields = fields
+
+    @admin.display()
+    def progress(self, job):
+        if not job.total:
+            return f'{job.processed}'
+        return f'{job.processed} / {job.total} ({job.processed * 100 // job.total}%)'
+        # total is counted when the job starts, rows added after that can make it go over 100%
+
+    @admin.action(description='Cancel jobs')
+    def cancel_jobs(self, request, queryset):
+        cancelled = queryset \
+            .filter(status__in=[models.AdminJob.STATUS_PENDING, models.AdminJob.STATUS_RUNNING]) \
+            .update(cancel_requested=True)
+        self.message_user(request, f'{cancelled} jobs will stop after their current chunk.')
+
+    def has_add_permission(self, request):
+        return False
+        # jobs are started from the actions of the other admins
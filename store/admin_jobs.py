@@ -0,0 +1,175 @@
+import traceback
+from decimal import Decimal
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import PermissionDenied
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest, Least, Round
+from django.http import HttpRequest, QueryDict
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.html import format_html
+from store import outbox
+from store.models import AdminJob, OutboxEvent
+
+# admin actions that can run on big selections without timing out the request
+# or locking every selected row at once.
+# small selections run in the request like a normal action, big ones become an AdminJob
+# that the outbox worker (python manage.py run_outbox) runs in chunks ordered by
+# primary key, one short transaction per chunk. the job page in the admin shows the
+# progress and the job can be cancelled from there.
+#
+# registering an action
+#     @admin_jobs.job_action('clear_inventory')
+#     def clear_inventory(queryset):
+#         return queryset.update(inventory=0)
+#
+# using it in a model admin action
+#     admin_jobs.dispatch(self, request, queryset, 'clear_inventory')
+
+ADMIN_JOBS = getattr(settings, 'ADMIN_JOBS', {})
+CHUNK_SIZE = ADMIN_JOBS.get('CHUNK_SIZE', 500)
+SYNC_LIMIT = ADMIN_JOBS.get('SYNC_LIMIT', 1000)
+# selections up to this size run in the request
+
+actions = {}
+# name -> function(queryset, **params), returns the number of rows changed
+
+
+def job_action(name):
+    def decorator(fn):
+        actions[name] = fn
+        return fn
+    return decorator
+
+
+def selection_of(queryset, request=None):
+    # what the job runs on, stored as JSON
+    #   {'changelist': 'inventory__gte=1&q=coke'} "select all" on the changelist, the worker
+    #       builds the changelist again with these filters and search (check changelist_queryset)
+    #   {'pks': [1, 2, 3]} the rows that were ticked, one page at most
+    if request is not None and request.POST.get('select_across') == '1':
+        return {'changelist': request.GET.urlencode()}
+    return {'pks': list(queryset.values_list('pk', flat=True))}
+
+
+def start_job(queryset, action, params=None, user=None, selection=None):
+    job = AdminJob(
+        action=action,
+        content_type=ContentType.objects.get_for_model(queryset.model),
+        selection=selection or selection_of(queryset),
+        params=params or {},
+        total=queryset.count(),
+        created_by=user)
+    with transaction.atomic():
+        job.save()
+        OutboxEvent.objects.publish('admin_job.created', {'job_id': job.id})
+        # the job is only picked up by the worker if it was saved
+    return job
+
+
+def changelist_queryset(model, querystring, user):
+    modeladmin = admin.site._registry[model]
+    request = HttpRequest()
+    request.method = 'GET'
+    request.path = reverse(f'admin:{model._meta.app_label}_{model._meta.model_name}_changelist')
+    request.GET = QueryDict(querystring)
+    request.user = user
+    if user is None or not modeladmin.has_change_permission(request):
+        raise PermissionDenied(f'{user} can no longer change {model._meta.verbose_name_plural}')
+        # checked again, the user may have lost the permission since the job was started
+    return modeladmin.get_changelist_instance(request).get_queryset(request)
+    # the same filters, search and admin queryset the action got in the request
+
+
+def job_queryset(job):
+    model = job.content_type.model_class()
+    if 'changelist' in job.selection:
+        queryset = changelist_queryset(model, job.selection['changelist'], job.created_by)
+    else:
+        queryset = model._default_manager.filter(pk__in=job.selection['pks'])
+    return queryset.order_by('pk')
+
+
+def finish(job, status):
+    job.status = status
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'finished_at'])
+
+
+def run_job(job, on_chunk=None):
+    fn = actions[job.action]
+    queryset = job_queryset(job)
+    while True:
+        if AdminJob.objects.filter(pk=job.pk, cancel_requested=True).exists():
+            finish(job, AdminJob.STATUS_CANCELLED)
+            return job
+            # the chunks that already ran stay done
+        with transaction.atomic():
+            ids = list(queryset.filter(pk__gt=job.last_pk).values_list('pk', flat=True)[:CHUNK_SIZE])
+            if not ids:
+                break
+            fn(queryset.filter(pk__in=ids), **job.params)
+            job.last_pk = ids[-1]
+            job.processed += len(ids)
+            job.save(update_fields=['last_pk', 'processed'])
+            # the progress is saved with the chunk, so if the worker dies
+            # the job continues after the last chunk that was saved
+        if on_chunk is not None:
+            on_chunk(job)
+    finish(job, AdminJob.STATUS_DONE)
+    return job
+
+
+@outbox.handler('admin_job.created', atomic=False)
+def run_admin_job(event):
+    job = AdminJob.objects.get(pk=event.payload['job_id'])
+    if job.status in [AdminJob.STATUS_DONE, AdminJob.STATUS_CANCELLED, AdminJob.STATUS_FAILED]:
+        return
+    job.status = AdminJob.STATUS_RUNNING
+    job.save(update_fields=['status'])
+    try:
+        run_job(job, on_chunk=lambda job: outbox.extend_lease(event))
+        # a job can take longer than the lease of the event, we renew it after every chunk
+        # so another worker doesn't claim the event and run the job twice
+    except Exception:
+        job.last_error = traceback.format_exc()
+        job.save(update_fields=['last_error'])
+        if event.attempts + 1 >= outbox.MAX_ATTEMPTS:
+            finish(job, AdminJob.STATUS_FAILED)
+        raise
+        # the outbox retries the event later and the job continues where it stopped
+
+
+def dispatch(modeladmin, request, queryset, action, params=None):
+    count = queryset.count()
+    if count <= SYNC_LIMIT:
+        updated_count = actions[action](queryset, **(params or {}))
+        modeladmin.message_user(
+            request, f'{updated_count} {queryset.model._meta.verbose_name_plural} were successfully updated.')
+        return None
+    job = start_job(queryset, action, params, request.user, selection_of(queryset, request))
+    url = reverse('admin:store_adminjob_change', args=[job.id])
+    modeladmin.message_user(
+        request,
+        format_html('{} {} will be updated in the background, <a href="{}">follow the progress</a>.',
+                    count, queryset.model._meta.verbose_name_plural, url),
+        messages.INFO)
+    return job
+
+
+@job_action('clear_inventory')
+def clear_inventory(queryset):
+    return queryset.update(inventory=0)
+
+
+@job_action('adjust_prices')
+def adjust_prices(queryset, percent):
+    factor = 1 + Decimal(percent) / 100
+    return queryset.update(unit_price=Least(
+        Greatest(Round(F('unit_price') * factor, 2), Value(Decimal('1.00'))),
+        Value(Decimal('9999.99'))))
+    # the new price stays between the lowest price a product can have (1)
+    # and the biggest number the column can hold
@@ -0,0 +1,219 @@
+import ast
+import inspect
+import logging
+import textwrap
+from contextlib import ExitStack
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections, models
+from core.metrics import QueryTimer
+
+# working out which relations a changelist needs from the code of its columns
+# so we don't have to keep list_select_related in sync with list_display by hand
+#
+# for every column in list_display we read (with the ast module) the code that
+# produces it and collect the attribute chains on the row object e.g
+#     def collection_title(self, product):
+#         return product.collection.title      -> product.collection -> select_related('collection')
+# a column showing a related object calls its __str__ so we read that too
+#     list_display = ['customer']               -> Customer.__str__ reads self.user -> 'customer__user'
+# relations to one object are loaded with select_related (a join)
+# relations to many objects (e.g order.items) with prefetch_related (one more query)
+
+logger = logging.getLogger(__name__)
+
+MAX_DEPTH = 3
+# how many methods deep we follow the code (a column calling a model mtd calling __str__ ...)
+
+
+def function_code(fn):
+    # the ast of a function, or None for things we can't read (builtins, lambdas in a list ...)
+    fn = inspect.unwrap(getattr(fn, 'fget', fn))
+    # fget for properties, unwrap for decorated functions
+    try:
+        tree = ast.parse(textwrap.dedent(inspect.getsource(fn)))
+    except (OSError, TypeError, SyntaxError):
+        return None
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            return node
+    return None
+
+
+def attribute_chains(code, root):
+    # ['collection', 'title'] for product.collection.title where root is 'product'
+    # getattr(customer, 'stats', None) counts as customer.stats
+    chains = []
+    for node in ast.walk(code):
+        chain = []
+        while True:
+            if isinstance(node, ast.Attribute):
+                chain.insert(0, node.attr)
+                node = node.value
+            elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) \
+                    and node.func.id == 'getattr' and len(node.args) >= 2 \
+                    and isinstance(node.args[1], ast.Constant) and isinstance(node.args[1].value, str):
+                chain.insert(0, node.args[1].value)
+                node = node.args[0]
+            else:
+                break
+        if chain and isinstance(node, ast.Name) and node.id == root:
+            chains.append(chain)
+    return chains
+
+
+def get_relation(model, name):
+    # the field of a relation by its name or its reverse accessor (e.g orderitem_set)
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        field = next(
+            (f for f in model._meta.get_fields()
+             if f.auto_created and not f.concrete and f.get_accessor_name() == name), None)
+    if getattr(field, 'attname', None) == name != field.name:
+        return None
+        # order.customer_id is the id in the order's row, it doesn't load the customer
+    if field is not None and field.is_relation and field.related_model is not None:
+        return field
+    return None
+
+
+def has_own_str(model):
+    return any('__str__' in cls.__dict__ for cls in model.__mro__ if cls is not models.Model
+               and issubclass(cls, models.Model))
+
+
+def related_paths(model, fn, root, depth=0):
+    # the relation paths (e.g {('customer', False), ('customer__user', False), ('items', True)})
+    # that the function reads from the object called root, True means it's a relation to many
+    code = function_code(fn)
+    if code is None or depth > MAX_DEPTH:
+        return set()
+    paths = set()
+    for chain in attribute_chains(code, root):
+        paths |= chain_paths(model, chain, depth)
+    return paths
+
+
+def chain_paths(model, chain, depth):
+    paths = set()
+    prefix = []
+    many = False
+    current = model
+    for name in chain:
+        field = get_relation(current, name)
+        if field is None:
+            attr = inspect.getattr_static(current, name, None)
+            if callable(attr) or isinstance(attr, property):
+                # a model mtd or property, we read its code too
+                for (path, path_many) in related_paths(current, attr, 'self', depth + 1):
+                    paths.add(('__'.join(prefix + [path]), many or path_many))
+            return paths
+        prefix.append(name)
+        many = many or field.many_to_many or field.one_to_many
+        current = field.related_model
+        paths.add(('__'.join(prefix), many))
+    if has_own_str(current) and not many:
+        # the chain ends on a related object, it's probably shown with its __str__
+        for (path, path_many) in related_paths(current, current.__str__, 'self', depth + 1):
+            paths.add(('__'.join(prefix + [path]), many or path_many))
+    return paths
+
+
+def column_paths(modeladmin, column):
+    model = modeladmin.model
+    if callable(column):
+        params = list(inspect.signature(column).parameters)
+        return related_paths(model, column, params[0], 1) if params else set()
+    if column == '__str__':
+        return related_paths(model, model.__str__, 'self')
+    if hasattr(modeladmin, column):
+        # a mtd of the model admin, (self, obj)
+        fn = getattr(modeladmin, column)
+        params = list(inspect.signature(fn).parameters)
+        return related_paths(model, fn, params[0], 1) if params else set()
+    return chain_paths(model, column.split('__'), 0)
+    # a field, a related field lookup or a mtd/property of the model
+
+
+def derive_related(modeladmin, columns):
+    select = set()
+    prefetch = set()
+    for column in columns:
+        for (path, many) in column_paths(modeladmin, column):
+            (prefetch if many else select).add(path)
+    select = sorted(path for path in select if not any(
+        other.startswith(path + '__') for other in select))
+    # select_related('customer__user') also loads the customer
+    prefetch = sorted(path for path in prefetch if not any(
+        other.startswith(path + '__') for other in prefetch))
+    return (select, prefetch)
+
+
+# use it before admin.ModelAdmin
+#     class OrderAdmin(AutoRelatedMixin, admin.ModelAdmin):
+# list_select_related still works and is added to what we find
+# with ADMIN_QUERY_DEBUG = True in the settings every changelist page logs how many
+# queries it ran and sends them in the X-Admin-Query-Count header
+class AutoRelatedMixin:
+    def get_auto_related(self, request):
+        columns = self.get_list_display(request)
+        key = tuple(columns)
+        cached = getattr(self, '_auto_related', None)
+        if cached is None or cached[0] != key:
+            self._auto_related = (key, derive_related(self, columns))
+            # the model admin lives as long as the process, we only read the code once
+        return self._auto_related[1]
+
+    def get_list_select_related(self, request):
+        explicit = super().get_list_select_related(request)
+        if explicit is True:
+            return True
+        (select, prefetch) = self.get_auto_related(request)
+        return sorted(set(select) | set(explicit or []))
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if getattr(request, '_changelist', False):
+            (select, prefetch) = self.get_auto_related(request)
+            if prefetch:
+                queryset = queryset.prefetch_related(*prefetch)
+        return queryset
+
+    def changelist_view(self, request, extra_context=None):
+        request._changelist = True
+        # the prefetches are only for the changelist, not the change form
+        if not getattr(settings, 'ADMIN_QUERY_DEBUG', False):
+            return super().changelist_view(request, extra_context)
+        timer = QueryTimer()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(timer))
+                # like core.metrics, counts the queries without turning on DEBUG's query log
+            response = super().changelist_view(request, extra_context)
+            if hasattr(response, 'render'):
+                response.render()
+                # the page is rendered later, but most of the queries (the rows and
+                # their columns) run while rendering so we render it here
+        response['X-Admin-Query-Count'] = str(timer.queries)
+        logger.info('%s changelist ran %s queries', self.model._meta.label, timer.queries)
+        return response
+
+
+# the admin autocomplete (the search box of autocomplete_fields) from a prefix index
+# (check store.autocomplete) instead of an icontains query over search_fields
+#     class ProductAdmin(PrefixSearchMixin, admin.ModelAdmin):
+#         prefix_index = autocomplete.products
+# the search of the changelist still uses search_fields
+class PrefixSearchMixin:
+    prefix_index = None
+    prefix_index_limit = 500
+
+    def get_search_results(self, request, queryset, search_term):
+        match = getattr(request, 'resolver_match', None)
+        if self.prefix_index is None or match is None or match.url_name != 'autocomplete' \
+                or not search_term.strip():
+            return super().get_search_results(request, queryset, search_term)
+        ids = [id for (id, label) in self.prefix_index.search(search_term, self.prefix_index_limit)]
+        return queryset.filter(pk__in=ids), False
+        # False means the results can't have duplicates
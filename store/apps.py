@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class StoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'store'
+
+    # this mtd is called when the app is ready
+    # we import our signal handlers here so they get registered
+    def ready(self) -> None:
+        import store.signals.handlers
+        import store.outbox_handlers
+        import store.rollups
+        import store.customer_stats
+        import store.admin_jobs
@@ -0,0 +1,95 @@
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.aggregates import Count
+from store.models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+
+# moving old orders into cold storage (ArchivedOrder, ArchivedOrderItem)
+# orders are moved in batches, every batch is one transaction that
+# 1. locks a batch of orders placed before the cutoff
+# 2. copies them and their items into the archive tables
+# 3. checks the archive has the same number of orders and items and the same totals
+# 4. deletes the orders and items from store_order and store_orderitem
+# if the check fails the transaction is rolled back and nothing is deleted
+# pending orders are never archived cus their payment status can still change
+
+ARCHIVABLE_STATUSES = [Order.PAYMENT_STATUS_COMPLETE, Order.PAYMENT_STATUS_FAILED]
+
+
+class ArchiveVerificationError(Exception):
+    pass
+
+
+def totals(orders, items):
+    return {
+        'orders': orders.count(),
+        **items.aggregate(
+            item_count=Count('id'),
+            units=Sum('quantity'),
+            revenue=Sum(ExpressionWrapper(
+                F('quantity') * F('unit_price'),
+                output_field=DecimalField(max_digits=12, decimal_places=2)))),
+    }
+
+
+def archive_batch(before, batch_size=500):
+    with transaction.atomic():
+        orders = list(
+            Order.objects
+            .select_for_update(skip_locked=True)
+            .filter(placed_at__lt=before, payment_status__in=ARCHIVABLE_STATUSES)
+            .order_by('id')[:batch_size])
+        # skip_locked=True so we don't wait for (or block) an order someone is updating
+        # we'll get it in a later run
+        if not orders:
+            return 0
+        order_ids = [order.id for order in orders]
+        items = list(OrderItem.objects.filter(order_id__in=order_ids))
+
+        ArchivedOrder.objects.bulk_create([
+            ArchivedOrder(
+                id=order.id,
+                placed_at=order.placed_at,
+                payment_status=order.payment_status,
+                customer_id=order.customer_id)
+            for order in orders
+        ])
+        ArchivedOrderItem.objects.bulk_create([
+            ArchivedOrderItem(
+                id=item.id,
+                order_id=item.order_id,
+                product_id=item.product_id,
+                quantity=item.quantity,
+                unit_price=item.unit_price)
+            for item in items
+        ])
+        # bulk_create inserts all the rows of a table in one query
+
+        source = totals(
+            Order.objects.filter(id__in=order_ids),
+            OrderItem.objects.filter(order_id__in=order_ids))
+        archived = totals(
+            ArchivedOrder.objects.filter(id__in=order_ids),
+            ArchivedOrderItem.objects.filter(order_id__in=order_ids))
+        if source != archived:
+            raise ArchiveVerificationError(
+                f'archive of orders {order_ids[0]}-{order_ids[-1]} does not match: {source} != {archived}')
+            # raising inside the atomic block rolls back the copies
+
+        OrderItem.objects.filter(order_id__in=order_ids).delete()
+        Order.objects.filter(id__in=order_ids).delete()
+        # items first cus OrderItem.order is PROTECT
+        return len(order_ids)
+
+
+def archive_orders(before, batch_size=500, max_batches=None, progress=None):
+    archived = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        count = archive_batch(before, batch_size)
+        if count == 0:
+            break
+        archived += count
+        batches += 1
+        if progress is not None:
+            progress(archived)
+    return archived
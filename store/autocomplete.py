@@ -0,0 +1,89 @@
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from core.prefix_index import PrefixIndex
+from store.models import Collection, Product
+from tags.models import Tag
+
+# autocomplete for product titles, collection titles and tag labels
+# from prefix indexes kept in memory (check core.prefix_index) instead of running
+# an icontains query on every keystroke.
+#
+# an index is loaded from the DB the first time it's used, then the signal handlers
+# (check store.signals.handlers) add and remove objects as they are saved and deleted.
+# other processes find out about a change through a version number in the django cache
+# and reload their index. bulk changes (queryset.update, bulk_create) don't send signals,
+# bump the version with changed() after them if they change the indexed field.
+
+AUTOCOMPLETE = getattr(settings, 'AUTOCOMPLETE', {})
+CHECK_SECONDS = AUTOCOMPLETE.get('CHECK_SECONDS', 1)
+# how often a process checks the version in the cache
+MAX_RESULTS = AUTOCOMPLETE.get('MAX_RESULTS', 500)
+
+
+class ModelIndex:
+    def __init__(self, model, field):
+        self.model = model
+        self.field = field
+        self.index = PrefixIndex()
+        self.version = None
+        # the version this process loaded, None if it didn't load the index yet
+        self.checked_at = 0
+        self.lock = threading.Lock()
+
+    @property
+    def version_key(self):
+        return f'autocomplete:{self.model._meta.label_lower}'
+
+    def get_version(self):
+        return cache.get_or_set(self.version_key, time.time_ns, timeout=None)
+        # starts from the time so a version that was evicted from the cache
+        # doesn't start again from a number a process already has
+
+    def current(self):
+        if self.version is not None and time.monotonic() - self.checked_at < CHECK_SECONDS:
+            return self.index
+        with self.lock:
+            version = self.get_version()
+            if version != self.version:
+                self.index.load(
+                    self.model._default_manager.values_list('id', self.field).iterator(chunk_size=2000))
+                self.version = version
+            self.checked_at = time.monotonic()
+        return self.index
+
+    def search(self, prefix, limit=10):
+        return self.current().search(prefix, limit)
+
+    def changed(self, instance=None, deleted=False):
+        with self.lock:
+            # not while current() is loading the index, the load would drop our change
+            try:
+                written = cache.incr(self.version_key)
+                # incr is atomic in redis (check CACHES in the settings), the number we get
+                # back is ours alone, a process bumping at the same time gets another one
+            except ValueError:
+                written = None
+                # nobody loaded the index yet, or the version was evicted
+            if self.version is None:
+                return
+            if instance is not None:
+                if deleted:
+                    self.index.remove(instance.pk)
+                else:
+                    self.index.add(instance.pk, getattr(instance, self.field))
+            if instance is not None and written is not None and written == self.version + 1:
+                self.version = written
+                # ours is the only bump since the version we have, our index is up to date
+            else:
+                self.checked_at = 0
+                # another process changed something too (or we don't know what changed),
+                # the next lookup compares the versions and loads the index again
+
+
+products = ModelIndex(Product, 'title')
+collections = ModelIndex(Collection, 'title')
+tags = ModelIndex(Tag, 'label')
+
+by_model = {index.model: index for index in [products, collections, tags]}
@@ -0,0 +1,111 @@
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Max, Sum
+from django.db.models.aggregates import Count
+from store import outbox
+from store.models import ArchivedOrder, ArchivedOrderItem, Customer, CustomerStats, Order, OrderItem
+
+# keeping CustomerStats up to date from the order events in the outbox (check store.outbox)
+# the handlers run in a transaction with the record of their delivery
+# so every event is counted exactly once
+
+item_total = Sum(ExpressionWrapper(
+    F('quantity') * F('unit_price'),
+    output_field=DecimalField(max_digits=12, decimal_places=2)))
+
+
+def locked_stats(customer_id):
+    (stats, created) = CustomerStats.objects.get_or_create(customer_id=customer_id)
+    return CustomerStats.objects.select_for_update().get(pk=stats.pk)
+    # we lock the row so two workers updating the same customer don't overwrite each other
+
+
+def update_average_basket(stats):
+    if stats.completed_order_count:
+        stats.average_basket = (stats.lifetime_spend / stats.completed_order_count) \
+            .quantize(Decimal('0.01'))
+    else:
+        stats.average_basket = 0
+
+
+@outbox.handler('order.created')
+def count_order(event):
+    order = Order.objects.only('placed_at').get(pk=event.payload['order_id'])
+    stats = locked_stats(event.payload['customer_id'])
+    stats.order_count += 1
+    if stats.last_order_at is None or order.placed_at > stats.last_order_at:
+        stats.last_order_at = order.placed_at
+    stats.save()
+
+
+@outbox.handler('order.payment_status_changed')
+def count_payment(event):
+    complete = Order.PAYMENT_STATUS_COMPLETE
+    if event.payload['new_status'] == complete:
+        sign = 1
+    elif event.payload['old_status'] == complete:
+        sign = -1
+        # e.g a refund, the order doesn't count anymore
+    else:
+        return
+    total = OrderItem.objects \
+        .filter(order_id=event.payload['order_id']) \
+        .aggregate(total=item_total)['total'] or 0
+    stats = locked_stats(event.payload['customer_id'])
+    stats.completed_order_count += sign
+    stats.lifetime_spend += sign * total
+    update_average_basket(stats)
+    stats.save()
+
+
+def aggregate_orders(orders, items, customer_ids):
+    # {customer_id: {...}} for the orders (live or archived) of the given customers
+    result = {}
+    for row in orders.filter(customer_id__in=customer_ids) \
+            .values('customer_id') \
+            .annotate(order_count=Count('id'), last_order_at=Max('placed_at')):
+        result[row['customer_id']] = row
+    for row in items.filter(
+            order__customer_id__in=customer_ids,
+            order__payment_status=Order.PAYMENT_STATUS_COMPLETE) \
+            .values('order__customer_id') \
+            .annotate(completed=Count('order_id', distinct=True), spend=item_total):
+        result[row['order__customer_id']].update(row)
+    return result
+
+
+def rebuild(chunk_size=1000, progress=None):
+    # recomputes the stats of every customer from their orders and archived orders
+    # stop the outbox worker while this runs
+    last_id = 0
+    processed = 0
+    while True:
+        customer_ids = list(
+            Customer.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not customer_ids:
+            break
+        live = aggregate_orders(Order.objects, OrderItem.objects, customer_ids)
+        archived = aggregate_orders(ArchivedOrder.objects, ArchivedOrderItem.objects, customer_ids)
+
+        rows = []
+        for customer_id in customer_ids:
+            stats = CustomerStats(customer_id=customer_id)
+            for totals in [live.get(customer_id), archived.get(customer_id)]:
+                if totals is None:
+                    continue
+                stats.order_count += totals['order_count']
+                stats.completed_order_count += totals.get('completed', 0)
+                stats.lifetime_spend += totals.get('spend') or 0
+                if stats.last_order_at is None or totals['last_order_at'] > stats.last_order_at:
+                    stats.last_order_at = totals['last_order_at']
+            update_average_basket(stats)
+            rows.append(stats)
+
+        with transaction.atomic():
+            CustomerStats.objects.filter(customer_id__in=customer_ids).delete()
+            CustomerStats.objects.bulk_create(rows)
+        last_id = customer_ids[-1]
+        processed += len(customer_ids)
+        if progress is not None:
+            progress(processed)
+    return processed
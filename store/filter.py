@@ -1,8 +1,18 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.aggregates import Count
+from django_filters import CharFilter, ChoiceFilter
 from django_filters.rest_framework import FilterSet
 
 from store.models import Product
+from tags.models import TaggedItem
 
 class ProductFilter(FilterSet):
+    tag = CharFilter(method='filter_tag')
+    # ?tag=red,blue products tagged red or blue
+    # ?tag=red,blue&tag_match=all products tagged red and blue
+    tag_match = ChoiceFilter(
+        choices=[('any', 'any'), ('all', 'all')], method='filter_tag_match')
+
     class Meta:
         model = Product
         fields  = {
@@ -10,4 +20,31 @@ class ProductFilter(FilterSet):
             'unit_price': ['gt', 'lt']
         }
         # we use a dictionary instead if an array so we can specify
-        # how the filtering should be done
\ No newline at end of file
+        # how the filtering should be done
+
+    # a filter method gets the queryset, the name of the filter and its value
+    # and returns the filtered queryset
+    def filter_tag(self, queryset, name, value):
+        labels = {label.strip() for label in value.split(',') if label.strip()}
+        if not labels:
+            return queryset
+        content_type_id = ContentType.objects.get_for_model(Product).id
+        # get_for_model caches the content type in memory, so after the first request
+        # this doesn't go to the DB and the id is just a number in the query
+        tagged = TaggedItem.objects.filter(
+            content_type_id=content_type_id, tag__label__in=labels)
+        if self.form.cleaned_data.get('tag_match') == 'all':
+            tagged = tagged \
+                .values('object_id') \
+                .annotate(matched=Count('tag__label', distinct=True)) \
+                .filter(matched=len(labels))
+            # only the products that have every one of the labels
+        return queryset.filter(id__in=tagged.values('object_id'))
+        # this is a subquery, so the DB does it all in one query
+        # WHERE id IN (SELECT object_id FROM tags_taggeditem JOIN tags_tag ...
+        #              WHERE content_type_id = 11 AND label IN ('red', 'blue'))
+        # both sides of the join are indexed (check tags.models)
+
+    def filter_tag_match(self, queryset, name, value):
+        return queryset
+        # tag_match only changes how filter_tag works
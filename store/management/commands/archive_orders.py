@@ -0,0 +1,27 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from store import archive
+
+# python manage.py archive_orders --older-than-days 365 --batch-size 500
+# moves complete and failed orders placed before the cutoff (and their items)
+# into the archive tables (check store.archive)
+
+
+class Command(BaseCommand):
+    help = 'Moves old orders and their items into the archive tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=365)
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--max-batches', type=int, default=None)
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options['older_than_days'])
+        archived = archive.archive_orders(
+            before,
+            batch_size=options['batch_size'],
+            max_batches=options['max_batches'],
+            progress=lambda count: self.stdout.write(f'{count} orders archived'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {archived} orders placed before {before:%Y-%m-%d}'))
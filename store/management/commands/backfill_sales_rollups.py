@@ -0,0 +1,23 @@
+from datetime import date
+from django.core.management.base import BaseCommand
+from store import rollups
+
+# python manage.py backfill_sales_rollups --since 2024-01-01
+# rebuilds the sales rollup tables from the complete orders (check store.rollups)
+# stop the outbox worker while it runs
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the daily sales rollups from the complete orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--since', type=date.fromisoformat, default=None,
+                            help='only rebuild the days from this date (YYYY-MM-DD) on')
+
+    def handle(self, *args, **options):
+        processed = rollups.backfill(
+            chunk_size=options['chunk_size'],
+            since=options['since'],
+            progress=lambda count: self.stdout.write(f'{count} orders'))
+        self.stdout.write(self.style.SUCCESS(f'Rolled up {processed} orders'))
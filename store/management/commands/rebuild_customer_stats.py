@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from store import customer_stats
+
+# python manage.py rebuild_customer_stats
+# recomputes CustomerStats from the orders and archived orders (check store.customer_stats)
+# stop the outbox worker while it runs
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the order stats of every customer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        processed = customer_stats.rebuild(
+            chunk_size=options['chunk_size'],
+            progress=lambda count: self.stdout.write(f'{count} customers'))
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the stats of {processed} customers'))
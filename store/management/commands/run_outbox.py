@@ -0,0 +1,127 @@
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+from django.db.models import Min
+from django.utils import timezone
+from store import outbox
+from store.models import OutboxEvent
+
+# python manage.py run_outbox --workers 4 --pool thread
+# claims events from the outbox in batches and runs their handlers on a pool
+# of threads (or processes with --pool process). it only needs the local DB.
+
+
+def setup_worker_process():
+    # with the spawn start method the child process starts from scratch
+    # so we have to load django (and with it the registered handlers) again
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+def run_event(event_id):
+    # what the pool runs for every event. every thread of the pool has its own DB connection
+    # so like django does around a request, we close it after the handler unless
+    # CONN_MAX_AGE lets it live longer, and a connection that broke is never reused
+    close_old_connections()
+    try:
+        return outbox.process_event(event_id)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = 'Runs the handlers of the events in the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--pool', choices=['thread', 'process'], default='thread')
+        parser.add_argument('--batch-size', type=int, default=outbox.BATCH_SIZE)
+        parser.add_argument('--max-in-flight', type=int, default=None,
+                            help='stop claiming events when this many are running or queued on the pool (default: 2 x workers)')
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument('--metrics-interval', type=float, default=30.0)
+        parser.add_argument('--once', action='store_true',
+                            help='process the events that are available now and exit')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        max_in_flight = options['max_in_flight'] or workers * 2
+        # backpressure: we never claim more events than the pool can start soon
+        # the rest stay in the outbox where other workers can claim them
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        if options['pool'] == 'process':
+            connections.close_all()
+            # the child processes must open their own DB connections
+            # instead of sharing the parent's socket
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=setup_worker_process)
+        else:
+            executor = ThreadPoolExecutor(max_workers=workers)
+
+        self.metrics = {'claimed': 0, 'done': 0, 'retry': 0, 'failed': 0, 'saturated': 0}
+        # saturated counts the times we didn't claim events cus the pool was full
+        in_flight = set()
+        last_report = time.monotonic()
+        try:
+            while not self.stopping:
+                claimed = []
+                free = max_in_flight - len(in_flight)
+                if free > 0:
+                    claimed = outbox.claim_events(min(options['batch_size'], free))
+                    self.metrics['claimed'] += len(claimed)
+                    for event_id in claimed:
+                        in_flight.add(executor.submit(run_event, event_id))
+                else:
+                    self.metrics['saturated'] += 1
+
+                if in_flight:
+                    (done, in_flight) = wait(
+                        in_flight, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.collect(future)
+                elif options['once']:
+                    break
+                elif not claimed:
+                    time.sleep(options['poll_interval'])
+
+                if time.monotonic() - last_report >= options['metrics_interval']:
+                    self.report(len(in_flight))
+                    outbox.purge_events()
+                    last_report = time.monotonic()
+        finally:
+            # let the running handlers finish, the events that were claimed but not started
+            # become available again when their lease expires
+            (done, _) = wait(in_flight)
+            for future in done:
+                self.collect(future)
+            executor.shutdown()
+            self.report(0)
+
+    def collect(self, future):
+        try:
+            self.metrics[future.result()] += 1
+        except Exception as error:
+            # process_event handles the errors of the handlers, this is something else
+            # (e.g the DB went away). the event becomes available again when its lease expires
+            self.metrics['failed'] += 1
+            self.stderr.write(f'outbox worker error: {error!r}')
+
+    def report(self, in_flight):
+        pending = OutboxEvent.objects.filter(
+            status=OutboxEvent.STATUS_PENDING, available_at__lte=timezone.now())
+        oldest = pending.aggregate(oldest=Min('created_at'))['oldest']
+        lag = (timezone.now() - oldest).total_seconds() if oldest else 0
+        # lag is how long the oldest available event has been waiting
+        # if it keeps growing the workers can't keep up
+        self.stdout.write(
+            'outbox ' + ' '.join(f'{key}={value}' for key, value in self.metrics.items())
+            + f' in_flight={in_flight} pending={pending.count()} lag={lag:.1f}s')
+
+    def stop(self, signum, frame):
+        self.stopping = True
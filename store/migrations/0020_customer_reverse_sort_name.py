@@ -0,0 +1,33 @@
+# Generated by Django 4.2.8 on 2026-10-19 17:42
+
+from django.db import migrations, models
+
+
+def fill_reverse_sort_name(apps, schema_editor):
+    Customer = apps.get_model('store', 'Customer')
+    customers = Customer.objects.select_related('user').only(
+        'id', 'user__first_name', 'user__last_name').order_by('id')
+    batch = []
+    for customer in customers.iterator(chunk_size=1000):
+        customer.reverse_sort_name = f'{customer.user.last_name} {customer.user.first_name}'.strip().casefold()
+        batch.append(customer)
+        if len(batch) == 1000:
+            Customer.objects.bulk_update(batch, ['reverse_sort_name'])
+            batch = []
+    Customer.objects.bulk_update(batch, ['reverse_sort_name'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0019_admin_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='reverse_sort_name',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=301),
+        ),
+        migrations.RunPython(fill_reverse_sort_name, migrations.RunPython.noop),
+    ]
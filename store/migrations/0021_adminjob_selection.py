@@ -0,0 +1,32 @@
+# Generated by Django 4.2.8 on 2026-10-19 18:05
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fail_unfinished_jobs(apps, schema_editor):
+    AdminJob = apps.get_model('store', 'AdminJob')
+    AdminJob.objects.filter(status__in=['P', 'R']).update(
+        status='F', finished_at=timezone.now(),
+        last_error='Started before the selection was stored as JSON, run the action again.')
+    # their pickled query is dropped, we don't unpickle it to convert it
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0020_customer_reverse_sort_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='adminjob',
+            name='selection',
+            field=models.JSONField(default=dict),
+        ),
+        migrations.RunPython(fail_unfinished_jobs, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='adminjob',
+            name='query',
+        ),
+    ]
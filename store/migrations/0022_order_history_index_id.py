@@ -0,0 +1,31 @@
+# Generated by Django 4.2.8 on 2026-10-19 17:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0021_adminjob_selection'),
+    ]
+
+    # the new indexes are made before the old ones are dropped, MySQL doesn't let us
+    # drop the only index that starts with customer_id while the foreign key needs one
+    operations = [
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['customer', 'placed_at', 'id'], name='store_archi_custome_4fa8e1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer', 'placed_at', 'id'], name='store_order_custome_c64870_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='archivedorder',
+            name='store_archi_custome_50b5ac_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='order',
+            name='store_order_custome_700a25_idx',
+        ),
+    ]
@@ -1,7 +1,9 @@
 from django.contrib import admin
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 from uuid import uuid4
 
 #Note - django create an id field automatically for each class
@@ -94,6 +96,25 @@ class Customer(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     # you don't want to reference the user model in django of in the core app(custom model)
     # cus
+    sort_name = models.CharField(max_length=301, db_index=True, editable=False, default='')
+    # a copy of the user's first and last name in lower case e.g 'john smith'
+    # we sort and search customers by it so we don't have to join the user table
+    # and sort by its columns on every customer query. it's kept in sync when
+    # the user is saved (check store.signals.handlers)
+    reverse_sort_name = models.CharField(max_length=301, db_index=True, editable=False, default='')
+    # the same names last name first e.g 'smith john', so searching by the last name
+    # is also a prefix search on an index
+
+    @staticmethod
+    def make_sort_name(first_name, last_name):
+        return f'{first_name} {last_name}'.strip().casefold()
+        # casefold is a stronger lower() e.g 'ß' becomes 'ss'
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and not self.sort_name:
+            self.sort_name = self.make_sort_name(self.user.first_name, self.user.last_name)
+            self.reverse_sort_name = self.make_sort_name(self.user.last_name, self.user.first_name)
+        super().save(*args, **kwargs)
 
     # def __str__(self):
     #     return f'{self.first_name} {self.last_name}'
@@ -103,17 +124,20 @@ class Customer(models.Model):
     # __str__ mtd 
     #  def __str__(self) -> str is type annotation it's asying the mtd returns a string object
 
-    @admin.display(ordering='user__first_name')
+    @admin.display(ordering='sort_name')
     def first_name(self):
         return self.user.first_name
     
-    @admin.display(ordering='user__last_name')
+    @admin.display(ordering='reverse_sort_name')
     def last_name(self):
         return self.user.last_name
+    # reverse_sort_name starts with the last name, sorting by it doesn't need the user table
     
     class Meta:
-        ordering = ['user__first_name', 'user__last_name']
+        ordering = ['sort_name']
+        # ordering = ['user__first_name', 'user__last_name']
         #sorting the customer by their names
+        # sorting by the user's names joined the user table on every customer query
 
         # we want to apply custom model permissions to our APIs
         # so we create a custom permission for our customer model
@@ -130,6 +154,21 @@ class Customer(models.Model):
         #indexes, used to speed up queries
 
 
+# numbers about a customer's orders that we keep up to date as orders are placed
+# and paid for (check store.customer_stats), instead of counting and adding up
+# the customer's orders every time we show them
+class CustomerStats(models.Model):
+    customer = models.OneToOneField(
+        Customer, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    order_count = models.PositiveIntegerField(default=0)
+    completed_order_count = models.PositiveIntegerField(default=0)
+    lifetime_spend = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    # the total of the completed orders
+    average_basket = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    # lifetime_spend / completed_order_count, stored so the admin can sort by it
+    last_order_at = models.DateTimeField(null=True, blank=True)
+
+
 class Order(models.Model):
     PAYMENT_STATUS_PENDING = 'P'
     PAYMENT_STATUS_COMPLETE = 'C'
@@ -146,6 +185,39 @@ class Order(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.PROTECT)
     #on_delete=models.PROTECT so that we don't delete the associated order if the customer is delete by mistake
 
+    # from_db is called when django creates an order from a row it read from the DB
+    # we remember the payment status we read so in save we can tell if it changed
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_payment_status = instance.__dict__.get('payment_status')
+        # __dict__.get so we don't trigger a query if payment_status was deferred
+        return instance
+
+    # the side effects of an order (confirmation email, stock alerts, ...) are not run here
+    # instead we write an event to the outbox in the same transaction as the order
+    # so either both are saved or none of them is, and a worker picks up the event later
+    # (check store.outbox)
+    # note: queryset.update(payment_status=...) doesn't call save so it doesn't publish anything
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            adding = self._state.adding
+            super().save(*args, **kwargs)
+            loaded_payment_status = getattr(self, '_loaded_payment_status', None)
+            if adding:
+                OutboxEvent.objects.publish('order.created', {
+                    'order_id': self.id,
+                    'customer_id': self.customer_id,
+                })
+            elif loaded_payment_status is not None and loaded_payment_status != self.payment_status:
+                OutboxEvent.objects.publish('order.payment_status_changed', {
+                    'order_id': self.id,
+                    'customer_id': self.customer_id,
+                    'old_status': loaded_payment_status,
+                    'new_status': self.payment_status,
+                })
+            self._loaded_payment_status = self.payment_status
+
     # creating custom permissions
     # we do this when we want to make a request that isn't about
     #  creating, updating or deleting data
@@ -156,6 +228,13 @@ class Order(models.Model):
             # canceling order is a special kind of request,
             # a special kind of update, so we create a ustom permission for it
         ]
+        indexes = [
+            models.Index(fields=['customer', 'placed_at', 'id'])
+        ]
+        # the order history endpoint filters by customer and sorts by placed_at, id
+        # so this composite index lets the DB find a customer's orders already
+        # sorted instead of scanning and sorting all of them
+        # (id cus orders placed at the same time need a tie breaker, check OrderCursorPagination)
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.PROTECT, related_name='items')
@@ -168,6 +247,32 @@ class OrderItem(models.Model):
     #so we store the price of product at the time it was ordered
 
 
+# cold storage for old orders (check store.archive)
+# store_order and store_orderitem only keep growing, so orders older than a cutoff
+# are moved here with their items. the rows keep the ids they had so
+# an archived order can still be found by its old id
+class ArchivedOrder(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    placed_at = models.DateTimeField()
+    payment_status = models.CharField(max_length=1, choices=Order.PAYMENT_STATUS_CHOICES)
+    customer = models.ForeignKey(Customer, on_delete=models.PROTECT, related_name='archived_orders')
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', 'placed_at', 'id'])
+        ]
+        # same as Order, for the history of a customer
+
+
+class ArchivedOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.PROTECT, related_name='items')
+    product = models.ForeignKey(Product, on_delete=models.PROTECT, related_name='archived_orderitems')
+    quantity = models.PositiveSmallIntegerField()
+    unit_price = models.DecimalField(max_digits=6, decimal_places=2)
+
+
 #one to one
 class Address(models.Model):
     street = models.CharField(max_length=255)
@@ -239,4 +344,152 @@ class Review(models.Model):
     # every time we create or update our models and migrate, django creates
     # permissions for us
 
-    # content_type specifies all models in our app
\ No newline at end of file
+    # content_type specifies all models in our app
+
+
+# sales rollups
+# answering "how much did we sell per day / per product / per collection" from
+# store_orderitem means aggregating every item ever sold, so instead we keep the totals
+# per day in these tables and add to them when an order is completed (check store.rollups)
+# the date is the day the order was placed
+class DailySales(models.Model):
+    date = models.DateField(unique=True)
+    order_count = models.PositiveIntegerField(default=0)
+    quantity = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+
+class DailyProductSales(models.Model):
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    order_count = models.PositiveIntegerField(default=0)
+    # the number of orders the product was in
+    quantity = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = [['date', 'product']]
+        # the unique constraint also gives us an index on (date, product) for date ranges
+        indexes = [
+            models.Index(fields=['product', 'date'])
+        ]
+        # for the sales of one product over time
+
+
+class DailyCollectionSales(models.Model):
+    date = models.DateField()
+    collection = models.ForeignKey(Collection, on_delete=models.CASCADE, related_name='+')
+    order_count = models.PositiveIntegerField(default=0)
+    quantity = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = [['date', 'collection']]
+        indexes = [
+            models.Index(fields=['collection', 'date'])
+        ]
+
+
+class OutboxEventManager(models.Manager):
+    def publish(self, topic, payload):
+        # call this inside the transaction that makes the change the event is about
+        # payload must be JSON serializable, e.g {'order_id': 1}
+        return self.create(topic=topic, payload=payload)
+
+
+# the transactional outbox
+# an event is a row in this table. it's written in the same transaction as the
+# change it describes and a worker (python manage.py run_outbox) claims events
+# in batches and runs the handlers registered for their topic
+class OutboxEvent(models.Model):
+    STATUS_PENDING = 'P'
+    STATUS_PROCESSING = 'R'
+    STATUS_DONE = 'D'
+    STATUS_FAILED = 'F'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_PROCESSING, 'Processing'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed')
+    ]
+
+    objects = OutboxEventManager()
+    topic = models.CharField(max_length=255)
+    # e.g order.created
+    payload = models.JSONField()
+    status = models.CharField(
+        max_length=1, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    # the event is not claimed before this time
+    # we push it forward when an attempt fails (retry with backoff) and when a worker claims
+    # the event (if the worker dies the event becomes available again after that time)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    def __str__(self) -> str:
+        return f'{self.topic} #{self.id}'
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at'])
+        ]
+        # the worker looks for pending events that are available
+
+
+# a handler can be run more than once for the same event
+# (e.g the worker died after the handler ran but before the event was marked as done)
+# so for every handler that ran successfully we store a delivery in the same
+# transaction as the handler's changes, and we skip the handler if it's already there
+class OutboxDelivery(models.Model):
+    event = models.ForeignKey(OutboxEvent, on_delete=models.CASCADE, related_name='deliveries')
+    handler = models.CharField(max_length=255)
+    # the dotted path of the handler function
+    delivered_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = [['event', 'handler']]
+
+
+# an admin action on a big selection (e.g clear the inventory of every product)
+# that runs in the background, in chunks of rows ordered by primary key (check store.admin_jobs)
+class AdminJob(models.Model):
+    STATUS_PENDING = 'P'
+    STATUS_RUNNING = 'R'
+    STATUS_DONE = 'D'
+    STATUS_CANCELLED = 'C'
+    STATUS_FAILED = 'F'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_CANCELLED, 'Cancelled'),
+        (STATUS_FAILED, 'Failed')
+    ]
+
+    action = models.CharField(max_length=255)
+    # the name the action was registered with e.g clear_inventory
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    selection = models.JSONField(default=dict)
+    # the changelist filters of a "select all" or the ticked ids, check store.admin_jobs.selection_of
+    # so "select all" doesn't have to store millions of ids
+    params = models.JSONField(default=dict, blank=True)
+    status = models.CharField(
+        max_length=1, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    last_pk = models.BigIntegerField(default=0)
+    # the job continues after this primary key if it's interrupted
+    cancel_requested = models.BooleanField(default=False)
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    def __str__(self) -> str:
+        return f'{self.action} #{self.id}'
+
+    class Meta:
+        ordering = ['-created_at']
@@ -0,0 +1,123 @@
+import logging
+import traceback
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from store.models import OutboxDelivery, OutboxEvent
+
+# the transactional outbox
+# instead of sending emails, updating analytics etc. inside the request that places
+# an order, the request only writes an event (a row in store_outboxevent) in the same
+# transaction as the order. a worker (python manage.py run_outbox) claims the
+# events in batches and runs the handlers registered for their topic.
+#
+# publishing an event
+#     OutboxEvent.objects.publish('order.created', {'order_id': order.id})
+#
+# handling an event
+#     @outbox.handler('order.created')
+#     def send_confirmation(event):
+#         ...
+
+logger = logging.getLogger(__name__)
+
+OUTBOX = getattr(settings, 'OUTBOX', {})
+BATCH_SIZE = OUTBOX.get('BATCH_SIZE', 100)
+MAX_ATTEMPTS = OUTBOX.get('MAX_ATTEMPTS', 5)
+LEASE_SECONDS = OUTBOX.get('LEASE_SECONDS', 300)
+# how long a worker can hold a claimed event before another worker can claim it again
+RETRY_DELAY_SECONDS = OUTBOX.get('RETRY_DELAY_SECONDS', 10)
+RETENTION_DAYS = OUTBOX.get('RETENTION_DAYS', 7)
+
+handlers = defaultdict(list)
+# topic -> [(name, function, atomic), ...]
+
+
+def handler(topic, atomic=True):
+    # atomic=True runs the handler and the record of its delivery in one transaction
+    # so the handler's changes are saved exactly once.
+    # long running handlers that manage their own transactions use atomic=False
+    # and have to be safe to run again
+    def decorator(fn):
+        name = f'{fn.__module__}.{fn.__qualname__}'
+        handlers[topic].append((name, fn, atomic))
+        return fn
+    return decorator
+
+
+def claim_events(batch_size=BATCH_SIZE):
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            OutboxEvent.objects
+            .select_for_update(skip_locked=True)
+            .filter(
+                status__in=[OutboxEvent.STATUS_PENDING, OutboxEvent.STATUS_PROCESSING],
+                available_at__lte=now)
+            .order_by('id')
+            .values_list('id', flat=True)[:batch_size])
+        # select_for_update locks the rows we read until the transaction ends
+        # skip_locked=True skips the rows another worker has locked instead of waiting for them
+        # so many workers can claim batches at the same time without getting the same events
+        # events that are still PROCESSING after their lease expired belong to a worker that died
+        OutboxEvent.objects.filter(id__in=ids).update(
+            status=OutboxEvent.STATUS_PROCESSING,
+            available_at=now + timedelta(seconds=LEASE_SECONDS))
+    return ids
+
+
+# long running handlers (atomic=False) call this now and then so the event
+# isn't claimed again by another worker while they are still running
+def extend_lease(event):
+    OutboxEvent.objects.filter(pk=event.pk).update(
+        available_at=timezone.now() + timedelta(seconds=LEASE_SECONDS))
+
+
+def deliver(event, name, fn, atomic):
+    if OutboxDelivery.objects.filter(event=event, handler=name).exists():
+        return
+    if atomic:
+        with transaction.atomic():
+            OutboxDelivery.objects.create(event=event, handler=name)
+            fn(event)
+            # if the handler raises, the delivery is rolled back with the handler's changes
+    else:
+        fn(event)
+        OutboxDelivery.objects.create(event=event, handler=name)
+
+
+# this runs on the worker's pool (thread or process) so it only takes the id of the event
+# returns 'done', 'retry' or 'failed'
+def process_event(event_id):
+    event = OutboxEvent.objects.get(pk=event_id)
+    try:
+        for (name, fn, atomic) in handlers.get(event.topic, []):
+            deliver(event, name, fn, atomic)
+    except Exception:
+        event.attempts += 1
+        event.last_error = traceback.format_exc()
+        if event.attempts >= MAX_ATTEMPTS:
+            event.status = OutboxEvent.STATUS_FAILED
+            logger.error('outbox event %s failed %s times, giving up', event, event.attempts)
+        else:
+            event.status = OutboxEvent.STATUS_PENDING
+            event.available_at = timezone.now() + timedelta(
+                seconds=RETRY_DELAY_SECONDS * 2 ** (event.attempts - 1))
+            # exponential backoff 10s, 20s, 40s, ...
+        event.save(update_fields=['attempts', 'last_error', 'status', 'available_at'])
+        return 'failed' if event.status == OutboxEvent.STATUS_FAILED else 'retry'
+
+    event.status = OutboxEvent.STATUS_DONE
+    event.processed_at = timezone.now()
+    event.save(update_fields=['status', 'processed_at'])
+    return 'done'
+
+
+def purge_events(retention_days=RETENTION_DAYS):
+    # done events are only kept for a while so the table doesn't keep growing
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    (count, _) = OutboxEvent.objects.filter(
+        status=OutboxEvent.STATUS_DONE, processed_at__lt=cutoff).delete()
+    return count
@@ -0,0 +1,38 @@
+import logging
+from django.core.mail import send_mail
+from store import outbox
+from store.models import Order, OrderItem
+
+# the handlers of the events published to the outbox (check store.outbox)
+# they run in the worker (python manage.py run_outbox), not in the request
+# this module is imported in StoreConfig.ready so the handlers get registered
+
+logger = logging.getLogger(__name__)
+
+LOW_INVENTORY = 10
+# same threshold as the 'Low' inventory status in the admin
+
+
+@outbox.handler('order.created')
+def send_order_confirmation(event):
+    order = Order.objects.select_related('customer__user').get(pk=event.payload['order_id'])
+    user = order.customer.user
+    send_mail(
+        subject=f'Order #{order.id} confirmation',
+        message=f'Hi {user.first_name}, we received your order #{order.id}.',
+        from_email=None,
+        # None uses the DEFAULT_FROM_EMAIL setting
+        recipient_list=[user.email])
+
+
+@outbox.handler('order.payment_status_changed')
+def alert_low_stock(event):
+    if event.payload['new_status'] != Order.PAYMENT_STATUS_COMPLETE:
+        return
+    items = OrderItem.objects \
+        .select_related('product') \
+        .filter(order_id=event.payload['order_id'], product__inventory__lt=LOW_INVENTORY)
+    for item in items:
+        logger.warning(
+            'low stock: product %s (%s) has %s left',
+            item.product.id, item.product.title, item.product.inventory)
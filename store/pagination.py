@@ -1,4 +1,11 @@
-from rest_framework.pagination import PageNumberPagination
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.core.exceptions import EmptyResultSet
+from django.db import connections
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 # to resolve this pagiantion warning
 # WARNINGS:
@@ -10,4 +17,71 @@ from rest_framework.pagination import PageNumberPagination
 # on a per-view basis you may silence this check.
 
 class DefaultPagination(PageNumberPagination):
-    page_size = 10
\ No newline at end of file
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    # ?page_size=100 for bigger pages, up to 1000
+
+
+# cursor pagination doesn't need a COUNT(*) or an OFFSET, it remembers
+# the position of the last row on the page (placed_at) in an opaque cursor
+# so every page is a cheap range scan on the (customer, placed_at, id) index
+# no matter how deep into the order history we go
+# id breaks the ties, orders placed at the same time would otherwise come back
+# in any order and a page boundary between them could skip or repeat one
+class OrderCursorPagination(CursorPagination):
+    page_size = 10
+    ordering = ('-placed_at', '-id')
+
+
+ADMIN_PAGINATOR = getattr(settings, 'ADMIN_PAGINATOR', {})
+EXACT_COUNT_THRESHOLD = ADMIN_PAGINATOR.get('EXACT_COUNT_THRESHOLD', 100000)
+COUNT_CACHE_SECONDS = ADMIN_PAGINATOR.get('COUNT_CACHE_SECONDS', 60)
+
+
+def estimated_row_count(model, using):
+    # the number of rows the DB thinks a table has, from the statistics it keeps
+    # for the query planner. it's not exact but it doesn't read the table
+    # returns None if the DB doesn't keep them (e.g sqlite)
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT TABLE_ROWS FROM information_schema.TABLES '
+                'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s', [table])
+        elif connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+        # postgres says -1 for a table that was never analyzed
+    return int(row[0])
+
+
+# the admin changelist runs a COUNT(*) of the whole table on every page
+# which on store_order takes seconds. this paginator
+#   - uses the table statistics when the changelist isn't filtered or searched
+#   - counts exactly when the table is small (below EXACT_COUNT_THRESHOLD)
+#   - caches the count of a filtered changelist for COUNT_CACHE_SECONDS
+# so the number of pages can be a bit off on big tables, use it with
+# show_full_result_count = False on the model admin so it doesn't count the table again
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= EXACT_COUNT_THRESHOLD:
+                return estimate
+            return queryset.count()
+
+        try:
+            (sql, params) = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+            # the filter can never match anything e.g id__in=[]
+        key = 'admin-count:' + hashlib.md5(f'{queryset.db}:{sql}:{params}'.encode()).hexdigest()
+        return cache.get_or_set(key, queryset.count, timeout=COUNT_CACHE_SECONDS)
@@ -1,3 +1,4 @@
+from django.core.cache import cache
 from rest_framework import permissions
 # from rest_framework.permissions import IsAuthenticated, BasePermission
 # NB:BasePermission is the base class for all permissions in django rest framework
@@ -16,6 +17,67 @@ class IsAdminOrReadOnly(permissions.BasePermission):
         # in the bool mtd are true else return false
         
 
+
+# user.has_perm() loads all the permissions of the user (the ones given to the user
+# and the ones of the user's groups) from the DB the first time it's called
+# and keeps them on the user object, so they're gone when the request ends.
+# we keep the set of permissions of each user in the django cache instead
+# so every request after the first one doesn't touch the DB.
+# each entry is stored with the permission version it was computed with,
+# - when the groups or permissions of one user change we delete that user's entry
+# - when the permissions of a group change we don't know which users are affected
+#   so we bump the version and every entry computed with the old version is ignored
+# check store.signals.handlers for the signals that do this
+# the cache is shared by the workers (check CACHES in the settings) so a change made
+# in one worker is seen by all of them on their next request
+PERMISSION_VERSION_KEY = 'permissions:version'
+
+
+def permission_cache_key(user_id):
+    return f'permissions:user:{user_id}'
+
+
+def get_permission_version():
+    return cache.get_or_set(PERMISSION_VERSION_KEY, 1, timeout=None)
+
+
+def bump_permission_version():
+    try:
+        cache.incr(PERMISSION_VERSION_KEY)
+    except ValueError:
+        # the key doesn't exist yet (e.g the cache was cleared)
+        cache.set(PERMISSION_VERSION_KEY, 1, timeout=None)
+
+
+def invalidate_user_permissions(user_id):
+    cache.delete(permission_cache_key(user_id))
+
+
+def get_cached_permissions(user):
+    key = permission_cache_key(user.id)
+    entries = cache.get_many([key, PERMISSION_VERSION_KEY])
+    # one round trip to the cache for both the entry and the current version
+    version = entries.get(PERMISSION_VERSION_KEY) or get_permission_version()
+    entry = entries.get(key)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+
+    perms = frozenset(user.get_all_permissions())
+    # e.g {'store.view_history', 'store.view_customer'}
+    cache.set(key, (version, perms))
+    return perms
+
+
+def has_cached_perms(user, perms):
+    # same rules as user.has_perms(), inactive users have no permissions
+    # and superusers have all of them
+    if not user.is_active:
+        return False
+    if user.is_superuser:
+        return True
+    return set(perms).issubset(get_cached_permissions(user))
+
+
 class FullDjangoModelPermissions(permissions.DjangoModelPermissions):
     def __init__(self) -> None:
         self.perms_map['GET'] = ['%(app_label)s.view_%(model_name)s']
@@ -28,9 +90,26 @@ class FullDjangoModelPermissions(permissions.DjangoModelPermissions):
         # to send a GET request the user should have a view permission
         # we'll use this permission in our customer view set
         # we don't want to pervent users outside the customer services group from viewing data
+
+    # this is DjangoModelPermissions.has_permission, the only difference is the last line
+    # we check the permissions against the cached set instead of request.user.has_perms
+    def has_permission(self, request, view):
+        if not request.user or (
+           not request.user.is_authenticated and self.authenticated_users_only):
+            return False
+
+        if getattr(view, '_ignore_model_permissions', False):
+            return True
+
+        queryset = self._queryset(view)
+        perms = self.get_required_permissions(request.method, queryset.model)
+
+        return has_cached_perms(request.user, perms)
         
 class ViewCustomerHistoryPermission(permissions.BasePermission):
     def has_permission(self, request, view):
-        return request.user.has_perm('store.view_history')
+        return bool(request.user and request.user.is_authenticated) \
+            and has_cached_perms(request.user, ['store.view_history'])
+        # return request.user.has_perm('store.view_history')
         # if this returns true the user will have permission and
         # will be able to access the history
\ No newline at end of file
@@ -0,0 +1,94 @@
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.aggregates import Count
+from django.db.models.functions import TruncDate
+from store import outbox
+from store.models import DailyCollectionSales, DailyProductSales, DailySales, Order, OrderItem
+
+# keeping the sales rollup tables (DailySales, DailyProductSales, DailyCollectionSales)
+# up to date. the totals of an order are added when its payment status becomes
+# complete and taken away if it stops being complete (e.g refunded)
+# this happens in the outbox worker, not in the request (check store.outbox)
+
+revenue = Sum(ExpressionWrapper(
+    F('quantity') * F('unit_price'),
+    output_field=DecimalField(max_digits=12, decimal_places=2)))
+# the price of an order item is the price at the time it was ordered
+
+
+def add_sales(model, key, order_count, quantity, revenue, sign=1):
+    (row, created) = model.objects.get_or_create(**key)
+    model.objects.filter(pk=row.pk).update(
+        order_count=F('order_count') + sign * order_count,
+        quantity=F('quantity') + sign * quantity,
+        revenue=F('revenue') + sign * revenue)
+    # F() makes the DB do the addition so two workers adding to the same row
+    # at the same time don't overwrite each other
+
+
+def rollup_orders(order_ids, sign=1):
+    # order_ids can be a list of ids or a queryset of ids
+    # one aggregate query per rollup table, grouped by day (and product or collection)
+    items = OrderItem.objects \
+        .filter(order_id__in=order_ids) \
+        .annotate(date=TruncDate('order__placed_at'))
+
+    for row in items.values('date').annotate(
+            orders=Count('order_id', distinct=True), units=Sum('quantity'), total=revenue):
+        add_sales(DailySales, {'date': row['date']},
+                  row['orders'], row['units'], row['total'], sign)
+
+    for row in items.values('date', 'product_id').annotate(
+            orders=Count('order_id', distinct=True), units=Sum('quantity'), total=revenue):
+        add_sales(DailyProductSales, {'date': row['date'], 'product_id': row['product_id']},
+                  row['orders'], row['units'], row['total'], sign)
+
+    for row in items.values('date', 'product__collection_id').annotate(
+            orders=Count('order_id', distinct=True), units=Sum('quantity'), total=revenue):
+        add_sales(DailyCollectionSales,
+                  {'date': row['date'], 'collection_id': row['product__collection_id']},
+                  row['orders'], row['units'], row['total'], sign)
+
+
+@outbox.handler('order.payment_status_changed')
+def update_sales_rollups(event):
+    complete = Order.PAYMENT_STATUS_COMPLETE
+    if event.payload['new_status'] == complete:
+        rollup_orders([event.payload['order_id']])
+    elif event.payload['old_status'] == complete:
+        rollup_orders([event.payload['order_id']], sign=-1)
+
+
+def backfill(chunk_size=1000, since=None, progress=None):
+    # rebuilds the rollups from the orders that are complete
+    # since (a date) only rebuilds the days from that date on
+    # stop the outbox worker while this runs, otherwise an order completed in the
+    # middle of the backfill can be counted twice
+    with transaction.atomic():
+        for model in [DailySales, DailyProductSales, DailyCollectionSales]:
+            rows = model.objects.all()
+            if since is not None:
+                rows = rows.filter(date__gte=since)
+            rows.delete()
+
+    orders = Order.objects.filter(payment_status=Order.PAYMENT_STATUS_COMPLETE)
+    if since is not None:
+        orders = orders.filter(placed_at__date__gte=since)
+
+    last_id = 0
+    processed = 0
+    while True:
+        # we go through the orders in chunks ordered by id, each chunk starts after the last id
+        # of the previous one so every chunk is a short query on the primary key
+        # and we never hold the whole history in memory
+        order_ids = list(
+            orders.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not order_ids:
+            break
+        with transaction.atomic():
+            rollup_orders(order_ids)
+        last_id = order_ids[-1]
+        processed += len(order_ids)
+        if progress is not None:
+            progress(processed)
+    return processed
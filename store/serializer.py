@@ -1,5 +1,6 @@
 from decimal import Decimal
-from store.models import Cart, CartItem, Customer, Order, OrderItem, Product, Collection, Review
+from django.db import transaction
+from store.models import ArchivedOrder, ArchivedOrderItem, Cart, CartItem, Customer, CustomerStats, DailySales, Order, OrderItem, OutboxEvent, Product, Collection, Review
 from rest_framework import serializers
 
 
@@ -66,7 +67,7 @@ class ProductSerializer2(serializers.ModelSerializer):
     # this is done so we don't have to redefine all the fields all the time
     class Meta:
         model =  Product
-        fields = ['id', 'title', 'description', 'slug', 'inventory', 'unit_price', 'price_with_tax', 'collection']
+        fields = ['id', 'title', 'description', 'slug', 'inventory', 'unit_price', 'price_with_tax', 'collection', 'like_count', 'liked_by_me']
         # this is done so we don't have to redefine all the fields all the time
         # so django will go to the Product class and look up the 
         # definition of the fields in the array
@@ -95,6 +96,27 @@ class ProductSerializer2(serializers.ModelSerializer):
     price_with_tax = serializers.SerializerMethodField(method_name='calculate_tax')
     def calculate_tax(self, product: Product):
         return product.unit_price * Decimal(1.1)
+
+    like_count = serializers.SerializerMethodField()
+    def get_like_count(self, product: Product):
+        return getattr(product, 'like_count', 0)
+        # the view set annotates the products with their like count
+        # a product that was just created doesn't have it and has no likes
+
+    liked_by_me = serializers.SerializerMethodField()
+    def get_liked_by_me(self, product: Product):
+        return getattr(product, 'liked_by_me', False)
+
+    # ?include=tags adds the tags of each product, the view set loads the tags
+    # of all the products on the page in one query and passes them in the context
+    def to_representation(self, product):
+        data = super().to_representation(product)
+        if 'tags' in self.context:
+            data['tags'] = [
+                {'id': tag.id, 'label': tag.label}
+                for tag in self.context['tags'].get(product.id, [])
+            ]
+        return data
     # validation at the object level
     # validating the request data can involve comparing multple fields
     # our validation rules comes from the definition of model fields
@@ -247,18 +269,26 @@ class AddCartItemSerializer(serializers.ModelSerializer):
         #here we extract the product id 
         cart_id = self.context['cart_id']
 
-        try:
-            cart_item = CartItem.objects.get(cart_id=cart_id, product_id=product_id, quantity=quantity)
-            # update an existing item
-            cart_item.quantity += quantity
-            cart_item.save()
-            self.instance = cart_item
-        except CartItem.DoesNotExist:
-            # create a new item
-            #  **validated_data
-            self.instance = CartItem.objects.create(cart_id=cart_id, **self.validated_data)
-            # cart_item = CartItem.objects.create(cart_id=cart_id, product_id=product_id, quantity=quantity)
-            # is redundant instead we unpack **self.validated_data dictionary
+        with transaction.atomic():
+            try:
+                cart_item = CartItem.objects.get(cart_id=cart_id, product_id=product_id, quantity=quantity)
+                # update an existing item
+                cart_item.quantity += quantity
+                cart_item.save()
+                self.instance = cart_item
+            except CartItem.DoesNotExist:
+                # create a new item
+                #  **validated_data
+                self.instance = CartItem.objects.create(cart_id=cart_id, **self.validated_data)
+                # cart_item = CartItem.objects.create(cart_id=cart_id, product_id=product_id, quantity=quantity)
+                # is redundant instead we unpack **self.validated_data dictionary
+
+            OutboxEvent.objects.publish('cart.item_added', {
+                'cart_id': str(cart_id),
+                'product_id': product_id,
+                'quantity': quantity,
+            })
+            # the event is saved in the same transaction as the cart item (check store.outbox)
 
         return self.instance
 
@@ -278,6 +308,11 @@ class CustomerSerializer(serializers.ModelSerializer):
         model = Customer
         fields = ['id', 'user_id', 'phone', 'birth_date', 'membership']
 
+class CustomerStatsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CustomerStats
+        fields = ['order_count', 'completed_order_count', 'lifetime_spend', 'average_basket', 'last_order_at']
+
 class OrderItemSerializer(serializers.ModelSerializer):
     product = SimpleProductSerializer()
     class Meta:
@@ -296,6 +331,19 @@ class OrderSerializer(serializers.ModelSerializer):
         model = Order
         fields = ['id', 'customer', 'placed_at', 'payment_status', "items"]
 
+# archived orders have the same shape as orders (check store.archive)
+class ArchivedOrderItemSerializer(serializers.ModelSerializer):
+    product = SimpleProductSerializer()
+    class Meta:
+        model = ArchivedOrderItem
+        fields = ['id', 'product', 'quantity', 'unit_price']
+
+class ArchivedOrderSerializer(serializers.ModelSerializer):
+    items = ArchivedOrderItemSerializer(many=True)
+    class Meta:
+        model = ArchivedOrder
+        fields = ['id', 'customer', 'placed_at', 'payment_status', 'items', 'archived_at']
+
 # when creating an order all we have to send to the server is the cart id
 # we can't use the order serializer cus the object has a different structure compare to
 # the object we want to send to the server, check the fields. 
@@ -311,14 +359,53 @@ class CreateOrderSerializer(serializers.Serializer):
     def save(self, **kwargs):
         print(self.validated_data['cart_id'])
 
-        # to get the user id
-        print(self.context['user_id'])
-        (customer, created) = Customer.objects.get_or_create(user_id=self.context['user_id'])
+        # to get the customer id
+        # (customer, created) = Customer.objects.get_or_create(user_id=self.context['user_id'])
         # using get_or_create in in the save mtd is not in violation of the command query separation principle
         # cus we can change the state of the system the save mtd
         # the save mtd is a command not a query
-        Order.objects.create(customer=customer)
-        # we are passing the customer object cus the customer field is the only 
+        # the view set now passes the customer id it read from the token
+        # so we don't have to look up the customer at all
+        Order.objects.create(customer_id=self.context['customer_id'])
+        # Order.save writes an order.created event to the outbox in the same transaction as the order
+        # we are passing the customer id cus the customer field is the only 
         # field in the Order model that's we need to set
         # unlike placed_at which is set automatically, payment_status which has a default value
         # return super().save(**kwargs)
+
+
+# sales analytics, these serializers are read only
+# they serve the rollup tables (check store.rollups)
+class SalesRangeSerializer(serializers.Serializer):
+    # the query string of the analytics endpoints
+    # e.g ?start=2024-01-01&end=2024-01-31
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    limit = serializers.IntegerField(required=False, min_value=1, max_value=1000, default=100)
+
+    def validate(self, data):
+        if 'start' in data and 'end' in data and data['start'] > data['end']:
+            raise serializers.ValidationError('start must be before end')
+        return data
+
+
+class DailySalesSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DailySales
+        fields = ['date', 'order_count', 'quantity', 'revenue']
+
+
+class ProductSalesSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    title = serializers.CharField(source='product__title')
+    order_count = serializers.IntegerField()
+    quantity = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+
+class CollectionSalesSerializer(serializers.Serializer):
+    collection_id = serializers.IntegerField()
+    title = serializers.CharField(source='collection__title')
+    order_count = serializers.IntegerField()
+    quantity = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=12, decimal_places=2)
@@ -0,0 +1,109 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from store import autocomplete
+from store.models import Collection, Customer, Product
+from store.permissions import bump_permission_version, invalidate_user_permissions
+from tags.models import Tag
+
+# signals are notifications django sends at different stages of the life cycle
+# of a model e.g pre_save, post_save, pre_delete, post_delete
+# we listen to them here so the store app can react to things that happen
+# in other apps (like the core app creating a user) without them knowing about the store app
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+# we are listening to the post_save signal of the user model
+# we are using settings.AUTH_USER_MODEL cus we shouldn't reference the user model in the core app directly
+def create_customer_for_new_user(sender, **kwargs):
+    # we create the customer record the moment the user registers
+    # so at login we can put the customer id inside the token (check core.serializers)
+    # and the order endpoints don't have to call get_or_create on every request
+    if kwargs['created']:
+        Customer.objects.create(user=kwargs['instance'])
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+# Customer.sort_name and reverse_sort_name are copies of the user's names so we update them when they change
+def update_customer_sort_name(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        return
+        # the customer was just created with the right sort name
+    if update_fields is not None and not {'first_name', 'last_name'} & set(update_fields):
+        return
+        # e.g logging in only saves last_login
+    sort_name = Customer.make_sort_name(instance.first_name, instance.last_name)
+    reverse_sort_name = Customer.make_sort_name(instance.last_name, instance.first_name)
+    Customer.objects \
+        .filter(user_id=instance.pk) \
+        .exclude(sort_name=sort_name, reverse_sort_name=reverse_sort_name) \
+        .update(sort_name=sort_name, reverse_sort_name=reverse_sort_name)
+
+
+# keeping the permission cache up to date (check store.permissions)
+User = get_user_model()
+
+
+@receiver([post_save, post_delete], sender=settings.AUTH_USER_MODEL)
+def invalidate_permissions_of_saved_user(sender, **kwargs):
+    # is_active and is_superuser change what has_cached_perms returns
+    invalidate_user_permissions(kwargs['instance'].pk)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+# .through is the table django creates for a many to many relationship
+# e.g core_user_groups for User.groups
+def invalidate_permissions_of_user(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        # user.groups.add(group), instance is the user
+        invalidate_user_permissions(instance.pk)
+    elif pk_set:
+        # group.user_set.add(user), instance is the group and pk_set the users
+        for user_id in pk_set:
+            invalidate_user_permissions(user_id)
+    else:
+        # group.user_set.clear() doesn't tell us which users were affected
+        bump_permission_version()
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_permissions_of_group(sender, action, **kwargs):
+    # every member of the group is affected so we invalidate every entry
+    if action.startswith('post_'):
+        bump_permission_version()
+
+
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Permission)
+def invalidate_permissions_of_deleted(sender, **kwargs):
+    bump_permission_version()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Collection)
+@receiver(post_save, sender=Tag)
+# keeping the autocomplete indexes up to date (check store.autocomplete)
+def update_autocomplete(sender, instance, update_fields=None, **kwargs):
+    index = autocomplete.by_model[sender]
+    if update_fields is not None and index.field not in update_fields:
+        return
+    saved = sender(pk=instance.pk, **{index.field: getattr(instance, index.field)})
+    transaction.on_commit(lambda: index.changed(saved))
+    # only once the row is committed, a rolled back save must not show up in the suggestions
+    # (or bump the version other workers reload on). saved is a copy of what was written
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Collection)
+@receiver(post_delete, sender=Tag)
+def remove_from_autocomplete(sender, instance, **kwargs):
+    index = autocomplete.by_model[sender]
+    deleted = sender(pk=instance.pk)
+    transaction.on_commit(lambda: index.changed(deleted, deleted=True))
+    # a copy, django sets the pk of the deleted instance to None after this signal
@@ -1,3 +1,671 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from unittest import mock
+from uuid import uuid4
+from django.contrib.admin import site
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.core import mail
+from django.core.cache import cache, caches
+from django.core.exceptions import PermissionDenied
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from store import admin_jobs, archive, autocomplete, customer_stats, export, outbox, rollups
+from store.pagination import EstimatedCountPaginator
+from store.models import AdminJob, ArchivedOrderItem, Collection, Customer, CustomerStats, DailySales, Order, OrderItem, OutboxEvent, Product
+from store.permissions import PERMISSION_VERSION_KEY, bump_permission_version, get_permission_version, has_cached_perms
+from store.serializer import CustomerStatsSerializer
+from tags.models import Tag, TaggedItem
+from likes.models import LikeCounter, LikedItem
 
 # Create your tests here.
+
+
+class OrderListQueryCountTests(APITestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username='buyer', email='buyer@domain.com', password='secret')
+        self.customer = self.user.customer
+        # the customer is created for us when the user registers
+        collection = Collection.objects.create(title='a')
+        self.products = [
+            Product.objects.create(
+                title=f'product {i}', slug=f'product-{i}', unit_price=10,
+                inventory=10, collection=collection)
+            for i in range(3)
+        ]
+        self.client.force_authenticate(user=self.user)
+
+    def create_orders(self, count):
+        for _ in range(count):
+            order = Order.objects.create(customer=self.customer)
+            for product in self.products:
+                OrderItem.objects.create(
+                    order=order, product=product, quantity=1, unit_price=product.unit_price)
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/store/orders/')
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response
+
+    def test_query_count_does_not_grow_with_orders(self):
+        self.create_orders(1)
+        (queries_for_one, response) = self.count_queries()
+        self.assertEqual(len(response.data['results']), 1)
+
+        self.create_orders(8)
+        (queries_for_many, response) = self.count_queries()
+        self.assertEqual(len(response.data['results']), 9)
+        self.assertEqual(len(response.data['results'][0]['items']), 3)
+
+        self.assertEqual(queries_for_one, queries_for_many)
+
+    def test_orders_are_paginated_newest_first(self):
+        self.create_orders(12)
+        response = self.client.get('/store/orders/')
+        results = response.data['results']
+        self.assertEqual(len(results), 10)
+        self.assertIsNotNone(response.data['next'])
+        placed_at = [order['placed_at'] for order in results]
+        self.assertEqual(placed_at, sorted(placed_at, reverse=True))
+
+    def test_orders_placed_at_the_same_time_are_not_skipped_or_repeated(self):
+        self.create_orders(25)
+        Order.objects.update(placed_at=timezone.now())
+        ids = []
+        url = '/store/orders/'
+        while url:
+            response = self.client.get(url)
+            ids += [order['id'] for order in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(ids, sorted(Order.objects.values_list('id', flat=True), reverse=True))
+
+
+class OrderTokenClaimsTests(APITestCase):
+    def test_orders_resolve_customer_from_token(self):
+        user = get_user_model().objects.create_user(
+            username='buyer', email='buyer@domain.com', password='secret')
+        response = self.client.post(
+            '/auth/jwt/create/', {'username': 'buyer', 'password': 'secret'})
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + response.data['access'])
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post('/store/orders/', {'cart_id': str(uuid4())})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Order.objects.get().customer_id, user.customer.id)
+        self.assertEqual(len([query for query in context.captured_queries
+                              if 'FROM "store_customer"' in query['sql']]), 1)
+        # only the check that the customer of the token still exists, not a lookup by user
+
+    def test_staff_access_follows_the_user_not_the_token(self):
+        admin = get_user_model().objects.create_user(
+            username='admin', email='admin@domain.com', password='secret', is_staff=True)
+        buyer = get_user_model().objects.create_user(
+            username='buyer', email='buyer@domain.com', password='secret')
+        Order.objects.create(customer=buyer.customer)
+        response = self.client.post(
+            '/auth/jwt/create/', {'username': 'admin', 'password': 'secret'})
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + response.data['access'])
+        self.assertEqual(len(self.client.get('/store/orders/').data['results']), 1)
+
+        admin.is_staff = False
+        admin.save()
+        self.assertEqual(len(self.client.get('/store/orders/').data['results']), 0)
+
+    def test_me_falls_back_to_the_user_when_the_token_customer_is_gone(self):
+        user = get_user_model().objects.create_user(
+            username='buyer', email='buyer@domain.com', password='secret')
+        response = self.client.post(
+            '/auth/jwt/create/', {'username': 'buyer', 'password': 'secret'})
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + response.data['access'])
+        user.customer.delete()
+        self.assertEqual(self.client.get('/store/customers/me/').status_code, 404)
+
+        customer = Customer.objects.create(user=user)
+        response = self.client.get('/store/customers/me/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id'], customer.id)
+
+    def test_orders_fall_back_to_the_user_when_the_token_customer_is_gone(self):
+        user = get_user_model().objects.create_user(
+            username='buyer', email='buyer@domain.com', password='secret')
+        response = self.client.post(
+            '/auth/jwt/create/', {'username': 'buyer', 'password': 'secret'})
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + response.data['access'])
+        user.customer.delete()
+        self.assertEqual(self.client.post('/store/orders/', {'cart_id': str(uuid4())}).status_code, 404)
+
+        customer = Customer.objects.create(user=user)
+        self.assertEqual(self.client.post('/store/orders/', {'cart_id': str(uuid4())}).status_code, 201)
+        self.assertEqual(Order.objects.get().customer_id, customer.id)
+
+
+class PermissionCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username='agent', email='agent@domain.com', password='secret')
+        self.group = Group.objects.create(name='customer service')
+        self.permission = Permission.objects.get(codename='view_history')
+
+    def test_permissions_are_cached_and_invalidated(self):
+        self.user.groups.add(self.group)
+        self.assertFalse(has_cached_perms(self.user, ['store.view_history']))
+
+        self.group.permissions.add(self.permission)
+        user = get_user_model().objects.get(pk=self.user.pk)
+        self.assertTrue(has_cached_perms(user, ['store.view_history']))
+        with self.assertNumQueries(0):
+            self.assertTrue(has_cached_perms(user, ['store.view_history']))
+
+        self.user.groups.remove(self.group)
+        user = get_user_model().objects.get(pk=self.user.pk)
+        self.assertFalse(has_cached_perms(user, ['store.view_history']))
+
+    def test_invalidation_reaches_other_workers(self):
+        self.user.groups.add(self.group)
+        self.group.permissions.add(self.permission)
+        self.assertTrue(has_cached_perms(self.user, ['store.view_history']))
+        other_worker = caches.create_connection('default')
+        # the cache backend another process would have
+        version = other_worker.get(PERMISSION_VERSION_KEY)
+
+        self.group.permissions.remove(self.permission)
+        self.assertNotEqual(other_worker.get(PERMISSION_VERSION_KEY), version)
+        with mock.patch('store.permissions.cache', other_worker):
+            user = get_user_model().objects.get(pk=self.user.pk)
+            self.assertFalse(has_cached_perms(user, ['store.view_history']))
+
+    def test_concurrent_version_bumps_are_not_lost(self):
+        version = get_permission_version()
+        threads = [threading.Thread(target=lambda: [bump_permission_version() for _ in range(25)])
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(get_permission_version(), version + 200)
+
+
+class CustomerSearchTests(TestCase):
+    def test_customers_are_found_by_first_or_last_name(self):
+        User = get_user_model()
+        john = User.objects.create_user(
+            username='john', email='john@domain.com', password='secret', first_name='John', last_name='Smith')
+        jane = User.objects.create_user(
+            username='jane', email='jane@domain.com', password='secret', first_name='Jane', last_name='Doe')
+        jane.last_name = 'Smithers'
+        jane.save()
+        customer_admin = site._registry[Customer]
+        for (term, users) in [('john sm', [john]), ('Smith', [jane, john]), ('smith j', [john]),
+                              ('smithers', [jane]), ('doe', [])]:
+            (queryset, _) = customer_admin.get_search_results(None, Customer.objects.all(), term)
+            self.assertEqual([customer.user for customer in queryset], users, term)
+
+    def test_the_last_name_column_sorts_by_the_customer_table(self):
+        User = get_user_model()
+        ann = User.objects.create_user(
+            username='ann', email='ann@domain.com', password='secret', first_name='Ann', last_name='Zed')
+        bob = User.objects.create_user(
+            username='bob', email='bob@domain.com', password='secret', first_name='Bob', last_name='Abel')
+        self.client.force_login(User.objects.create_superuser(
+            username='admin', email='admin@domain.com', password='secret'))
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/admin/store/customer/', {'o': '2'})
+            # o=2 is the second column of list_display, last_name
+        users = [customer.user for customer in response.context['cl'].result_list]
+        self.assertEqual([user for user in users if user.username != 'admin'], [bob, ann])
+        self.assertTrue(any('ORDER BY "store_customer"."reverse_sort_name"' in query['sql']
+                            for query in context.captured_queries))
+
+
+class OutboxTests(TestCase):
+    def test_order_events_are_processed_once(self):
+        user = get_user_model().objects.create_user(
+            username='buyer', email='buyer@domain.com', password='secret')
+        order = Order.objects.create(customer=user.customer)
+        order = Order.objects.get(pk=order.pk)
+        order.payment_status = Order.PAYMENT_STATUS_COMPLETE
+        order.save()
+        self.assertEqual(
+            list(OutboxEvent.objects.order_by('id').values_list('topic', flat=True)),
+            ['order.created', 'order.payment_status_changed'])
+
+        event_ids = outbox.claim_events()
+        self.assertEqual(outbox.claim_events(), [])
+        # claimed events are leased to the worker that claimed them
+        results = [outbox.process_event(event_id) for event_id in event_ids]
+        self.assertEqual(results, ['done', 'done'])
+        self.assertEqual(len(mail.outbox), 1)
+
+        outbox.process_event(event_ids[0])
+        # running an event again doesn't run its handlers again
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class SalesRollupTests(APITestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username='admin', email='admin@domain.com', password='secret', is_staff=True)
+        collection = Collection.objects.create(title='a')
+        self.product = Product.objects.create(
+            title='a', slug='a', unit_price=10, inventory=100, collection=collection)
+
+    def complete_order(self, quantity):
+        order = Order.objects.create(customer=self.user.customer)
+        OrderItem.objects.create(order=order, product=self.product, quantity=quantity, unit_price=10)
+        order = Order.objects.get(pk=order.pk)
+        order.payment_status = Order.PAYMENT_STATUS_COMPLETE
+        order.save()
+        return order
+
+    def test_rollups_follow_completed_orders(self):
+        self.complete_order(2)
+        self.complete_order(3)
+        for event_id in outbox.claim_events():
+            outbox.process_event(event_id)
+
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get('/store/analytics/products/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]['order_count'], 2)
+        self.assertEqual(response.data[0]['quantity'], 5)
+        self.assertEqual(response.data[0]['revenue'], 50)
+
+        incremental = list(DailySales.objects.values_list('order_count', 'quantity', 'revenue'))
+        rollups.backfill(chunk_size=1)
+        self.assertEqual(
+            list(DailySales.objects.values_list('order_count', 'quantity', 'revenue')), incremental)
+
+
+class CustomerStatsTests(APITestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username='admin', email='admin@domain.com', password='secret', is_staff=True)
+        collection = Collection.objects.create(title='a')
+        self.product = Product.objects.create(
+            title='a', slug='a', unit_price=10, inventory=100, collection=collection)
+
+    def test_customer_history_returns_stats(self):
+        order = Order.objects.create(customer=self.user.customer)
+        OrderItem.objects.create(order=order, product=self.product, quantity=2, unit_price=10)
+        order = Order.objects.get(pk=order.pk)
+        order.payment_status = Order.PAYMENT_STATUS_COMPLETE
+        order.save()
+        Order.objects.create(customer=self.user.customer)
+        for event_id in outbox.claim_events():
+            outbox.process_event(event_id)
+        incremental = CustomerStatsSerializer(CustomerStats.objects.get()).data
+        self.assertEqual(incremental['order_count'], 2)
+        self.assertEqual(incremental['completed_order_count'], 1)
+        self.assertEqual(incremental['average_basket'], 20)
+
+        customer_stats.rebuild()
+        self.assertEqual(CustomerStatsSerializer(CustomerStats.objects.get()).data, incremental)
+
+        self.user.is_superuser = True
+        self.user.save()
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(f'/store/customers/{self.user.customer.id}/history/')
+        self.assertEqual(response.data['stats'], incremental)
+        self.assertEqual(len(response.data['results']), 2)
+
+
+class ArchiveTests(APITestCase):
+    def test_old_orders_move_to_the_archive(self):
+        user = get_user_model().objects.create_user(
+            username='buyer', email='buyer@domain.com', password='secret')
+        collection = Collection.objects.create(title='a')
+        product = Product.objects.create(
+            title='a', slug='a', unit_price=10, inventory=100, collection=collection)
+        for status in [Order.PAYMENT_STATUS_COMPLETE, Order.PAYMENT_STATUS_PENDING]:
+            order = Order.objects.create(customer=user.customer, payment_status=status)
+            OrderItem.objects.create(order=order, product=product, quantity=2, unit_price=10)
+
+        archived = archive.archive_orders(timezone.now() + timedelta(days=1), batch_size=1)
+        self.assertEqual(archived, 1)
+        # the pending order stays
+        self.assertEqual(Order.objects.get().payment_status, Order.PAYMENT_STATUS_PENDING)
+        self.assertEqual(ArchivedOrderItem.objects.get().quantity, 2)
+
+        self.client.force_authenticate(user=user)
+        response = self.client.get('/store/archived-orders/')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['items'][0]['product']['id'], product.id)
+
+        other = get_user_model().objects.create_user(
+            username='other', email='other@domain.com', password='secret')
+        self.client.force_authenticate(user=other)
+        self.assertEqual(len(self.client.get('/store/archived-orders/').data['results']), 0)
+        other.is_staff = True
+        other.save()
+        self.assertEqual(len(self.client.get('/store/archived-orders/').data['results']), 1)
+
+
+class ProductIncludeTagsTests(APITestCase):
+    def setUp(self):
+        self.collection = Collection.objects.create(title='a')
+        self.tags = [Tag.objects.create(label='red'), Tag.objects.create(label='blue')]
+
+    def create_products(self, count):
+        products = []
+        for _ in range(count):
+            i = Product.objects.count()
+            product = Product.objects.create(
+                title=f'product {i}', slug=f'product-{i}', unit_price=10, inventory=1, collection=self.collection)
+            for tag in self.tags:
+                TaggedItem.objects.create(tag=tag, content_object=product)
+            products.append(product)
+        return products
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/store/products/?include=tags&page_size=100')
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response
+
+    def test_tags_of_a_page_are_loaded_in_one_query(self):
+        self.create_products(1)
+        self.count_queries()
+        # the content type is cached after the first request
+        (queries_for_one, response) = self.count_queries()
+        self.assertEqual(sorted(tag['label'] for tag in response.data['results'][0]['tags']), ['blue', 'red'])
+
+        self.create_products(9)
+        (queries_for_many, response) = self.count_queries()
+        self.assertEqual(len(response.data['results']), 10)
+        self.assertTrue(all(len(product['tags']) == 2 for product in response.data['results']))
+        self.assertEqual(queries_for_one, queries_for_many)
+        self.assertNotIn('tags', self.client.get('/store/products/').data['results'][0])
+
+    def test_untagged_objects_get_no_tags(self):
+        (tagged,) = self.create_products(1)
+        untagged = Product.objects.create(
+            title='untagged', slug='untagged', unit_price=10, inventory=1, collection=self.collection)
+        tags = TaggedItem.objects.get_tags_for_many(Product, [tagged.id, untagged.id])
+        self.assertEqual(tags[untagged.id], [])
+        self.assertEqual(sorted(tag.label for tag in tags[tagged.id]), ['blue', 'red'])
+        self.assertEqual(TaggedItem.objects.get_tags_for_many(Product, []), {})
+
+
+class ProductTagFilterTests(APITestCase):
+    def test_filter_products_by_any_or_all_tags(self):
+        collection = Collection.objects.create(title='a')
+        (both, red, none) = [
+            Product.objects.create(
+                title=title, slug=title, unit_price=10, inventory=10, collection=collection)
+            for title in ['both', 'red', 'none']
+        ]
+        tags = {label: Tag.objects.create(label=label) for label in ['red', 'blue']}
+        for (product, labels) in [(both, ['red', 'blue']), (red, ['red'])]:
+            for label in labels:
+                TaggedItem.objects.create(content_object=product, tag=tags[label])
+
+        def ids(query):
+            return {product['id'] for product in self.client.get(f'/store/products/?{query}').data['results']}
+        self.assertEqual(ids('tag=red,blue'), {both.id, red.id})
+        self.assertEqual(ids('tag=red,blue&tag_match=all'), {both.id})
+        self.assertEqual(ids('tag=blue'), {both.id})
+
+
+class ProductLikeTests(APITestCase):
+    def test_like_and_unlike_are_idempotent(self):
+        user = get_user_model().objects.create_user(
+            username='buyer', email='buyer@domain.com', password='secret')
+        product = Product.objects.create(
+            title='a', slug='a', unit_price=10, inventory=10,
+            collection=Collection.objects.create(title='a'))
+        self.client.force_authenticate(user=user)
+
+        for _ in range(2):
+            response = self.client.post(f'/store/products/{product.id}/like/')
+            self.assertEqual(response.data, {'liked': True, 'like_count': 1})
+        self.assertEqual(self.client.get('/store/products/').data['results'][0]['like_count'], 1)
+
+        for _ in range(2):
+            response = self.client.delete(f'/store/products/{product.id}/like/')
+            self.assertEqual(response.data, {'liked': False, 'like_count': 0})
+
+    def test_unlike_of_a_deleted_like_does_not_lower_the_count(self):
+        (first, second) = [
+            get_user_model().objects.create_user(
+                username=name, email=f'{name}@domain.com', password='secret')
+            for name in ['first', 'second']
+        ]
+        product = Product.objects.create(
+            title='a', slug='a', unit_price=10, inventory=10,
+            collection=Collection.objects.create(title='a'))
+        for user in [first, second]:
+            LikedItem.objects.like(user, product)
+
+        self.assertTrue(LikedItem.objects.unlike(first, product))
+        self.assertFalse(LikedItem.objects.unlike(first, product))
+        # e.g a second request unliking at the same time, the row is already gone
+        self.assertEqual(LikeCounter.objects.count_for(product), 1)
+
+        LikedItem.objects.like(first, product)
+        second.delete()
+        self.assertEqual(LikeCounter.objects.count_for(product), 1)
+        self.assertEqual(LikedItem.objects.count(), 1)
+
+    def test_liked_by_me_query_count_does_not_grow_with_page_size(self):
+        user = get_user_model().objects.create_user(
+            username='buyer', email='buyer@domain.com', password='secret')
+        collection = Collection.objects.create(title='a')
+        products = Product.objects.bulk_create([
+            Product(title=f'{i}', slug=f'{i}', unit_price=10, inventory=10, collection=collection)
+            for i in range(1000)
+        ])
+        for product in products[::2]:
+            LikedItem.objects.like(user, product)
+        self.client.force_authenticate(user=user)
+
+        query_counts = set()
+        for page_size in [10, 100, 1000]:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(f'/store/products/?page_size={page_size}&ordering=like_count')
+            query_counts.add(len(queries))
+            results = response.data['results']
+            self.assertEqual(len(results), page_size)
+            self.assertTrue(all(p['liked_by_me'] == (p['like_count'] == 1) for p in results))
+        self.assertEqual(len(query_counts), 1)
+
+
+class EstimatedCountPaginatorTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.collection = Collection.objects.create(title='a')
+        Product.objects.bulk_create([
+            Product(title=f'{i}', slug=f'{i}', unit_price=10, inventory=i, collection=self.collection)
+            for i in range(5)
+        ])
+
+    def test_unfiltered_count_uses_table_statistics_above_threshold(self):
+        with mock.patch('store.pagination.estimated_row_count', return_value=10 ** 7):
+            self.assertEqual(EstimatedCountPaginator(Product.objects.all(), 10).count, 10 ** 7)
+        with mock.patch('store.pagination.estimated_row_count', return_value=4):
+            self.assertEqual(EstimatedCountPaginator(Product.objects.all(), 10).count, 5)
+            # small tables are counted exactly
+
+    def test_filtered_count_is_cached(self):
+        products = Product.objects.filter(inventory__lt=3)
+        self.assertEqual(EstimatedCountPaginator(products, 10).count, 3)
+        Product.objects.create(title='x', slug='x', unit_price=10, inventory=0, collection=self.collection)
+        with self.assertNumQueries(0):
+            self.assertEqual(EstimatedCountPaginator(products, 10).count, 3)
+
+    def test_admin_changelist(self):
+        admin = get_user_model().objects.create_superuser(
+            username='admin', email='admin@domain.com', password='secret')
+        self.client.force_login(admin)
+        for url in ['/admin/store/product/', '/admin/store/order/', '/admin/store/customer/?q=a']:
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class AdminJobTests(TestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='a')
+        Product.objects.bulk_create([
+            Product(title=f'{i}', slug=f'{i}', unit_price=10, inventory=i, collection=collection)
+            for i in range(1, 8)
+        ])
+        self.admin = get_user_model().objects.create_superuser(
+            username='admin', email='admin@domain.com', password='secret')
+        self.client.force_login(self.admin)
+
+    def post_action(self, data, querystring='inventory__gte=1'):
+        return self.client.post(f'/admin/store/product/?{querystring}', {
+            'action': data.pop('action'), 'select_across': '1',
+            '_selected_action': [Product.objects.first().pk], **data}, follow=True)
+
+    def test_big_selections_run_in_chunks_in_the_background(self):
+        with mock.patch.object(admin_jobs, 'SYNC_LIMIT', 2), mock.patch.object(admin_jobs, 'CHUNK_SIZE', 3):
+            response = self.post_action({'action': 'adjust_prices'})
+            self.assertContains(response, 'name="percent"')
+            self.post_action({'action': 'adjust_prices', 'percent': '-10', 'apply': '1'})
+            # nothing changes until the worker runs the job
+            self.assertEqual(Product.objects.filter(unit_price=9).count(), 0)
+            job = AdminJob.objects.get()
+            self.assertEqual(job.total, 7)
+            for event in OutboxEvent.objects.all():
+                outbox.process_event(event.id)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed), (AdminJob.STATUS_DONE, 7))
+        self.assertEqual(Product.objects.filter(unit_price=9).count(), 7)
+
+        self.assertContains(self.client.get(f'/admin/store/adminjob/{job.id}/change/'), '7 / 7 (100%)')
+
+    def test_select_all_jobs_keep_the_changelist_filters(self):
+        with mock.patch.object(admin_jobs, 'SYNC_LIMIT', 2):
+            self.post_action({'action': 'clear_inventory'}, 'inventory__gte=4')
+            job = AdminJob.objects.get()
+            self.assertEqual(job.selection, {'changelist': 'inventory__gte=4'})
+            for event in OutboxEvent.objects.all():
+                outbox.process_event(event.id)
+        self.assertEqual(list(Product.objects.filter(inventory=0).values_list('title', flat=True).order_by('id')),
+                         ['4', '5', '6', '7'])
+
+    def test_select_all_jobs_stop_if_the_user_lost_the_permission(self):
+        with mock.patch.object(admin_jobs, 'SYNC_LIMIT', 2):
+            self.post_action({'action': 'clear_inventory'})
+        self.admin.is_superuser = False
+        self.admin.save()
+        with self.assertRaises(PermissionDenied):
+            admin_jobs.run_job(AdminJob.objects.get())
+        self.assertFalse(Product.objects.filter(inventory=0).exists())
+
+    def test_cancelled_jobs_stop_between_chunks(self):
+        job = admin_jobs.start_job(Product.objects.all(), 'clear_inventory', user=self.admin)
+        self.assertEqual(job.selection, {'pks': list(Product.objects.values_list('pk', flat=True))})
+        with mock.patch.object(admin_jobs, 'CHUNK_SIZE', 3):
+            admin_jobs.run_job(job, on_chunk=lambda job: AdminJob.objects.update(cancel_requested=True))
+        self.assertEqual((job.status, job.processed), (AdminJob.STATUS_CANCELLED, 3))
+        self.assertEqual(Product.objects.filter(inventory=0).count(), 3)
+
+    def test_small_selections_run_right_away(self):
+        self.post_action({'action': 'clear_inventory'})
+        self.assertFalse(AdminJob.objects.exists())
+        self.assertEqual(Product.objects.filter(inventory=0).count(), 7)
+
+
+class AdminRelatedTests(TestCase):
+    @override_settings(ADMIN_QUERY_DEBUG=True)
+    def test_order_changelist_query_count_is_fixed(self):
+        admin = get_user_model().objects.create_superuser(
+            username='admin', email='admin@domain.com', password='secret')
+        self.client.force_login(admin)
+        query_counts = set()
+        for i in range(3):
+            user = get_user_model().objects.create_user(
+                username=f'buyer{i}', email=f'buyer{i}@domain.com', password='secret')
+            Order.objects.create(customer=user.customer)
+            response = self.client.get('/admin/store/order/')
+            query_counts.add(int(response['X-Admin-Query-Count']))
+        self.assertEqual(len(query_counts), 1)
+        self.assertGreater(query_counts.pop(), 0)
+
+
+class AutocompleteTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        for index in autocomplete.by_model.values():
+            index.version = None
+        self.collection = Collection.objects.create(title='Drinks')
+        self.coke = Product.objects.create(
+            title='Diet Coke Lemon', slug='coke', unit_price=10, inventory=10, collection=self.collection)
+
+    def test_suggestions_follow_saves_and_deletes(self):
+        self.assertEqual(self.client.get('/store/products/suggest/?q=le').data,
+                         [{'id': self.coke.id, 'title': 'Diet Coke Lemon'}])
+        self.coke.title = 'Diet Cola'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.coke.save()
+        self.assertEqual(self.client.get('/store/products/suggest/?q=le').data, [])
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.client.get('/store/products/suggest/?q=diet  co').data), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.coke.delete()
+        self.assertEqual(self.client.get('/store/products/suggest/?q=diet').data, [])
+
+    def test_rolled_back_saves_do_not_change_the_suggestions(self):
+        self.assertEqual(len(self.client.get('/store/products/suggest/?q=le').data), 1)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                self.coke.title = 'Diet Cola'
+                self.coke.save()
+                transaction.set_rollback(True)
+        self.assertEqual(callbacks, [])
+        self.assertEqual(self.client.get('/store/products/suggest/?q=le').data,
+                         [{'id': self.coke.id, 'title': 'Diet Coke Lemon'}])
+
+    def test_a_process_reloads_when_another_one_changed_the_index_too(self):
+        (mine, other) = (autocomplete.ModelIndex(Product, 'title'), autocomplete.ModelIndex(Product, 'title'))
+        # the same index in two processes, they share the cache
+        self.assertEqual(len(mine.search('diet')), 1)
+        self.assertEqual(len(other.search('diet')), 1)
+        pepsi = Product.objects.create(
+            title='Diet Pepsi', slug='pepsi', unit_price=10, inventory=10, collection=self.collection)
+        other.changed(pepsi)
+        Product.objects.filter(pk=self.coke.pk).update(title='Diet Cola')
+        self.coke.title = 'Diet Cola'
+        mine.changed(self.coke)
+        # mine didn't get the only bump, it must not keep an index without Diet Pepsi
+        self.assertEqual(sorted(title for (id, title) in mine.search('diet')), ['Diet Cola', 'Diet Pepsi'])
+
+    def test_admin_autocomplete_uses_the_index(self):
+        admin = get_user_model().objects.create_superuser(
+            username='admin', email='admin@domain.com', password='secret')
+        self.client.force_login(admin)
+        response = self.client.get('/admin/autocomplete/', {
+            'term': 'drin', 'app_label': 'store', 'model_name': 'product', 'field_name': 'collection'})
+        self.assertEqual([result['id'] for result in response.json()['results']], [str(self.collection.id)])
+
+
+class ExportTests(TestCase):
+    def test_orders_are_streamed_in_chunks(self):
+        admin = get_user_model().objects.create_superuser(
+            username='admin', email='admin@domain.com', password='secret', first_name='Ada')
+        product = Product.objects.create(
+            title='a', slug='a', unit_price=10, inventory=10, collection=Collection.objects.create(title='a'))
+        orders = []
+        for quantity in range(1, 6):
+            order = Order.objects.create(customer=admin.customer)
+            OrderItem.objects.create(order=order, product=product, quantity=quantity, unit_price=10)
+            orders.append(order)
+        self.client.force_login(admin)
+
+        with mock.patch.object(export, 'CHUNK_SIZE', 2), CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/admin/store/order/', {
+                'action': 'export_csv', 'select_across': '1', '_selected_action': [orders[0].id]})
+            lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,placed_at,payment_status,customer_id,first_name,last_name,email,item_count,total')
+        self.assertEqual(len(lines), 6)
+        self.assertTrue(lines[5].startswith(f'{orders[4].id},'))
+        self.assertIn(',Ada,,admin@domain.com,1,50', lines[5])
+        self.assertEqual(len([q for q in queries if 'store_orderitem' in q['sql']]), 4)
+        # 5 orders in chunks of 2, and the empty chunk at the end
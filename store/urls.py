@@ -32,6 +32,10 @@ router.register('collections', views.CollectionViewSet)
 router.register('carts', views.CartViewSet)
 router.register('customers', views.CustomerViewSet)
 router.register('orders', views.OrderViewSet, basename='orders')
+router.register('archived-orders', views.ArchivedOrderViewSet, basename='archived-orders')
+router.register('analytics', views.SalesAnalyticsViewSet, basename='analytics')
+# analytics only has custom actions so we'll have analytics-daily, analytics-products
+# and analytics-collections
 
 products_router = routers.NestedDefaultRouter(router, 'products', lookup='product')
 # lookup ?
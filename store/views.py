@@ -11,12 +11,17 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet, GenericViewSet
 from rest_framework import status
+from store import autocomplete
 from store.filter import ProductFilter
-from store.pagination import DefaultPagination
+from store.pagination import DefaultPagination, OrderCursorPagination
 from store.permissions import FullDjangoModelPermissions, IsAdminOrReadOnly, ViewCustomerHistoryPermission
-from .models import Cart, CartItem, Customer, Order, OrderItem, Product, Collection, Review
-from .serializer import AddCartItemSerializer, CartItemSerializer, CartSerializer, CreateOrderSerializer, CustomerSerializer, OrderSerializer, ProductSerializer, ProductSerializer2, CollectionSerializer, ReviewSerializer, UpdateCartItemSerializer
-from django.db.models.aggregates import Count
+from .models import ArchivedOrder, ArchivedOrderItem, Cart, CartItem, Customer, CustomerStats, DailyCollectionSales, DailyProductSales, DailySales, Order, OrderItem, Product, Collection, Review
+from .serializer import AddCartItemSerializer, ArchivedOrderSerializer, CartItemSerializer, CartSerializer, CollectionSalesSerializer, CreateOrderSerializer, CustomerSerializer, CustomerStatsSerializer, DailySalesSerializer, OrderSerializer, ProductSalesSerializer, ProductSerializer, ProductSerializer2, CollectionSerializer, ReviewSerializer, SalesRangeSerializer, UpdateCartItemSerializer
+from django.db.models.aggregates import Count, Sum
+from tags.models import TaggedItem
+from likes.models import LikeCounter, LikedItem
+from django.utils import timezone
+from datetime import timedelta
 
 # Create your views here.
 
@@ -154,7 +159,7 @@ class ProductViewSet(ModelViewSet):
     # collection__title is used to reference the title field in the collection class(related class)
     # so when we search we find any product that has the key search word
 
-    ordering_fields = ['unit_price', 'last_update']
+    ordering_fields = ['unit_price', 'last_update', 'like_count']
 
     # def get_queryset(self):
     #     # Product.objects.filter(collection_id=self.request.query_params['collection_id'])
@@ -174,16 +179,62 @@ class ProductViewSet(ModelViewSet):
     #         queryset = queryset.filter(collection_id=collection_id)
     #     return queryset
 
+    def get_queryset(self):
+        return Product.objects.annotate(
+            like_count=LikeCounter.objects.count_expression(Product),
+            liked_by_me=LikedItem.objects.liked_expression(Product, self.request.user))
+        # the like count of every product on the page comes with the products
+        # from the counters (check likes.models) instead of counting the likes
+        # and so does whether the user liked them, however big the page is
+
     def get_serializer_context(self):
         return {'request': self.request}
 
+    # POST /store/products/1/like/ to like a product, DELETE to unlike it
+    # liking twice or unliking something you haven't liked does nothing
+    @action(detail=True, methods=['POST', 'DELETE'], permission_classes=[IsAuthenticated])
+    def like(self, request, pk):
+        product = get_object_or_404(Product.objects.only('id'), pk=pk)
+        if request.method == 'POST':
+            LikedItem.objects.like(request.user, product)
+        else:
+            LikedItem.objects.unlike(request.user, product)
+        return Response({
+            'liked': request.method == 'POST',
+            'like_count': LikeCounter.objects.count_for(product),
+        })
+
+    # GET /store/products/suggest/?q=cok for the search box as the user types
+    # the titles come from an index in memory (check store.autocomplete), not the DB
+    @action(detail=False)
+    def suggest(self, request):
+        products = autocomplete.products.search(request.query_params.get('q', ''), limit=10)
+        return Response([{'id': id, 'title': title} for (id, title) in products])
+
+    # ?include=tags (or ?include=tags,other) to add related data to the products
+    def includes(self, name):
+        return name in self.request.query_params.get('include', '').split(',')
+
+    # the list action calls get_serializer with the products of the page (many=True)
+    # and the other actions with a single product, so this is where we know which
+    # products are going to be serialized and can load their tags in one query
+    def get_serializer(self, *args, **kwargs):
+        if args and args[0] is not None and self.includes('tags'):
+            products = args[0] if kwargs.get('many') else [args[0]]
+            kwargs.setdefault('context', self.get_serializer_context())
+            kwargs['context']['tags'] = TaggedItem.objects.get_tags_for_many(
+                Product, [product.id for product in products])
+        return super().get_serializer(*args, **kwargs)
+
     #earlier on we were overriding the delete mtd cus we were using RetrieveUpdateDestroyAPIView
     # now we are using ModelViewSet
     # in the RetrieveUpdateDestroyAPIView class delete mtd 
     # that simply delegate(returns) the destroy mtd
     # but then we combined the ProductList and ProductDetails class into a view set
     def destroy(self, request, *args, **kwargs):
-        if OrderItem.objects.filter(product_id=kwargs['pk']).count() > 0:
+        if OrderItem.objects.filter(product_id=kwargs['pk']).exists() \
+                or ArchivedOrderItem.objects.filter(product_id=kwargs['pk']).exists():
+            # archived order items still point to their product (check store.archive)
             return Response({'error': 'Product cannot be deleted because it is associated with an order item'},status=status.HTTP_405_METHOD_NOT_ALLOWED)
         return super().destroy(request, *args, **kwargs)
     # the destroy mtd is inbuilt into the DestroyModelMixin
@@ -440,6 +491,35 @@ class CartItemViewSet(ModelViewSet):
         # kwargs is keyword argument
         return CartItem.objects.filter(cart_id=self.kwargs['cart_pk']).select_related('product')
 
+# request.auth is the validated access token when the user authenticates with JWT
+# the claims in it are signed by the server so we can trust them
+# check core.serializers.TokenObtainPairSerializer
+def get_token_claim(request, claim, default=None):
+    if request.auth is None:
+        return default
+    return request.auth.get(claim, default)
+
+
+def get_customer_id(request):
+    customer_id = get_token_claim(request, 'customer_id')
+    if customer_id is None:
+        # tokens issued before we added the claim don't have it
+        # so we fall back to the DB for them
+        (customer, created) = Customer.objects.only('id').get_or_create(user_id=request.user.id)
+        customer_id = customer.id
+    return customer_id
+
+
+def get_existing_customer_id(request):
+    # for writes, the customer of the token may have been deleted since it was issued
+    # we check it's still there (one EXISTS on the primary key) and otherwise
+    # look it up by user like the me action does, a 404 if the user has no customer
+    customer_id = get_customer_id(request)
+    if Customer.objects.filter(pk=customer_id).exists():
+        return customer_id
+    return get_object_or_404(Customer.objects.only('id'), user_id=request.user.id).id
+
+
 # building the user profile api
 class CustomerViewSet(ModelViewSet):
     # class CustomerViewSet(CreateModelMixin, RetrieveModelMixin, UpdateModelMixin, GenericViewSet):
@@ -505,7 +585,11 @@ class CustomerViewSet(ModelViewSet):
         # if the user is not logged in it'l be set to an instance of the
         # AnonymousUser class else it's going to be a user object
 
-        (customer, created) = Customer.objects.get_or_create(user_id=request.user.id)
+        customer = Customer.objects.filter(pk=get_customer_id(request)).first() \
+            or get_object_or_404(Customer, user_id=request.user.id)
+        # the customer id comes from the token so we don't need get_or_create anymore
+        # if that customer was deleted since the token was issued we look it up by user
+        # (customer, created) = Customer.objects.get_or_create(user_id=request.user.id)
         # customer = Customer.objects.get(user_id=request.user.id)
         # we are using get_or_create instead of get just in case the user doesn't have an account
 
@@ -531,13 +615,32 @@ class CustomerViewSet(ModelViewSet):
     @action(detail=True, permission_classes=[ViewCustomerHistoryPermission])
     def history(self, request, pk):
         # pk cus it's for a particular customer
-        return Response('ok')
+        # return Response('ok')
+        # the stats of the customer and the orders of the customer, newest first
+        # ?archived=true returns the orders that were moved to the archive (check store.archive)
+        customer = get_object_or_404(Customer, pk=pk)
+        stats = CustomerStats.objects.filter(customer=customer).first() or CustomerStats(customer=customer)
+        # the stats are kept up to date by the outbox worker (check store.customer_stats)
+        # a customer that never placed an order doesn't have them yet
+        if request.query_params.get('archived') == 'true':
+            queryset = ArchivedOrder.objects.filter(customer_id=pk)
+            serializer_class = ArchivedOrderSerializer
+        else:
+            queryset = Order.objects.filter(customer_id=pk)
+            serializer_class = OrderSerializer
+        paginator = OrderCursorPagination()
+        page = paginator.paginate_queryset(
+            queryset.prefetch_related('items__product'), request, view=self)
+        response = paginator.get_paginated_response(serializer_class(page, many=True).data)
+        response.data['stats'] = CustomerStatsSerializer(stats).data
+        return response
 
 
 class OrderViewSet(ModelViewSet):
     
     # serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = OrderCursorPagination
 
     def get_serializer_class(self):
         if self.request.method == 'POST':
@@ -545,17 +648,94 @@ class OrderViewSet(ModelViewSet):
         return OrderSerializer
 
     def get_serializer_context(self):
-        return {'user_id': self.request.user.id}
+        if self.request.method == 'POST':
+            return {'customer_id': get_existing_customer_id(self.request)}
+            # an order for a deleted customer would fail on the foreign key with a 500
+        return {'customer_id': get_customer_id(self.request)}
 
     def get_queryset(self):
         user = self.request.user
+        queryset = Order.objects.prefetch_related('items__product')
+        # OrderSerializer renders the items of each order and the product of each item
+        # so we preload both, otherwise we'd send a query per order and per item
+        # with prefetch_related the number of queries stays the same however many orders we return
         if user.is_staff:
-            return Order.objects.all()
+            return queryset.all()
+            # request.user is loaded from the DB (or the short lived user cache) so a user
+            # that is no longer staff loses access right away, a claim in the token wouldn't
         
-        (customer_id, created) = Customer.objects.only('id').get_or_create(user_id=user.id)
+        # (customer_id, created) = Customer.objects.only('id').get_or_create(user_id=user.id)
         # using get_or_create in in the get_query mtd is in violation of the command query separation principle
         # cus we are not supposed to change the state of the system the get_queryset mtd
         # the get_queryset mtd is a query not a command
         # customer_id is the object we are working with
         # created is the boolean value that check if the object is created or not
-        return Order.objects.filter(customer_id=customer_id)
+        # now the customer is created when the user registers and its id is in the token
+        return queryset.filter(customer_id=get_customer_id(self.request))
+
+
+# orders that were moved to cold storage (check store.archive)
+# http://127.0.0.1:8000/store/archived-orders/
+# read only, customers only see their own orders like in OrderViewSet
+class ArchivedOrderViewSet(ReadOnlyModelViewSet):
+    serializer_class = ArchivedOrderSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = OrderCursorPagination
+
+    def get_queryset(self):
+        queryset = ArchivedOrder.objects.prefetch_related('items__product')
+        if self.request.user.is_staff:
+            return queryset.all()
+            # like OrderViewSet, from the user and not the token
+        return queryset.filter(customer_id=get_customer_id(self.request))
+
+
+# read only sales analytics for the admins
+# http://127.0.0.1:8000/store/analytics/daily/?start=2024-01-01&end=2024-01-31
+# http://127.0.0.1:8000/store/analytics/products/?start=2024-01-01&limit=10
+# http://127.0.0.1:8000/store/analytics/collections/
+# all of them read the rollup tables (check store.rollups) instead of aggregating
+# store_orderitem, so the cost depends on the number of days asked for, not on the number of orders
+class SalesAnalyticsViewSet(GenericViewSet):
+    permission_classes = [IsAdminUser]
+
+    def get_range(self):
+        serializer = SalesRangeSerializer(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        end = serializer.validated_data.get('end', timezone.now().date())
+        start = serializer.validated_data.get('start', end - timedelta(days=30))
+        # the last 30 days by default
+        return (start, end, serializer.validated_data['limit'])
+
+    def totals(self, queryset, *fields):
+        # adds up the daily rows of each product or collection in the range
+        # an order is only in one day so adding the daily order counts is correct
+        return queryset \
+            .values(*fields) \
+            .annotate(
+                order_count=Sum('order_count'),
+                quantity=Sum('quantity'),
+                revenue=Sum('revenue')) \
+            .order_by('-revenue')
+
+    @action(detail=False)
+    def daily(self, request):
+        (start, end, limit) = self.get_range()
+        queryset = DailySales.objects.filter(date__range=(start, end)).order_by('date')
+        return Response(DailySalesSerializer(queryset, many=True).data)
+
+    @action(detail=False)
+    def products(self, request):
+        (start, end, limit) = self.get_range()
+        queryset = self.totals(
+            DailyProductSales.objects.filter(date__range=(start, end)),
+            'product_id', 'product__title')[:limit]
+        return Response(ProductSalesSerializer(queryset, many=True).data)
+
+    @action(detail=False)
+    def collections(self, request):
+        (start, end, limit) = self.get_range()
+        queryset = self.totals(
+            DailyCollectionSales.objects.filter(date__range=(start, end)),
+            'collection_id', 'collection__title')[:limit]
+        return Response(CollectionSalesSerializer(queryset, many=True).data)
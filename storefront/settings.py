@@ -42,7 +42,6 @@ INSTALLED_APPS = [
     'rest_framework',
     'djoser',
     'playground',
-    'debug_toolbar',
     'store',
     'tags',
     'likes',
@@ -50,7 +49,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
+    'core.profiling.SamplingProfilerMiddleware',
+    'core.metrics.MetricsMiddleware',
+    'core.slow_queries.SlowQueryMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -60,6 +61,12 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# the debug toolbar traces every query and template of every request
+# which is way too slow outside of development, so it's only on with DEBUG
+if DEBUG:
+    INSTALLED_APPS.append('debug_toolbar')
+    MIDDLEWARE.insert(0, 'debug_toolbar.middleware.DebugToolbarMiddleware')
+
 INTERNAL_IPS = [
     # ...
     '127.0.0.1',
@@ -101,6 +108,21 @@ DATABASES = {
 }
 
 
+# the django cache is shared by all the processes (workers) of the site, the permission
+# cache (store.permissions), the autocomplete versions (store.autocomplete) and the admin
+# counts (store.pagination) have to be invalidated in every worker, not only the one that
+# changed something. the default cache (LocMemCache) lives in the memory of each process.
+# redis keeps it in memory (a read doesn't cost a DB query) and its incr is atomic, so two
+# workers bumping a version at the same time get two different numbers
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379/1',
+        'TIMEOUT': 300,
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -146,14 +168,38 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'COERCE_DECIMAL_TO_STRING': False,
+    'DEFAULT_RENDERER_CLASSES': (
+        'core.renderers.FastJSONRenderer',
+        # JSONRenderer with orjson, check core.renderers
+        'core.renderers.MessagePackRenderer',
+        # only for clients that send Accept: application/msgpack
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+        'core.parsers.MessagePackParser',
+    ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'core.authentication.CachedJWTAuthentication',
+        # 'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
 }
 
+# CachedJWTAuthentication keeps decoded tokens and users in memory
+# so we don't decode the same token and load the same user on every request
+JWT_AUTH_CACHE = {
+    'TOKEN_CACHE_SIZE': 10000,
+    'USER_CACHE_SIZE': 10000,
+    'USER_CACHE_TTL': 60,
+    # seconds a user stays in the cache of a process that didn't save it
+}
+
 SIMPLE_JWT = {
    'AUTH_HEADER_TYPES': ('JWT',),
    "ACCESS_TOKEN_LIFETIME": timedelta(days=1),
+   'TOKEN_OBTAIN_SERIALIZER': 'core.serializers.TokenObtainPairSerializer',
 }
 
 AUTH_USER_MODEL = 'core.User'
@@ -163,4 +209,66 @@ DJOSER = {
         'user_create': 'core.serializers.UserCreateSerializer',
         'current_user': 'core.serializers.UserSerializer',
     }
-}
\ No newline at end of file
+}
+
+# the outbox worker (python manage.py run_outbox), check store.outbox
+OUTBOX = {
+    'BATCH_SIZE': 100,
+    'MAX_ATTEMPTS': 5,
+    'LEASE_SECONDS': 300,
+    'RETRY_DELAY_SECONDS': 10,
+    'RETENTION_DAYS': 7,
+}
+
+# the order confirmation emails sent by the outbox worker are printed to the console
+EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+
+# the paginator of the big admin changelists, check store.pagination.EstimatedCountPaginator
+ADMIN_PAGINATOR = {
+    'EXACT_COUNT_THRESHOLD': 100000,
+    # tables the DB thinks are smaller than this are counted exactly
+    'COUNT_CACHE_SECONDS': 60,
+    # how long the count of a filtered changelist is reused
+}
+
+# changelists using store.admin_mixins.AutoRelatedMixin log their number of queries
+ADMIN_QUERY_DEBUG = DEBUG
+
+# how many rows core.streaming reads from the DB at a time for big reads and exports
+STREAMING_FETCH_SIZE = 2000
+
+# the sampling profiler we can leave on in production (check core.profiling)
+# a fraction of the requests of every url name is profiled, the stacks are at /profiles/
+SAMPLING_PROFILER = {
+    'ENABLED': True,
+    'DEFAULT_RATE': 0.01,
+    'RATES': {
+        # 'products-list': 0.1,
+    },
+    'INTERVAL': 0.005,
+    'FLUSH_SECONDS': 30,
+    'OUTPUT_DIR': BASE_DIR / 'profiles',
+    'MAX_STACKS': 5000,
+    # the most common stacks kept per url name and process
+}
+
+# per route request, latency and DB query metrics for prometheus at /metrics/ (check core.metrics)
+METRICS = {
+    'ENABLED': True,
+    'MULTIPROCESS_DIR': None,
+    # a directory shared by the workers when there is more than one process
+    'FLUSH_SECONDS': 15,
+}
+
+# the fingerprints, timings and EXPLAINs of the queries (check core.slow_queries)
+# python manage.py slow_queries or /slow-queries/
+SLOW_QUERIES = {
+    'ENABLED': True,
+    'THRESHOLD_MS': 100,
+    # slower queries get an EXPLAIN and the view/serializer that ran them
+    'MAX_FINGERPRINTS': 500,
+    'FLUSH_SECONDS': 30,
+    'OUTPUT_DIR': BASE_DIR / 'slow_queries',
+    'RECORD_PARAMS': False,
+    # True keeps the values of the slow queries, they can be session keys or emails
+}
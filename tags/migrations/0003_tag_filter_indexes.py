@@ -0,0 +1,22 @@
+# Generated by Django 4.2.8 on 2026-10-19 17:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tags', '0002_taggeditem_object_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tag',
+            name='label',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='taggeditem',
+            index=models.Index(fields=['content_type', 'tag', 'object_id'], name='tags_tagged_content_7b6d69_idx'),
+        ),
+    ]
@@ -14,9 +14,24 @@ class TaggedItemManager(models.Manager):
                 object_id=obj_id
             )
 
+    # the tags of many objects of the same model in one query
+    # e.g get_tags_for_many(Product, [1, 2, 3]) returns {1: [<Tag>, ...], 2: [], 3: [...]}
+    # instead of calling get_tags_for for every product on a page
+    def get_tags_for_many(self, model, ids):
+        content_type = ContentType.objects.get_for_model(model)
+        # get_for_model caches the content types so this doesn't go to the DB after the first time
+        tags = {object_id: [] for object_id in ids}
+        items = TaggedItem.objects \
+            .select_related('tag') \
+            .filter(content_type=content_type, object_id__in=ids)
+        for item in items:
+            tags[item.object_id].append(item.tag)
+        return tags
+
 
 class Tag(models.Model):
-    label = models.CharField(max_length=255)
+    label = models.CharField(max_length=255, db_index=True)
+    # indexed cus we filter products by tag label e.g /store/products/?tag=red
 
     def __str__(self) -> str:
         return self.label
@@ -28,3 +43,12 @@ class TaggedItem(models.Model):
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['content_type', 'object_id']),
+            models.Index(fields=['content_type', 'tag', 'object_id'])
+        ]
+        # we look up tagged items by the type and id of the object together
+        # and the other way around, the objects of a type that have a tag
+        # (content_type, tag, object_id) lets the DB answer the second one from the index alone